@@ -0,0 +1,33 @@
+"""
+Move the messages of idle chat sessions into compressed cold storage
+
+    python archive_sessions.py --idle-days 30
+
+Run it periodically (e.g. from cron). Archived sessions stay listed and
+readable; a new message moves a session's messages back to the hot table.
+"""
+from dotenv import load_dotenv
+
+# Load .env before importing modules that read their configuration at import time
+load_dotenv()
+
+import json
+import asyncio
+import argparse
+from service.archive_service import ARCHIVE_BATCH_SIZE, ARCHIVE_IDLE_DAYS, archive_idle_sessions
+
+
+async def _run_cli(args: argparse.Namespace) -> None:
+    totals = await archive_idle_sessions(idle_days=args.idle_days, max_sessions=args.max_sessions, batch_size=args.batch_size)
+    if totals["raw_bytes"]:
+        totals["compression_ratio"] = round(totals["raw_bytes"] / totals["compressed_bytes"], 2)
+    print(json.dumps(totals))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive idle chat sessions")
+    parser.add_argument("--idle-days", type=float, default=ARCHIVE_IDLE_DAYS, help="Archive sessions with no message for this many days")
+    parser.add_argument("--max-sessions", type=int, default=None, help="Stop after archiving this many sessions")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE, help="Sessions archived per transaction")
+
+    asyncio.run(_run_cli(parser.parse_args()))
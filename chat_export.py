@@ -0,0 +1,63 @@
+"""
+Export or import chat sessions as NDJSON from the command line
+
+    python chat_export.py export --user-id user123 --gzip --output chats.ndjson.gz
+    python chat_export.py import --input chats.ndjson.gz
+"""
+from dotenv import load_dotenv
+
+# Load .env before importing modules that read their configuration at import time
+load_dotenv()
+
+import sys
+import json
+import asyncio
+import argparse
+from typing import AsyncIterator
+from service.export_service import export_sessions, import_sessions, gzip_stream, gunzip_stream
+
+
+async def _read_file(path: str) -> AsyncIterator[bytes]:
+    """Read a file in chunks; stdin when path is '-'"""
+    stream = sys.stdin.buffer if path == "-" else open(path, "rb")
+    try:
+        while True:
+            chunk = stream.read(1024 * 1024)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+
+
+async def _run_cli(args: argparse.Namespace) -> None:
+    if args.command == "export":
+        output = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+        lines = export_sessions(user_id=args.user_id)
+        chunks = gzip_stream(lines) if args.gzip else (line.encode() async for line in lines)
+        try:
+            async for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+    else:
+        chunks = _read_file(args.input)
+        if args.gzip or args.input.endswith(".gz"):
+            chunks = gunzip_stream(chunks)
+        print(json.dumps(await import_sessions(chunks)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export or import chat sessions as NDJSON")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="Write sessions and messages as NDJSON")
+    export_parser.add_argument("--user-id", default=None, help="Only export this user's sessions")
+    export_parser.add_argument("--output", default="-", help="Output file (default: stdout)")
+    export_parser.add_argument("--gzip", action="store_true", help="Gzip-compress the output")
+    import_parser = commands.add_parser("import", help="Load an NDJSON export")
+    import_parser.add_argument("--input", default="-", help="Input file (default: stdin); .gz files are decompressed")
+    import_parser.add_argument("--gzip", action="store_true", help="Input is gzip-compressed")
+
+    asyncio.run(_run_cli(parser.parse_args()))
@@ -1,7 +1,17 @@
-from fastapi import APIRouter, HTTPException
+import json
+import logging
+from fastapi import APIRouter, HTTPException, Depends, Query, Response, Header
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from typing import Optional
-from service.chatbot_service import process_chat_message, get_chat_history, get_all_sessions
+from typing import Optional, Dict, Any, AsyncIterator, List
+from sqlalchemy.ext.asyncio import AsyncSession
+from service.chatbot_service import process_chat_message, process_idempotent_chat_message, get_chat_history, get_all_sessions, prepare_chat_stream, stream_chat_message, search_chat_history
+from service.batch_service import BATCH_MAX_ITEMS, BATCH_PARALLEL_CAP, process_chat_batch
+from service.session_coordinator import IdempotencyConflictError
+from service.usage_service import QuotaExceededError, get_user_usage
+from utilities.concurrency_limiter import LoadShedError
+from utilities.database import get_async_db
+from utilities.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, InvalidCursorError
 
 
 # Request/Response models
@@ -20,8 +30,15 @@ class ChatRequest(BaseModel):
             }
         }
     
+class BatchChatRequest(BaseModel):
+    """Request model for batch chat endpoint"""
+    requests: List[ChatRequest] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS, description="Chat turns to process")
+    max_parallel: Optional[int] = Field(None, ge=1, le=BATCH_PARALLEL_CAP, description="Maximum number of turns generated concurrently")
+
 class GetSessionsRequest(BaseModel):
     user_id: str
+    limit: int = Field(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of sessions to return")
+    cursor: Optional[str] = Field(None, description="Continuation token from the previous page")
 
 
 class ChatResponse(BaseModel):
@@ -39,7 +56,8 @@ class ChatResponse(BaseModel):
                     {
                         "message_id": 1,
                         "question": "Hello, how are you?",
-                        "answer": "I'm doing well, thank you! How can I help you today?"
+                        "answer": "I'm doing well, thank you! How can I help you today?",
+                        "prompt_version": 1
                     }
                 ],
                 "timestamp": "2026-01-06T16:30:00"
@@ -52,6 +70,37 @@ class AllChatsResponse(BaseModel):
     session_name: str
     created_at: str
     updated_at: str
+    message_count: int = 0
+    last_message_at: Optional[str] = None
+    last_message_preview: Optional[str] = None
+
+class SearchResult(BaseModel):
+    """One message matching a search"""
+    message_id: int
+    session_id: int
+    session_name: Optional[str] = None
+    question: str
+    snippet: str
+    timestamp: Optional[str] = None
+
+class SearchResponse(BaseModel):
+    """Response model for chat history search"""
+    results: List[SearchResult]
+    next_cursor: Optional[str] = None
+
+class UsageDay(BaseModel):
+    """A user's token usage on one UTC day"""
+    day: str
+    prompt_tokens: int
+    completion_tokens: int
+    requests: int
+
+class UsageResponse(BaseModel):
+    """Response model for a user's token usage"""
+    user_id: str
+    daily_quota: Optional[int] = None
+    used_today: int
+    days: List[UsageDay]
 
 class SessionHistoryResponse(BaseModel):
     """Response model for session history"""
@@ -59,31 +108,109 @@ class SessionHistoryResponse(BaseModel):
     session_name: str
     created_at: str
     messages: list
+    next_cursor: Optional[str] = None
+
 
+logger = logging.getLogger(__name__)
 
 # Create router
 router = APIRouter(prefix="/api", tags=["Chatbot"])
 
 @router.post("/chat", response_model=ChatResponse, status_code=200)
-async def chat(request: ChatRequest):
+async def chat(
+    request: ChatRequest,
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
     """
     Main chatbot endpoint - Send a message and receive AI response
     
     - **message**: The user's message (required)
     - **session_id**: Optional session ID to continue existing conversation
     - **user_id**: Optional user identifier for tracking
+    - **Idempotency-Key** header: Optional; retries and double-submits with the
+      same key share one AI call and one stored message
     
     Returns the AI's response along with session information
     """
     try:
-        result = process_chat_message(
+        if idempotency_key:
+            result = await process_idempotent_chat_message(
+                idempotency_key,
+                user_message=request.message,
+                session_id=request.session_id,
+                user_id=request.user_id
+            )
+        else:
+            result = await process_chat_message(
+                db,
+                user_message=request.message,
+                session_id=request.session_id,
+                user_id=request.user_id
+            )
+        
+        return ChatResponse(**result)
+    
+    except LoadShedError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(int(e.retry_after))}
+        )
+    except QuotaExceededError as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(int(e.retry_after))}
+        )
+    except IdempotencyConflictError as e:
+        raise HTTPException(
+            status_code=409,
+            detail=str(e)
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=404,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occurred: {str(e)}"
+        )
+
+
+async def _format_sse(events: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    """Encode service events as Server-Sent Events frames"""
+    async for event in events:
+        yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+@router.post("/chat/stream", status_code=200)
+async def chat_stream(request: ChatRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    Streaming chatbot endpoint - Send a message and receive the AI response as Server-Sent Events
+    
+    - **message**: The user's message (required)
+    - **session_id**: Optional session ID to continue existing conversation
+    - **user_id**: Optional user identifier for tracking
+    
+    Emits a `session` event, one `token` event per content delta and a final
+    `done` event once the answer has been saved (or `error` on failure)
+    """
+    try:
+        session, conversation_history = await prepare_chat_stream(
+            db,
             user_message=request.message,
             session_id=request.session_id,
             user_id=request.user_id
         )
-        
-        return ChatResponse(**result)
-    
+    except QuotaExceededError as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(int(e.retry_after))}
+        )
     except ValueError as e:
         raise HTTPException(
             status_code=404,
@@ -95,21 +222,67 @@ async def chat(request: ChatRequest):
             detail=f"An error occurred: {str(e)}"
         )
 
+    return StreamingResponse(
+        _format_sse(stream_chat_message(session, conversation_history, request.message, new_session=not request.session_id)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def _format_ndjson(results: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    """Encode service results as newline-delimited JSON"""
+    async for result in results:
+        yield json.dumps(result) + "\n"
+
+
+@router.post("/chat/batch", status_code=200)
+async def chat_batch(request: BatchChatRequest):
+    """
+    Batch chatbot endpoint - Process many chat turns in one request
+    
+    - **requests**: List of chat requests (same fields as `/api/chat`)
+    - **max_parallel**: Optional cap on concurrently generated turns
+    
+    Turns on different sessions run concurrently; turns on the same session
+    run in the order given. Streams one JSON line per turn as it finishes,
+    carrying its `index` in the request list and `status` `ok` or `error`
+    """
+    return StreamingResponse(
+        _format_ndjson(process_chat_batch(
+            [item.model_dump() for item in request.requests],
+            max_parallel=request.max_parallel
+        )),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"}
+    )
+
 
 @router.get("/session/{session_id}", response_model=SessionHistoryResponse)
-async def get_session_history(session_id: int):
+async def get_session_history(
+    session_id: int,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
     """
-    Get complete conversation history for a session
+    Get conversation history for a session, one page at a time
     
     - **session_id**: The session ID to retrieve
+    - **limit**: Maximum number of messages per page
+    - **cursor**: `next_cursor` from the previous page
     
-    Returns session information and all messages
+    Returns session information and the next page of messages, oldest first
     """
     try:
-        history = await get_chat_history(session_id)
-        print(history)
+        history = await get_chat_history(db, session_id, limit=limit, cursor=cursor)
+        logger.debug("session.history", extra={"session_id": session_id, "messages": len(history["messages"])})
         return history
     
+    except InvalidCursorError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
     except ValueError as e:
         raise HTTPException(
             status_code=404,
@@ -122,13 +295,29 @@ async def get_session_history(session_id: int):
         )
 
 @router.post("/sessions", response_model=list[dict])
-async def get_all_chats(request: GetSessionsRequest):
+async def get_all_chats(request: GetSessionsRequest, response: Response, db: AsyncSession = Depends(get_async_db)):
+    """
+    Get a user's sessions, most recently updated first, one page at a time
+    
+    - **user_id**: The user identifier
+    - **limit**: Maximum number of sessions per page
+    - **cursor**: Value of the `X-Next-Cursor` header from the previous page
+    
+    The continuation token for the next page is returned in the
+    `X-Next-Cursor` response header (absent on the last page)
+    """
     try:
-        print(request.user_id)
-        result = await get_all_sessions(user_id=request.user_id)
-        print(result)
-        return result
+        result = await get_all_sessions(db, user_id=request.user_id, limit=request.limit, cursor=request.cursor)
+        logger.debug("sessions.listed", extra={"user_id": request.user_id, "sessions": len(result["sessions"])})
+        if result["next_cursor"]:
+            response.headers["X-Next-Cursor"] = result["next_cursor"]
+        return result["sessions"]
 
+    except InvalidCursorError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
     except ValueError as e:
         raise HTTPException(
             status_code=404,
@@ -138,4 +327,61 @@ async def get_all_chats(request: GetSessionsRequest):
         raise HTTPException(
             status_code=500,
             detail=f"An error occurred: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+
+@router.get("/search", response_model=SearchResponse)
+async def search_chats(
+    user_id: str,
+    q: str = Query(..., min_length=1, max_length=500),
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Full-text search over a user's questions and answers
+    
+    - **user_id**: The user identifier
+    - **q**: Search terms (Postgres also accepts "quoted phrases", OR and -exclusions)
+    - **limit**: Maximum number of results per page
+    - **cursor**: `next_cursor` from the previous page
+    
+    Returns matches best first, each with a snippet highlighting the terms in `<b>` tags
+    """
+    try:
+        return await search_chat_history(db, user_id=user_id, query=q, limit=limit, cursor=cursor)
+
+    except InvalidCursorError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occurred: {str(e)}"
+        )
+
+
+@router.get("/usage", response_model=UsageResponse)
+async def get_usage(
+    user_id: str,
+    days: int = Query(30, ge=1, le=366),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Get a user's LLM token usage per UTC day and their daily quota
+    
+    - **user_id**: The user identifier
+    - **days**: Number of days to report, including today
+    
+    `used_today` is live; the per-day rows trail it by up to one flush interval
+    """
+    try:
+        return await get_user_usage(db, user_id=user_id, days=days)
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occurred: {str(e)}"
+        )
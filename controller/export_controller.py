@@ -0,0 +1,59 @@
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Header, Request
+from fastapi.responses import StreamingResponse
+from service.export_service import ImportFormatError, export_sessions, import_sessions, gzip_stream, gunzip_stream
+
+
+# Create router
+router = APIRouter(prefix="/api", tags=["Export"])
+
+
+@router.get("/export")
+async def export_chats(
+    user_id: Optional[str] = None,
+    accept_encoding: Optional[str] = Header(None, alias="Accept-Encoding")
+):
+    """
+    Export sessions and their messages as NDJSON
+    
+    - **user_id**: Optional; only export this user's sessions
+    
+    Streams a `session` line followed by its `message` lines for every
+    session, in constant memory. Gzip-compressed when the client accepts it.
+    """
+    lines = export_sessions(user_id=user_id)
+    headers = {"Content-Disposition": 'attachment; filename="chats.ndjson"'}
+    if accept_encoding and "gzip" in accept_encoding.lower():
+        headers["Content-Encoding"] = "gzip"
+        return StreamingResponse(gzip_stream(lines), media_type="application/x-ndjson", headers=headers)
+    return StreamingResponse(lines, media_type="application/x-ndjson", headers=headers)
+
+
+@router.post("/import")
+async def import_chats(
+    request: Request,
+    content_encoding: Optional[str] = Header(None, alias="Content-Encoding")
+):
+    """
+    Import an NDJSON export produced by `/api/export`
+    
+    The body is read as a stream (gzip if sent with `Content-Encoding: gzip`)
+    and written in batches. Sessions get new IDs.
+    
+    Returns the number of sessions and messages imported
+    """
+    chunks = request.stream()
+    if content_encoding and content_encoding.lower() == "gzip":
+        chunks = gunzip_stream(chunks)
+    try:
+        return await import_sessions(chunks)
+    except ImportFormatError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occurred: {str(e)}"
+        )
@@ -0,0 +1,67 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from service.prompt_service import load_prompts, publish_prompt, pin_prompt
+from utilities.prompt_registry import list_active
+
+
+class PublishPromptRequest(BaseModel):
+    """Request model for publishing a prompt version"""
+    prompt_type: str = Field(..., description="Prompt type, e.g. 'system' or 'summary'", min_length=1)
+    prompt_text: str = Field(..., description="Template text; ${name} placeholders are allowed", min_length=1)
+
+
+# Create router
+router = APIRouter(prefix="/api/prompts", tags=["Prompts"])
+
+
+@router.get("", response_model=list[dict])
+async def get_active_prompts():
+    """List the active version of every prompt type"""
+    return list_active()
+
+
+@router.post("", response_model=dict, status_code=201)
+async def create_prompt_version(request: PublishPromptRequest):
+    """
+    Publish a new prompt version and pin it as active
+    
+    - **prompt_type**: The prompt type to version
+    - **prompt_text**: The template text
+    """
+    try:
+        return await run_in_threadpool(publish_prompt, request.prompt_type, request.prompt_text)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occurred: {str(e)}"
+        )
+
+
+@router.post("/{prompt_id}/activate", response_model=dict)
+async def activate_prompt_version(prompt_id: int):
+    """Pin an existing prompt version, e.g. to roll back"""
+    try:
+        return await run_in_threadpool(pin_prompt, prompt_id)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=404,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occurred: {str(e)}"
+        )
+
+
+@router.post("/reload", response_model=list[dict])
+async def reload_prompts():
+    """Reload pinned prompt versions from the database now instead of waiting for the periodic refresh"""
+    try:
+        return await run_in_threadpool(load_prompts)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occurred: {str(e)}"
+        )
@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+from dataclasses import dataclass, field
+from typing import List, Optional, AsyncIterator
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+
+# Vocabulary the fake answers are drawn from; one word is one token
+WORDS = (
+    "the a brain box answer question model token latency cache session user "
+    "pool request stream service data fast slow simple helpful result"
+).split()
+
+
+@dataclass
+class FakeProviderConfig:
+    """Behaviour of the stand-in provider, all tunable from the environment"""
+    latency_ms: float = float(os.getenv("FAKE_LLM_LATENCY_MS", "300"))  # median time to first token
+    latency_sigma: float = float(os.getenv("FAKE_LLM_LATENCY_SIGMA", "0.5"))  # lognormal spread, 0 = fixed
+    tokens_per_second: float = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "80"))
+    response_tokens: int = int(os.getenv("FAKE_LLM_RESPONSE_TOKENS", "60"))
+    error_rate: float = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+    error_statuses: List[int] = field(
+        default_factory=lambda: [int(s) for s in os.getenv("FAKE_LLM_ERROR_STATUSES", "429,500,503").split(",")]
+    )
+    seed: Optional[int] = None
+
+
+def _first_token_delay(config: FakeProviderConfig, rng: random.Random) -> float:
+    """Sample the time to first token in seconds"""
+    median = config.latency_ms / 1000
+    if config.latency_sigma <= 0:
+        return median
+    return rng.lognormvariate(0, config.latency_sigma) * median
+
+
+def _error_response(status: int) -> JSONResponse:
+    headers = {"Retry-After": "1"} if status == 429 else None
+    return JSONResponse(
+        status_code=status,
+        content={"error": {"message": f"Injected error {status}", "type": "fake_provider_error", "code": status}},
+        headers=headers,
+    )
+
+
+def create_app(config: Optional[FakeProviderConfig] = None) -> FastAPI:
+    """
+    Build an OpenAI-compatible app serving POST /v1/chat/completions
+    
+    Answers are random words, produced after a lognormal time to first token
+    and then at a fixed token rate; streamed requests get SSE chunks in the
+    OpenAI format. A configurable share of requests fails with an injected
+    status code instead.
+    """
+    config = config or FakeProviderConfig()
+    rng = random.Random(config.seed)
+    app = FastAPI(title="Fake LLM provider")
+    app.state.config = config
+    app.state.stats = {"requests": 0, "streams": 0, "errors": 0}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats = app.state.stats
+        stats["requests"] += 1
+
+        if config.error_rate and rng.random() < config.error_rate:
+            stats["errors"] += 1
+            return _error_response(rng.choice(config.error_statuses))
+
+        completion_id = f"chatcmpl-fake-{stats['requests']}"
+        created = int(time.time())
+        model = body.get("model") or "fake-model"
+        tokens = [rng.choice(WORDS) for _ in range(config.response_tokens)]
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages", []))
+        token_interval = 1 / config.tokens_per_second if config.tokens_per_second > 0 else 0
+
+        await asyncio.sleep(_first_token_delay(config, rng))
+
+        if not body.get("stream"):
+            await asyncio.sleep(token_interval * len(tokens))
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(tokens),
+                    "total_tokens": prompt_tokens + len(tokens),
+                },
+            }
+
+        stats["streams"] += 1
+
+        def chunk(delta: dict, finish_reason: Optional[str] = None) -> str:
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return f"data: {json.dumps(data)}\n\n"
+
+        async def events() -> AsyncIterator[str]:
+            yield chunk({"role": "assistant", "content": ""})
+            for index, token in enumerate(tokens):
+                yield chunk({"content": token if index == 0 else " " + token})
+                await asyncio.sleep(token_interval)
+            yield chunk({}, "stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens), "total_tokens": prompt_tokens + len(tokens)}
+                yield f"data: {json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model, 'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def get_stats():
+        return app.state.stats
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the fake OpenAI-compatible provider")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,296 @@
+"""
+Offline load test for the Brainbox API
+
+Starts the fake OpenAI-compatible provider and the FastAPI app in-process,
+drives /api/chat and /api/chat/stream with concurrent virtual users and
+reports latency percentiles, throughput, errors and DB pool saturation.
+Runs against SQLite (default, needs aiosqlite) or Postgres via --database-url,
+with no network access. Gate options make it exit non-zero on regressions:
+
+    python -m loadtest.run --requests 1000 --concurrency 50 --max-p95-ms 900
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+from typing import List, Dict, Any, Optional
+import httpx
+import uvicorn
+from loadtest.fake_provider import FakeProviderConfig, create_app
+
+
+def _parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline load test for the Brainbox API")
+    parser.add_argument("--requests", type=int, default=500, help="Total requests to send")
+    parser.add_argument("--duration", type=float, default=None, help="Stop after this many seconds instead")
+    parser.add_argument("--concurrency", type=int, default=20, help="Number of virtual users")
+    parser.add_argument("--stream-ratio", type=float, default=0.2, help="Share of turns sent to /api/chat/stream")
+    parser.add_argument("--new-session-ratio", type=float, default=0.2, help="Share of turns that start a new session")
+    parser.add_argument("--database-url", default=None, help="Sync SQLAlchemy URL (default: temporary SQLite file)")
+    parser.add_argument("--target", default=None, help="Drive an already running API at this URL instead")
+    parser.add_argument("--llm-url", default=None, help="Use this OpenAI-compatible base URL instead of the fake provider")
+    parser.add_argument("--llm-latency-ms", type=float, default=None, help="Median time to first token")
+    parser.add_argument("--llm-latency-sigma", type=float, default=None, help="Lognormal spread of the first token latency")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=None)
+    parser.add_argument("--llm-response-tokens", type=int, default=None)
+    parser.add_argument("--llm-error-rate", type=float, default=None, help="Share of provider calls failing with 429/5xx")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write the report to this file")
+    parser.add_argument("--max-p95-ms", type=float, default=None)
+    parser.add_argument("--max-p99-ms", type=float, default=None)
+    parser.add_argument("--max-error-rate", type=float, default=None)
+    parser.add_argument("--min-throughput", type=float, default=None, help="Minimum requests per second")
+    return parser.parse_args(argv)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _async_url(url: str) -> str:
+    """Derive the async driver URL from a sync SQLAlchemy URL"""
+    for prefix, async_prefix in (("postgresql://", "postgresql+asyncpg://"), ("sqlite://", "sqlite+aiosqlite://")):
+        if url.startswith(prefix):
+            return async_prefix + url[len(prefix):]
+    return url
+
+
+def _serve(app, port: int) -> uvicorn.Server:
+    """Run an ASGI app with uvicorn on a background thread and wait until it accepts requests"""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError(f"Server on port {port} failed to start")
+        time.sleep(0.02)
+    server.thread = thread
+    return server
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def _summarize(latencies: List[float]) -> Dict[str, Any]:
+    return {
+        "count": len(latencies),
+        "p50_ms": _ms(_percentile(latencies, 50)),
+        "p95_ms": _ms(_percentile(latencies, 95)),
+        "p99_ms": _ms(_percentile(latencies, 99)),
+        "max_ms": _ms(max(latencies) if latencies else None),
+    }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+class PoolSampler:
+    """Samples checked-out connections of the app's async engine pool"""
+
+    def __init__(self, pool, interval: float = 0.01):
+        self.pool = pool
+        self.interval = interval
+        self.samples: List[int] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.samples.append(self.pool.checkedout())
+            time.sleep(self.interval)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> Dict[str, Any]:
+        self._stop.set()
+        self._thread.join()
+        samples = self.samples or [0]
+        report = {
+            "pool": type(self.pool).__name__,
+            "max_checked_out": max(samples),
+            "mean_checked_out": round(sum(samples) / len(samples), 2),
+        }
+        # Only queue pools have a bounded capacity that can saturate
+        if hasattr(self.pool, "size"):
+            capacity = self.pool.size() + max(getattr(self.pool, "_max_overflow", 0), 0)
+            report["pool_size"] = self.pool.size()
+            report["capacity"] = capacity
+            report["saturated_pct"] = round(100 * sum(1 for s in samples if s >= capacity) / len(samples), 1)
+        return report
+
+
+async def _drive(base_url: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """Run the virtual users and collect per-request results"""
+    rng = random.Random(args.seed)
+    results: List[Dict[str, Any]] = []
+    deadline = time.monotonic() + args.duration if args.duration else None
+    remaining = [args.requests]
+
+    def take() -> bool:
+        if deadline is not None:
+            return time.monotonic() < deadline
+        if remaining[0] <= 0:
+            return False
+        remaining[0] -= 1
+        return True
+
+    async def turn(client: httpx.AsyncClient, user: int, session_id: Optional[int]) -> Optional[int]:
+        stream = rng.random() < args.stream_ratio
+        payload = {"message": f"Load test question {len(results)} from user {user}", "session_id": session_id, "user_id": f"load-{user}"}
+        result = {"endpoint": "stream" if stream else "chat", "new_session": session_id is None}
+        started = time.monotonic()
+        try:
+            if stream:
+                async with client.stream("POST", "/api/chat/stream", json=payload) as response:
+                    result["status"] = response.status_code
+                    event = None
+                    async for line in response.aiter_lines():
+                        if line.startswith("event: "):
+                            event = line[len("event: "):]
+                        elif line.startswith("data: "):
+                            if event == "token" and "ttft" not in result:
+                                result["ttft"] = time.monotonic() - started
+                            elif event == "session":
+                                session_id = json.loads(line[len("data: "):]).get("session_id", session_id)
+                            elif event == "error":
+                                result["status"] = "stream_error"
+            else:
+                response = await client.post("/api/chat", json=payload)
+                result["status"] = response.status_code
+                if response.status_code == 200:
+                    session_id = response.json()["session_id"]
+        except httpx.HTTPError as e:
+            result["status"] = type(e).__name__
+        result["latency"] = time.monotonic() - started
+        results.append(result)
+        return session_id
+
+    async def user(client: httpx.AsyncClient, index: int) -> None:
+        session_id = None
+        while take():
+            if session_id is not None and rng.random() < args.new_session_ratio:
+                session_id = None
+            session_id = await turn(client, index, session_id)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        started = time.monotonic()
+        await asyncio.gather(*(user(client, index) for index in range(args.concurrency)))
+        elapsed = time.monotonic() - started
+
+    ok = [r for r in results if r["status"] == 200]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if r["status"] != 200:
+            errors[str(r["status"])] = errors.get(str(r["status"]), 0) + 1
+    return {
+        "requests": len(results),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(results) / elapsed, 1) if elapsed else 0,
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else 0,
+        "errors": errors,
+        "latency": _summarize([r["latency"] for r in ok]),
+        "chat_latency": _summarize([r["latency"] for r in ok if r["endpoint"] == "chat"]),
+        "stream_latency": _summarize([r["latency"] for r in ok if r["endpoint"] == "stream"]),
+        "stream_ttft": _summarize([r["ttft"] for r in ok if "ttft" in r]),
+    }
+
+
+def _check_gates(report: Dict[str, Any], args: argparse.Namespace) -> List[str]:
+    """Return a message per violated regression gate"""
+    failures = []
+    p95, p99 = report["latency"]["p95_ms"], report["latency"]["p99_ms"]
+    if args.max_p95_ms is not None and (p95 is None or p95 > args.max_p95_ms):
+        failures.append(f"p95 {p95} ms exceeds {args.max_p95_ms} ms")
+    if args.max_p99_ms is not None and (p99 is None or p99 > args.max_p99_ms):
+        failures.append(f"p99 {p99} ms exceeds {args.max_p99_ms} ms")
+    if args.max_error_rate is not None and report["error_rate"] > args.max_error_rate:
+        failures.append(f"error rate {report['error_rate']} exceeds {args.max_error_rate}")
+    if args.min_throughput is not None and report["throughput_rps"] < args.min_throughput:
+        failures.append(f"throughput {report['throughput_rps']} rps below {args.min_throughput} rps")
+    return failures
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = _parse_args(argv)
+    servers = []
+    sampler = None
+    report: Dict[str, Any] = {}
+
+    if args.target:
+        base_url = args.target
+    else:
+        # Point the app at the stand-in provider and a throwaway database
+        # before its modules read their configuration
+        if args.llm_url:
+            llm_url = args.llm_url
+        else:
+            config = FakeProviderConfig(seed=args.seed)
+            for name in ("latency_ms", "latency_sigma", "tokens_per_second", "response_tokens", "error_rate"):
+                value = getattr(args, f"llm_{name}")
+                if value is not None:
+                    setattr(config, name, value)
+            port = _free_port()
+            servers.append(_serve(create_app(config), port))
+            llm_url = f"http://127.0.0.1:{port}/v1/"
+            report["provider"] = vars(config)
+        database_url = args.database_url
+        if database_url is None:
+            path = os.path.join(tempfile.gettempdir(), "brainbox-loadtest.db")
+            if os.path.exists(path):
+                os.remove(path)
+            database_url = f"sqlite:///{path}"
+        os.environ["OPENAI_BASE_URL"] = llm_url
+        os.environ.setdefault("OPENAI_API_KEY", "loadtest")
+        os.environ.setdefault("OPENAI_MODEL", "fake-model")
+        os.environ["DATABASE_URL"] = database_url
+        os.environ["ASYNC_DATABASE_URL"] = _async_url(database_url)
+
+        import main as app_main
+        from utilities.database import async_engine
+        port = _free_port()
+        servers.append(_serve(app_main.app, port))
+        base_url = f"http://127.0.0.1:{port}"
+        report["database"] = async_engine.url.render_as_string(hide_password=True)
+        sampler = PoolSampler(async_engine.sync_engine.pool)
+        sampler.start()
+
+    try:
+        report.update(asyncio.run(_drive(base_url, args)))
+    finally:
+        if sampler is not None:
+            report["db_pool"] = sampler.stop()
+            from utilities.ai_client import get_client_stats, get_limiter_stats
+            report["llm_client"] = get_client_stats()
+            report["llm_limiter"] = get_limiter_stats()
+        for server in reversed(servers):
+            server.should_exit = True
+            server.thread.join(timeout=10)
+
+    failures = _check_gates(report, args)
+    report["gate_failures"] = failures
+    print(json.dumps(report, indent=2, default=str))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
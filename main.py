@@ -1,19 +1,65 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from dotenv import load_dotenv
+
+# Load .env before importing modules that read their configuration at import time
+load_dotenv()
+
+from utilities.logging_config import setup_logging, RequestIdMiddleware
+
+# Structured JSON logging through a background queue, before anything logs
+setup_logging()
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from controller.chatbot_controller import router as chatbot_router
+from controller.prompt_controller import router as prompt_router
+from controller.export_controller import router as export_router
 from utilities.database import init_db
+from utilities.ai_client import close_ai_client
+from service.error_service import flush_error_logs
+from service.usage_service import flush_usage
+from service.prompt_service import load_prompts, start_prompt_refresh, stop_prompt_refresh
+from utilities.metrics import MetricsMiddleware, render_metrics
+from utilities.profiler import ProfilerMiddleware
 import uvicorn
-from dotenv import load_dotenv
 
-load_dotenv()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application startup/shutdown hooks"""
+    # Create tables and apply pending schema migrations
+    init_db()
+    # Compile pinned prompt versions into the in-memory registry
+    load_prompts()
+    # Pick up versions published or pinned through other workers
+    start_prompt_refresh()
+    yield
+    stop_prompt_refresh()
+    # Release pooled upstream connections
+    await close_ai_client()
+    # Write out queued error logs
+    flush_error_logs()
+    # Write out token usage accumulated since the last flush
+    flush_usage()
+
 
 # Create FastAPI application
 app = FastAPI(
-    description="AI Chatbot API with conversation management"
+    description="AI Chatbot API with conversation management",
+    lifespan=lifespan
 )
 
+# Count and time every request for /metrics
+app.add_middleware(MetricsMiddleware)
+# SQL counts per request, slow-request log and opt-in profiling (inside the
+# request ID middleware, so reports carry the request's ID)
+app.add_middleware(ProfilerMiddleware)
+# Correlation ID for every request's log records (outermost, so it covers the others)
+app.add_middleware(RequestIdMiddleware)
+
 # Register routers
 app.include_router(chatbot_router)
+app.include_router(prompt_router)
+app.include_router(export_router)
 
 # Health check endpoint
 @app.get("/", tags=["Health"])
@@ -34,6 +80,17 @@ async def health_check():
     }
 
 
+
+@app.get("/metrics", tags=["Health"], response_class=PlainTextResponse)
+async def metrics():
+    """
+    Prometheus metrics: request counts and latency, chat stage latency, DB pool
+    and LLM client, limiter and provider series, cache, context builder,
+    chat turn coordination and background writer counters
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 if __name__ == "__main__":
 
     uvicorn.run(
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Date, DateTime, ForeignKey, Index, Boolean, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -9,50 +9,134 @@ Base = declarative_base()
 class ChatSession(Base):
     """Model for storing chat session information"""
     __tablename__ = "chat_sessions"
+    __table_args__ = (
+        # Session listing: filter by user_id, keyset-paginate by (updated_at, id) desc
+        Index("ix_chat_sessions_user_id_updated_at_id", "user_id", "updated_at", "id"),
+        # Archival: sessions not yet archived whose last message is older than a cutoff
+        Index("ix_chat_sessions_archived_at_last_message_at", "archived_at", "last_message_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     user_id = Column(String(100), nullable=True)
     session_name = Column(String(255), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Rolling summary of turns that no longer fit the context budget
+    summary = Column(Text, nullable=True)
+    summary_message_id = Column(Integer, nullable=True)  # Last message folded into summary
+    # Maintained with each new message so session listing needs no message lookups
+    message_count = Column(Integer, nullable=False, default=0)
+    last_message_at = Column(DateTime, nullable=True)
+    last_message_preview = Column(String(200), nullable=True)  # Truncated last answer
+    # Set while the session's messages live in chat_session_archives instead of chat_messages
+    archived_at = Column(DateTime, nullable=True)
     
     # Relationship with messages
     messages = relationship("ChatMessage", back_populates="session", cascade="all, delete-orphan")
+    archive = relationship("ChatSessionArchive", uselist=False, cascade="all, delete-orphan")
 
 
 
 class ChatMessage(Base):
     """Model for storing individual chat messages"""
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        # Recent history and full history: filter by session_id, keyset-paginate by (timestamp, id)
+        Index("ix_chat_messages_session_id_timestamp_id", "session_id", "timestamp", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     session_id = Column(Integer, ForeignKey("chat_sessions.id"), nullable=False)
+    # Copied from the session by the database on insert, so search can be scoped by the full-text index
+    user_id = Column(String(100), nullable=True)
     question = Column(Text, nullable=False)
     answer = Column(Text, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
+    prompt_version = Column(Integer, nullable=True)  # System prompt version used (0 = built-in)
+    # Upstream usage for the answer; NULL when it was served from cache or not reported
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+    llm_latency_ms = Column(Integer, nullable=True)
     
     # Relationship with session
     session = relationship("ChatSession", back_populates="messages")
 
 
+class ChatSessionArchive(Base):
+    """Cold storage for an idle session's messages, kept as one compressed blob"""
+    __tablename__ = "chat_session_archives"
+    
+    session_id = Column(Integer, ForeignKey("chat_sessions.id"), primary_key=True)
+    payload = Column(LargeBinary, nullable=False)  # zlib-compressed JSON list of messages
+    message_count = Column(Integer, nullable=False)
+    raw_bytes = Column(Integer, nullable=False)  # Size of the JSON before compression
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ArchivedMessageSearch(Base):
+    """Searchable text of archived messages, so archiving a session keeps it findable"""
+    __tablename__ = "archived_message_search"
+    
+    message_id = Column(Integer, primary_key=True, autoincrement=False)  # ID the message had in chat_messages
+    session_id = Column(Integer, ForeignKey("chat_sessions.id"), nullable=False, index=True)
+    user_id = Column(String(100), nullable=True)
+    question = Column(Text, nullable=False)
+    answer = Column(Text, nullable=False)
+    timestamp = Column(DateTime, nullable=True)
+
+
+class UserTokenUsage(Base):
+    """Model for per-user, per-day LLM token totals, written in batches by the usage ledger"""
+    __tablename__ = "user_token_usage"
+    
+    user_id = Column(String(100), primary_key=True)
+    day = Column(Date, primary_key=True)  # UTC
+    prompt_tokens = Column(BigInteger, nullable=False, default=0)
+    completion_tokens = Column(BigInteger, nullable=False, default=0)
+    requests = Column(Integer, nullable=False, default=0)
+
+
+class UserQuota(Base):
+    """Model for per-user daily token limits, overriding the configured default"""
+    __tablename__ = "user_quotas"
+    
+    user_id = Column(String(100), primary_key=True)
+    daily_tokens = Column(BigInteger, nullable=True)  # NULL = unlimited
+
+
 class ErrorLog(Base):
     """Model for storing application errors"""
     __tablename__ = "error_logs"
+    __table_args__ = (
+        # get_errors_by_type: filter by error_type, order by last_seen desc
+        Index("ix_error_logs_error_type_last_seen", "error_type", "last_seen"),
+    )
     
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     error_type = Column(String(100), nullable=False)
     error_message = Column(Text, nullable=False)
     stack_trace = Column(Text, nullable=True)
     timestamp = Column(DateTime, default=datetime.utcnow)
+    # Repeated errors collapse into one row per fingerprint (type + normalized trace)
+    fingerprint = Column(String(64), nullable=True, index=True)
+    occurrence_count = Column(Integer, nullable=False, default=1)
+    first_seen = Column(DateTime, default=datetime.utcnow)
+    last_seen = Column(DateTime, default=datetime.utcnow)
     
 
 
 class Prompt(Base):
     """Model for storing prompt templates and history"""
     __tablename__ = "prompts"
+    __table_args__ = (
+        # Concurrent publishers cannot store the same version twice
+        Index("uq_prompts_prompt_type_version", "prompt_type", "version", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     prompt_text = Column(Text, nullable=False)
     prompt_type = Column(String(100), nullable=True)  # e.g., 'system', 'template', 'user'
     created_at = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=True)  # Increments per prompt_type
+    is_active = Column(Boolean, nullable=False, default=False)  # Pinned version for its prompt_type
     
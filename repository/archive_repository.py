@@ -0,0 +1,141 @@
+import json
+import zlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from sqlalchemy import select, insert, delete, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import ChatSession, ChatMessage, ChatSessionArchive, ArchivedMessageSearch
+from utilities.database import on_commit, read_replica
+import repository.recent_turns_cache as recent_turns_cache
+
+# Idle sessions keep their chat_sessions row (with its message stats), but
+# their messages move out of chat_messages into one compressed blob in
+# chat_session_archives, so the hot table and its indexes only hold recent
+# conversations. Messages keep their IDs so cursors and summaries stay valid.
+# Their question and answer text also moves to archived_message_search, which
+# has its own full-text index, so search keeps finding archived conversations.
+# Moving a session between tiers leaves updated_at alone, so the recent-chats
+# order only follows new messages.
+
+# Archives written before a field was added simply lack the trailing values
+_MESSAGE_FIELDS = ("id", "question", "answer", "timestamp", "prompt_version", "prompt_tokens", "completion_tokens", "llm_latency_ms")
+
+
+def encode_messages(messages: List[ChatMessage]) -> bytes:
+    """Serialize messages as compact JSON"""
+    return json.dumps([
+        [message.id, message.question, message.answer,
+         message.timestamp.isoformat() if message.timestamp else None, message.prompt_version,
+         message.prompt_tokens, message.completion_tokens, message.llm_latency_ms]
+        for message in messages
+    ], separators=(",", ":")).encode()
+
+
+def decode_messages(payload: bytes, session_id: int) -> List[Dict[str, Any]]:
+    """Decompress an archive payload into message column dicts"""
+    messages = []
+    for values in json.loads(zlib.decompress(payload)):
+        message = dict.fromkeys(_MESSAGE_FIELDS)
+        message.update(zip(_MESSAGE_FIELDS, values))
+        message["session_id"] = session_id
+        message["timestamp"] = datetime.fromisoformat(message["timestamp"]) if message["timestamp"] else None
+        messages.append(message)
+    return messages
+
+
+async def get_idle_session_ids(db: AsyncSession, idle_before: datetime, limit: int) -> List[int]:
+    """IDs of sessions not yet archived whose last message is older than idle_before"""
+    result = await db.scalars(
+        select(ChatSession.id)
+        .where(ChatSession.archived_at.is_(None), ChatSession.last_message_at < idle_before)
+        .order_by(ChatSession.last_message_at)
+        .limit(limit)
+    )
+    return result.all()
+
+
+async def archive_session(db: AsyncSession, session_id: int, compress_level: int = 6) -> Optional[Dict[str, int]]:
+    """
+    Move a session's messages into a compressed archive row
+
+    The session is only archived if no message was added since it was
+    found idle: the archived_at update is conditional on last_message_at,
+    and only the messages that went into the blob are deleted.
+
+    Returns:
+        Dictionary with messages, raw_bytes and compressed_bytes, or None if
+        the session was not archived
+    """
+    session = await db.get(ChatSession, session_id)
+    if session is None or session.archived_at is not None:
+        return None
+    seen_last_message_at = session.last_message_at
+    messages = (await db.scalars(
+        select(ChatMessage).where(ChatMessage.session_id == session_id).order_by(ChatMessage.timestamp, ChatMessage.id)
+    )).all()
+    if not messages:
+        return None
+
+    raw = encode_messages(messages)
+    payload = zlib.compress(raw, compress_level)
+    now = datetime.utcnow()
+    claimed = await db.execute(
+        update(ChatSession)
+        .where(ChatSession.id == session_id, ChatSession.last_message_at == seen_last_message_at)
+        .values(archived_at=now, updated_at=ChatSession.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+    if claimed.rowcount != 1:
+        return None
+    await db.execute(insert(ChatSessionArchive).values(
+        session_id=session_id, payload=payload, message_count=len(messages), raw_bytes=len(raw), archived_at=now
+    ))
+    message_ids = [message.id for message in messages]
+    await db.execute(insert(ArchivedMessageSearch).from_select(
+        ["message_id", "session_id", "user_id", "question", "answer", "timestamp"],
+        select(ChatMessage.id, ChatMessage.session_id, ChatMessage.user_id, ChatMessage.question, ChatMessage.answer, ChatMessage.timestamp)
+        .where(ChatMessage.id.in_(message_ids))
+    ))
+    await db.execute(
+        delete(ChatMessage)
+        .where(ChatMessage.id.in_(message_ids))
+        .execution_options(synchronize_session=False)
+    )
+    for message in messages:
+        db.expunge(message)
+    db.expire(session)
+    on_commit(db, lambda: recent_turns_cache.invalidate(session_id))
+    return {"messages": len(messages), "raw_bytes": len(raw), "compressed_bytes": len(payload)}
+
+
+async def get_archived_messages(db: AsyncSession, session_id: int) -> List[Dict[str, Any]]:
+    """Read an archived session's messages, oldest first, without moving them back"""
+    payload = await db.scalar(
+        select(ChatSessionArchive.payload).where(ChatSessionArchive.session_id == session_id),
+        bind_arguments=read_replica(("chat_session", session_id))
+    )
+    return decode_messages(payload, session_id) if payload is not None else []
+
+
+async def rehydrate_session(db: AsyncSession, session_id: int) -> int:
+    """
+    Move an archived session's messages back into chat_messages
+
+    Returns:
+        Number of messages restored (0 if the session was not archived)
+    """
+    archive = await db.get(ChatSessionArchive, session_id, with_for_update=True)
+    if archive is None:
+        return 0
+    messages = decode_messages(archive.payload, session_id)
+    if messages:
+        await db.execute(insert(ChatMessage), messages)
+    await db.delete(archive)
+    await db.execute(delete(ArchivedMessageSearch).where(ArchivedMessageSearch.session_id == session_id))
+    await db.execute(
+        update(ChatSession)
+        .where(ChatSession.id == session_id)
+        .values(archived_at=None, updated_at=ChatSession.updated_at)
+    )
+    await db.flush()
+    return len(messages)
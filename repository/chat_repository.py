@@ -1,128 +1,362 @@
-from sqlalchemy.orm import Session
-from models import ChatSession, ChatMessage
-from typing import Optional, List
+from sqlalchemy import select, update, delete, func, bindparam, tuple_
+from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import ChatSession, ChatMessage, ArchivedMessageSearch
+from typing import Optional, List, Tuple, Iterable
 from datetime import datetime
-from utilities.database import get_db
+from utilities.database import on_commit, read_replica
+import repository.recent_turns_cache as recent_turns_cache
 
+# Length of ChatSession.last_message_preview
+PREVIEW_LENGTH = 120
+
+# Repository functions take the request's unit of work (AsyncSession) and only
+# flush; committing is left to the caller so one chat turn is one transaction.
+# Read-only queries behind display endpoints (history, session listing) pass
+# read_replica(...) so they can be served by the read replica, keyed by what
+# they read for read-your-writes. Reads that build a chat turn's context or a
+# summary stay on the primary: the read-your-writes check only knows this
+# worker's writes, and a turn must see the previous turn even when that was
+# answered by another worker within the replica's lag.
 
-def create_session(user_id: Optional[str] = None, session_name: Optional[str] = None) -> ChatSession:
-    """Create a new chat session"""
-    db = next(get_db())
-    try:
-        session = ChatSession(
-            user_id=user_id,
-            session_name=session_name or f"Chat Session {datetime.utcnow().strftime('%Y-%m-%d %H:%M')}"
-        )
-        db.add(session)
-        db.commit()
-        db.refresh(session)
 
-        return session
-    finally:
-        db.close()
+async def create_session(db: AsyncSession, user_id: Optional[str] = None, session_name: Optional[str] = None) -> ChatSession:
+    """Create a new chat session"""
+    session = ChatSession(
+        user_id=user_id,
+        session_name=session_name or f"Chat Session {datetime.utcnow().strftime('%Y-%m-%d %H:%M')}"
+    )
+    db.add(session)
+    await db.flush()
+    on_commit(db, lambda: recent_turns_cache.seed_session(session))
+    return session
 
 
-def get_session(session_id: int) -> Optional[ChatSession]:
+async def get_session(db: AsyncSession, session_id: int) -> Optional[ChatSession]:
     """Get a chat session by ID"""
-    db = next(get_db())
-    try:
-        return db.query(ChatSession).filter(ChatSession.id == session_id).first()
-    finally:
-        db.close()
+    return await db.get(ChatSession, session_id)
+
+
+async def get_session_for_read(db: AsyncSession, session_id: int) -> Optional[ChatSession]:
+    """Get a chat session by ID for display, from the read replica when possible"""
+    return await db.scalar(
+        select(ChatSession).where(ChatSession.id == session_id),
+        bind_arguments=read_replica(("chat_session", session_id))
+    )
+
+
+async def get_session_with_recent_messages(
+    db: AsyncSession, session_id: int, count: int = 10
+) -> Tuple[Optional[ChatSession], List[ChatMessage]]:
+    """Get a chat session and its most recent N messages in a single round trip, from the primary"""
+    recent = select(ChatMessage)\
+        .where(ChatMessage.session_id == session_id)\
+        .order_by(ChatMessage.timestamp.desc())\
+        .limit(count)\
+        .subquery()
+    recent_message = aliased(ChatMessage, recent)
+
+    rows = (await db.execute(
+        select(ChatSession, recent_message)
+        .outerjoin(recent_message, recent_message.session_id == ChatSession.id)
+        .where(ChatSession.id == session_id)
+    )).all()
+    if not rows:
+        return None, []
+
+    messages = [message for _, message in rows if message is not None]
+    messages.sort(key=lambda message: (message.timestamp, message.id))  # Chronological order
+    return rows[0][0], messages
+
+
+async def update_session_summary(
+    db: AsyncSession, session_id: int, summary: str, summary_message_id: int
+) -> Optional[ChatSession]:
+    """Store a session's rolling summary and the last message folded into it"""
+    session = await db.get(ChatSession, session_id)
+    if session:
+        session.summary = summary
+        session.summary_message_id = summary_message_id
+        await db.flush()
+        on_commit(db, lambda: recent_turns_cache.update_session(session))
+    return session
 
 
-def get_all_histories(user_id: Optional[str] = None) -> List[ChatSession]:
+async def get_all_histories(db: AsyncSession, user_id: Optional[str] = None) -> List[ChatSession]:
     """Get all chat sessions, optionally filtered by user_id"""
-    db = next(get_db())
-    try:
-        query = db.query(ChatSession)
-        if user_id:
-            query = query.filter(ChatSession.user_id == user_id)
-        result = query.order_by(ChatSession.updated_at.desc()).all()
-        return result
-    finally:
-        db.close()
-
-
-def update_session(session_id: int, session_name: Optional[str] = None) -> Optional[ChatSession]:
+    query = select(ChatSession)
+    if user_id:
+        query = query.where(ChatSession.user_id == user_id)
+    result = await db.scalars(query.order_by(ChatSession.updated_at.desc()), bind_arguments=read_replica(("user", user_id)))
+    return result.all()
+
+
+async def get_histories_page(
+    db: AsyncSession,
+    user_id: Optional[str] = None,
+    limit: int = 50,
+    before: Optional[Tuple[datetime, int]] = None
+) -> List[ChatSession]:
+    """Get one page of chat sessions, newest first, strictly after the (updated_at, id) keyset position"""
+    query = select(ChatSession)
+    if user_id:
+        query = query.where(ChatSession.user_id == user_id)
+    if before:
+        query = query.where(tuple_(ChatSession.updated_at, ChatSession.id) < tuple_(*before))
+    result = await db.scalars(
+        query.order_by(ChatSession.updated_at.desc(), ChatSession.id.desc()).limit(limit),
+        bind_arguments=read_replica(("user", user_id))
+    )
+    return result.all()
+
+
+async def update_session(db: AsyncSession, session_id: int, session_name: Optional[str] = None) -> Optional[ChatSession]:
     """Update a chat session"""
-    db = next(get_db())
-    try:
-        session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
-        if session:
-            if session_name:
-                session.session_name = session_name
-            session.updated_at = datetime.utcnow()
-            db.commit()
-            db.refresh(session)
-        return session
-    finally:
-        db.close()
-
-
-def delete_session(session_id: int) -> bool:
+    session = await db.get(ChatSession, session_id)
+    if session:
+        if session_name:
+            session.session_name = session_name
+        session.updated_at = datetime.utcnow()
+        await db.flush()
+        on_commit(db, lambda: recent_turns_cache.update_session(session))
+    return session
+
+
+async def delete_session(db: AsyncSession, session_id: int) -> bool:
     """Delete a chat session"""
-    db = next(get_db())
-    try:
-        session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
-        if session:
-            db.delete(session)
-            db.commit()
-            return True
-        return False
-    finally:
-        db.close()
-
-
-def create_message(session_id: int, question: str, answer: str) -> ChatMessage:
-    """Create a new chat message"""
-    db = next(get_db())
-    try:
-        message = ChatMessage(
-            session_id=session_id,
-            question=question,
-            answer=answer
+    session = await db.get(ChatSession, session_id)
+    if session:
+        if session.archived_at is not None:
+            await db.execute(delete(ArchivedMessageSearch).where(ArchivedMessageSearch.session_id == session_id))
+        await db.delete(session)
+        await db.flush()
+        on_commit(db, lambda: recent_turns_cache.invalidate(session_id))
+        return True
+    return False
+
+
+async def delete_session_if_empty(db: AsyncSession, session_id: int) -> bool:
+    """
+    Delete a session that has no messages, e.g. one whose first streamed turn failed
+
+    The message count is checked in the DELETE itself, so a session that got
+    a message from another turn meanwhile is kept.
+    """
+    result = await db.execute(
+        delete(ChatSession).where(ChatSession.id == session_id, ChatSession.message_count == 0)
+    )
+    if result.rowcount:
+        on_commit(db, lambda: recent_turns_cache.invalidate(session_id))
+    return bool(result.rowcount)
+
+
+def message_preview(answer: str) -> str:
+    """Single-line answer excerpt stored as the session's last_message_preview"""
+    text = " ".join(answer.split())
+    return text if len(text) <= PREVIEW_LENGTH else text[:PREVIEW_LENGTH - 1] + "\u2026"
+
+
+async def create_message(
+    db: AsyncSession,
+    session_id: int,
+    question: str,
+    answer: str,
+    prompt_version: Optional[int] = None,
+    prompt_tokens: Optional[int] = None,
+    completion_tokens: Optional[int] = None,
+    llm_latency_ms: Optional[int] = None
+) -> ChatMessage:
+    """Create a new chat message and bump its session's message stats in the same transaction"""
+    message = ChatMessage(
+        session_id=session_id,
+        question=question,
+        answer=answer,
+        timestamp=datetime.utcnow(),
+        prompt_version=prompt_version,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        llm_latency_ms=llm_latency_ms
+    )
+    db.add(message)
+    # Increment in SQL so concurrent writers never lose a count
+    await db.execute(
+        update(ChatSession)
+        .where(ChatSession.id == session_id)
+        .values(
+            message_count=ChatSession.message_count + 1,
+            last_message_at=message.timestamp,
+            last_message_preview=message_preview(answer),
+            updated_at=message.timestamp,
+        )
+    )
+    await db.flush()
+    on_commit(db, lambda: recent_turns_cache.append_turn(message))
+    return message
+
+
+async def create_messages_bulk(db: AsyncSession, turns: List[dict]) -> List[ChatMessage]:
+    """
+    Create many chat messages (and any new sessions they need) with batched inserts
+    
+    Each turn is a dict with question, answer, prompt_version, optional
+    token usage (prompt_tokens, completion_tokens, llm_latency_ms) and either a
+    session_id or, for a new chat, session_id None and an optional user_id.
+    Messages of new chats come back with their session attached.
+    """
+    now = datetime.utcnow()
+    # A new chat holds exactly one turn, so its stats are known up front
+    new_sessions = {
+        index: ChatSession(
+            user_id=turn.get("user_id"),
+            session_name=f"Chat Session {now.strftime('%Y-%m-%d %H:%M')}",
+            message_count=1,
+            last_message_at=now,
+            last_message_preview=message_preview(turn["answer"]),
+            created_at=now,
+            updated_at=now
+        )
+        for index, turn in enumerate(turns) if turn["session_id"] is None
+    }
+    if new_sessions:
+        db.add_all(list(new_sessions.values()))
+        await db.flush()
+
+    messages = [
+        ChatMessage(
+            session_id=turn["session_id"],
+            question=turn["question"],
+            answer=turn["answer"],
+            timestamp=now,
+            prompt_version=turn.get("prompt_version"),
+            prompt_tokens=turn.get("prompt_tokens"),
+            completion_tokens=turn.get("completion_tokens"),
+            llm_latency_ms=turn.get("llm_latency_ms")
         )
-        db.add(message)
-        db.commit()
-        db.refresh(message)
-        return message
-    finally:
-        db.close()
+        for turn in turns
+    ]
+    for index, session in new_sessions.items():
+        messages[index].session = session
+    db.add_all(messages)
 
+    # Existing sessions: one executemany bumping each session by its turn count
+    bumps = {}
+    for turn in turns:
+        if turn["session_id"] is not None:
+            count, _ = bumps.get(turn["session_id"], (0, None))
+            bumps[turn["session_id"]] = (count + 1, turn["answer"])
+    if bumps:
+        table = ChatSession.__table__
+        await db.execute(
+            update(table)
+            .where(table.c.id == bindparam("b_session_id"))
+            .values(
+                message_count=table.c.message_count + bindparam("b_count"),
+                last_message_at=bindparam("b_at"),
+                last_message_preview=bindparam("b_preview"),
+                updated_at=bindparam("b_at"),
+            ),
+            [
+                {"b_session_id": session_id, "b_count": count, "b_at": now, "b_preview": message_preview(answer)}
+                for session_id, (count, answer) in bumps.items()
+            ]
+        )
+    await db.flush()
+
+    def update_cache() -> None:
+        for session in new_sessions.values():
+            recent_turns_cache.seed_session(session)
+        for message in messages:
+            recent_turns_cache.append_turn(message)
+
+    on_commit(db, update_cache)
+    return messages
+
+
+async def refresh_session_stats(db: AsyncSession, session_ids: Iterable[int]) -> None:
+    """Recompute message_count, last_message_at and last_message_preview from the messages table"""
+    session_ids = list(session_ids)
+    if not session_ids:
+        return
+    messages = ChatMessage.__table__
+    table = ChatSession.__table__
+    owned = messages.c.session_id == table.c.id
+    last_answer = select(messages.c.answer).where(owned)\
+        .order_by(messages.c.timestamp.desc(), messages.c.id.desc()).limit(1).scalar_subquery()
+    await db.execute(
+        update(table)
+        .where(table.c.id.in_(session_ids))
+        .values(
+            message_count=select(func.count()).where(owned).scalar_subquery(),
+            last_message_at=select(func.max(messages.c.timestamp)).where(owned).scalar_subquery(),
+            last_message_preview=func.substr(last_answer, 1, PREVIEW_LENGTH),
+            # Keep updated_at as it is rather than letting onupdate stamp it
+            updated_at=table.c.updated_at,
+        )
+    )
 
-def get_message(message_id: int) -> Optional[ChatMessage]:
+
+async def get_message(db: AsyncSession, message_id: int) -> Optional[ChatMessage]:
     """Get a specific message by ID"""
-    db = next(get_db())
-    try:
-        return db.query(ChatMessage).filter(ChatMessage.id == message_id).first()
-    finally:
-        db.close()
+    return await db.get(ChatMessage, message_id)
 
 
-def get_messages_by_session(session_id: int, limit: Optional[int] = None) -> List[ChatMessage]:
+async def get_messages_by_session(db: AsyncSession, session_id: int, limit: Optional[int] = None) -> List[ChatMessage]:
     """Get all messages for a specific session"""
-    db = next(get_db())
-    try:
-        query = db.query(ChatMessage).filter(ChatMessage.session_id == session_id)
-        query = query.order_by(ChatMessage.timestamp.asc())
-        
-        if limit:
-            query = query.limit(limit)
-        
-        return query.all()
-    finally:
-        db.close()
-
-
-def get_recent_messages(session_id: int, count: int = 10) -> List[ChatMessage]:
-    """Get the most recent N messages for a session"""
-    db = next(get_db())
-    try:
-        return db.query(ChatMessage)\
-            .filter(ChatMessage.session_id == session_id)\
-            .order_by(ChatMessage.timestamp.desc())\
-            .limit(count)\
-            .all()[::-1]  # Reverse to get chronological order
-    finally:
-        db.close()
+    query = select(ChatMessage).where(ChatMessage.session_id == session_id)
+    query = query.order_by(ChatMessage.timestamp.asc())
+
+    if limit:
+        query = query.limit(limit)
+
+    result = await db.scalars(query, bind_arguments=read_replica(("chat_session", session_id)))
+    return result.all()
+
+
+async def get_messages_page(
+    db: AsyncSession,
+    session_id: int,
+    limit: int = 50,
+    after: Optional[Tuple[datetime, int]] = None
+) -> List[ChatMessage]:
+    """Get one page of messages for a session, oldest first, strictly after the (timestamp, id) keyset position"""
+    query = select(ChatMessage).where(ChatMessage.session_id == session_id)
+    if after:
+        query = query.where(tuple_(ChatMessage.timestamp, ChatMessage.id) > tuple_(*after))
+    result = await db.scalars(
+        query.order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc()).limit(limit),
+        bind_arguments=read_replica(("chat_session", session_id))
+    )
+    return result.all()
+
+
+async def get_recent_messages(db: AsyncSession, session_id: int, count: int = 10) -> List[ChatMessage]:
+    """Get the most recent N messages for a session, from the primary"""
+    result = await db.scalars(
+        select(ChatMessage)
+        .where(ChatMessage.session_id == session_id)
+        .order_by(ChatMessage.timestamp.desc())
+        .limit(count)
+    )
+    return result.all()[::-1]  # Reverse to get chronological order
+
+
+async def get_messages_between(
+    db: AsyncSession,
+    session_id: int,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    limit: Optional[int] = None
+) -> List[ChatMessage]:
+    """Get messages for a session with IDs strictly between after_id and before_id, oldest first, from the primary"""
+    query = select(ChatMessage).where(ChatMessage.session_id == session_id)
+    if after_id is not None:
+        query = query.where(ChatMessage.id > after_id)
+    if before_id is not None:
+        query = query.where(ChatMessage.id < before_id)
+    query = query.order_by(ChatMessage.id.asc())
+
+    if limit:
+        query = query.limit(limit)
+
+    result = await db.scalars(query)
+    return result.all()
@@ -1,42 +1,128 @@
-from sqlalchemy.orm import Session
-from models import ErrorLog
-from typing import List, Optional
+import re
+import hashlib
 import traceback
+from datetime import datetime
+from typing import List, Optional, Dict, Any
+from sqlalchemy import select, insert, update, bindparam
+from models import ErrorLog
 from utilities.database import get_db
+from repository.error_log_writer import ErrorLogWriter
+from utilities.metrics import CounterFunc, GaugeFunc
 
+# A trace's frame lines identify where an error was raised; its message lines
+# carry IDs, counts and values that differ between otherwise identical errors
+_FRAME = re.compile(r'^\s*File "[^"]*", line \d+, in .+$', re.MULTILINE)
+_ADDRESS = re.compile(r"0x[0-9a-fA-F]+")
+_QUOTED = re.compile(r"'[^']*'|\"[^\"]*\"")
+_NUMBER = re.compile(r"\d+")
 
-def log_error(error_type: str, error_message: str, stack_trace: Optional[str] = None) -> ErrorLog:
-    """Create a new error log entry"""
-    db = next(get_db())
-    try:
-        error_log = ErrorLog(
-            error_type=error_type,
-            error_message=error_message,
-            stack_trace=stack_trace
-        )
-        db.add(error_log)
-        db.commit()
-        db.refresh(error_log)
-        return error_log
-    finally:
-        db.close()
+
+def _normalize_message(text: str) -> str:
+    return _NUMBER.sub("N", _QUOTED.sub("?", _ADDRESS.sub("0x?", text)))
+
+
+def error_fingerprint(error_type: str, error_message: str, stack_trace: Optional[str] = None) -> str:
+    """Fingerprint an error by its type and the frame lines of its trace (or its normalized message without one)"""
+    frames = _FRAME.findall(stack_trace) if stack_trace else []
+    if frames:
+        normalized = "\n".join(frame.strip() for frame in frames)
+    else:
+        normalized = _normalize_message(stack_trace or error_message)
+    return hashlib.sha256(f"{error_type}\n{normalized}".encode()).hexdigest()
+
+
+def log_error(error_type: str, error_message: str, stack_trace: Optional[str] = None) -> str:
+    """
+    Queue an error log entry for the background writer.
+    Never blocks; the entry is dropped (and counted) if the queue is full.
+    Returns the error's fingerprint.
+    """
+    fingerprint = error_fingerprint(error_type, error_message, stack_trace)
+    error_log_writer.enqueue({
+        "fingerprint": fingerprint,
+        "error_type": error_type,
+        "error_message": error_message,
+        "stack_trace": stack_trace,
+        "seen_at": datetime.utcnow(),
+    })
+    return fingerprint
 
 
-def log_exception(exception: Exception) -> ErrorLog:
+def log_exception(exception: Exception) -> str:
     """Log an exception with full stack trace"""
     return log_error(
         error_type=type(exception).__name__,
         error_message=str(exception),
-        stack_trace=traceback.format_exc()
+        stack_trace="".join(traceback.format_exception(type(exception), exception, exception.__traceback__))
     )
 
 
+def write_error_batch(entries: List[Dict[str, Any]]) -> None:
+    """Write queued entries in one transaction, collapsing them into one row per fingerprint"""
+    grouped: Dict[str, Dict[str, Any]] = {}
+    for entry in entries:
+        group = grouped.get(entry["fingerprint"])
+        if group is None:
+            grouped[entry["fingerprint"]] = dict(entry, count=1, first_seen=entry["seen_at"], last_seen=entry["seen_at"])
+        else:
+            group["count"] += 1
+            group["first_seen"] = min(group["first_seen"], entry["seen_at"])
+            group["last_seen"] = max(group["last_seen"], entry["seen_at"])
+
+    table = ErrorLog.__table__
+    db = next(get_db())
+    try:
+        existing = dict(db.execute(
+            select(table.c.fingerprint, table.c.id).where(table.c.fingerprint.in_(list(grouped)))
+        ).all())
+
+        updates = [
+            {"row_id": existing[fingerprint], "count": group["count"], "seen": group["last_seen"]}
+            for fingerprint, group in grouped.items() if fingerprint in existing
+        ]
+        if updates:
+            db.execute(
+                update(table)
+                .where(table.c.id == bindparam("row_id"))
+                .values(occurrence_count=table.c.occurrence_count + bindparam("count"), last_seen=bindparam("seen")),
+                updates
+            )
+
+        inserts = [
+            {
+                "fingerprint": fingerprint,
+                "error_type": group["error_type"],
+                "error_message": group["error_message"],
+                "stack_trace": group["stack_trace"],
+                "timestamp": group["first_seen"],
+                "occurrence_count": group["count"],
+                "first_seen": group["first_seen"],
+                "last_seen": group["last_seen"],
+            }
+            for fingerprint, group in grouped.items() if fingerprint not in existing
+        ]
+        if inserts:
+            db.execute(insert(table), inserts)
+        db.commit()
+    finally:
+        db.close()
+
+
+# Background writer that batches queued entries into write_error_batch
+error_log_writer = ErrorLogWriter(write_error_batch)
+CounterFunc(
+    "brainbox_error_log_entries", "Error log entries enqueued, dropped on a full queue, written and failed",
+    lambda: {(name,): error_log_writer.stats()[name] for name in ("enqueued", "dropped", "written", "failed")}, ("event",)
+)
+GaugeFunc("brainbox_error_log_queue_depth", "Error log entries waiting for the background writer", lambda: error_log_writer.stats()["queue_depth"])
+
+
 def get_recent_errors(limit: int = 50) -> List[ErrorLog]:
-    """Get recent error logs"""
+    """Get recently seen error logs"""
     db = next(get_db())
     try:
         return db.query(ErrorLog)\
-            .order_by(ErrorLog.timestamp.desc())\
+            .order_by(ErrorLog.last_seen.desc())\
             .limit(limit)\
             .all()
     finally:
@@ -49,7 +135,7 @@ def get_errors_by_type(error_type: str, limit: int = 50) -> List[ErrorLog]:
     try:
         return db.query(ErrorLog)\
             .filter(ErrorLog.error_type == error_type)\
-            .order_by(ErrorLog.timestamp.desc())\
+            .order_by(ErrorLog.last_seen.desc())\
             .limit(limit)\
             .all()
     finally:
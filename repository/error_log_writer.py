@@ -0,0 +1,112 @@
+import os
+import time
+import logging
+import queue
+import atexit
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+
+ERROR_LOG_QUEUE_SIZE = int(os.getenv("ERROR_LOG_QUEUE_SIZE", "10000"))
+ERROR_LOG_BATCH_SIZE = int(os.getenv("ERROR_LOG_BATCH_SIZE", "200"))
+ERROR_LOG_FLUSH_INTERVAL = float(os.getenv("ERROR_LOG_FLUSH_INTERVAL", "1.0"))
+
+_STOP = object()
+
+logger = logging.getLogger(__name__)
+
+
+class ErrorLogWriter:
+    """
+    Background thread that drains queued error log entries in batches
+    
+    The queue is bounded and enqueue never blocks, so logging can not stall
+    or take down the request path: when the queue is full the entry is
+    dropped and counted instead.
+    """
+
+    def __init__(
+        self,
+        write_batch: Callable[[List[Dict[str, Any]]], None],
+        max_queue_size: int = ERROR_LOG_QUEUE_SIZE,
+        batch_size: int = ERROR_LOG_BATCH_SIZE,
+        flush_interval: float = ERROR_LOG_FLUSH_INTERVAL
+    ):
+        self._write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._atexit_registered = False
+        self._stats = {"enqueued": 0, "dropped": 0, "written": 0, "batches": 0, "failed": 0}
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="error-log-writer", daemon=True)
+                self._thread.start()
+                if not self._atexit_registered:
+                    atexit.register(self.stop)
+                    self._atexit_registered = True
+
+    def enqueue(self, entry: Dict[str, Any]) -> bool:
+        """Queue an entry; returns False if it was dropped because the queue is full"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self._stats["dropped"] += 1
+            return False
+        self._stats["enqueued"] += 1
+        return True
+
+    def _run(self) -> None:
+        batch: List[Dict[str, Any]] = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                self._flush(batch)
+                return
+            if item is not None:
+                batch.append(item)
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._flush(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _flush(self, batch: List[Dict[str, Any]]) -> None:
+        if not batch:
+            return
+        try:
+            self._write_batch(batch)
+            self._stats["written"] += len(batch)
+            self._stats["batches"] += 1
+        except Exception as ex:
+            # Report through the application log and keep the writer alive
+            self._stats["failed"] += len(batch)
+            logger.error("error_log.write_failed", extra={"entries": len(batch), "error": str(ex)})
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Flush everything queued so far and stop the writer thread"""
+        thread = self._thread
+        if thread is None:
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        thread.join(timeout)
+        with self._lock:
+            self._thread = None
+
+    def stats(self) -> Dict[str, int]:
+        """Enqueued, dropped, written, batch and failure counters plus current queue depth"""
+        return dict(self._stats, queue_depth=self._queue.qsize())
+
@@ -0,0 +1,86 @@
+from sqlalchemy import select, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.engine import Row
+from models import ChatSession, ChatMessage, ChatSessionArchive
+from utilities.database import read_replica
+from typing import Optional, List, AsyncIterator
+
+# Bulk export/import works on plain rows rather than ORM objects, so memory
+# stays flat no matter how many sessions or messages are moved.
+
+SESSION_COLUMNS = (
+    ChatSession.id.label("session_id"),
+    ChatSession.user_id,
+    ChatSession.session_name,
+    ChatSession.created_at,
+    ChatSession.updated_at,
+    ChatSession.summary,
+    ChatSessionArchive.payload.label("archive_payload"),
+)
+MESSAGE_COLUMNS = (
+    ChatMessage.id.label("message_id"),
+    ChatMessage.question,
+    ChatMessage.answer,
+    ChatMessage.timestamp,
+    ChatMessage.prompt_version,
+    ChatMessage.prompt_tokens,
+    ChatMessage.completion_tokens,
+    ChatMessage.llm_latency_ms,
+)
+
+# Columns written by COPY, in order
+_MESSAGE_COPY_COLUMNS = [
+    "session_id", "question", "answer", "timestamp", "prompt_version",
+    "prompt_tokens", "completion_tokens", "llm_latency_ms",
+]
+
+
+async def stream_sessions_with_messages(
+    db: AsyncSession, user_id: Optional[str] = None, batch_size: int = 1000
+) -> AsyncIterator[Row]:
+    """
+    Stream every session joined to its messages through a server-side cursor
+
+    Rows come ordered by session, then message time, so a session's rows are
+    contiguous; sessions without messages yield one row with NULL message
+    columns. Archived sessions carry their compressed messages in
+    archive_payload. Only batch_size rows are buffered at a time.
+    """
+    query = select(*SESSION_COLUMNS, *MESSAGE_COLUMNS)\
+        .outerjoin(ChatSessionArchive, ChatSessionArchive.session_id == ChatSession.id)\
+        .outerjoin(ChatMessage, ChatMessage.session_id == ChatSession.id)\
+        .order_by(ChatSession.id, ChatMessage.timestamp, ChatMessage.id)\
+        .execution_options(yield_per=batch_size)
+    if user_id:
+        query = query.where(ChatSession.user_id == user_id)
+
+    result = await db.stream(query, bind_arguments=read_replica(("user", user_id)))
+    async for row in result:
+        yield row
+
+
+async def insert_sessions(db: AsyncSession, sessions: List[dict]) -> List[int]:
+    """Insert sessions with one batched statement and return their new IDs in input order"""
+    result = await db.execute(
+        insert(ChatSession).returning(ChatSession.id, sort_by_parameter_order=True),
+        sessions
+    )
+    return list(result.scalars())
+
+
+async def insert_messages(db: AsyncSession, messages: List[dict]) -> None:
+    """
+    Insert messages in bulk: COPY on asyncpg, batched executemany elsewhere
+
+    Each dict carries the columns of _MESSAGE_COPY_COLUMNS.
+    """
+    connection = await db.connection()
+    if connection.dialect.driver == "asyncpg":
+        raw = await connection.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            ChatMessage.__tablename__,
+            records=[tuple(message[column] for column in _MESSAGE_COPY_COLUMNS) for message in messages],
+            columns=_MESSAGE_COPY_COLUMNS,
+        )
+    else:
+        await db.execute(insert(ChatMessage), messages)
@@ -1,8 +1,13 @@
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from models import Prompt
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from utilities.database import get_db
 
+# Attempts after a concurrent publisher took the version number first
+VERSION_CONFLICT_RETRIES = 3
+
 
 def create_prompt(prompt_text: str, prompt_type: Optional[str] = None) -> Prompt:
     """Create a new prompt entry"""
@@ -51,3 +56,82 @@ def get_recent_prompts(limit: int = 10) -> List[Prompt]:
             .all()
     finally:
         db.close()
+
+
+def get_active_prompts() -> List[Prompt]:
+    """Get the pinned (active) prompt for every prompt type"""
+    db = next(get_db())
+    try:
+        return db.query(Prompt).filter(Prompt.is_active.is_(True)).all()
+    finally:
+        db.close()
+
+
+def get_active_prompt_ids() -> List[Tuple[str, int]]:
+    """Get (prompt_type, id) of every pinned prompt, without the prompt texts"""
+    db = next(get_db())
+    try:
+        return [tuple(row) for row in db.query(Prompt.prompt_type, Prompt.id).filter(Prompt.is_active.is_(True)).all()]
+    finally:
+        db.close()
+
+
+def _latest_version(db: Session, prompt_type: str) -> Optional[int]:
+    return db.query(func.max(Prompt.version)).filter(Prompt.prompt_type == prompt_type).scalar()
+
+
+def create_prompt_version(prompt_text: str, prompt_type: str, activate: bool = True) -> Prompt:
+    """
+    Store the next version of a prompt type, optionally pinning it as the active one
+
+    Two publishers can read the same latest version; the unique index on
+    (prompt_type, version) rejects the second insert, which then retries
+    with a fresh read.
+    """
+    db = next(get_db())
+    try:
+        for attempt in range(VERSION_CONFLICT_RETRIES + 1):
+            latest = _latest_version(db, prompt_type)
+            if activate:
+                db.execute(
+                    update(Prompt)
+                    .where(Prompt.prompt_type == prompt_type, Prompt.is_active.is_(True))
+                    .values(is_active=False)
+                )
+            prompt = Prompt(
+                prompt_text=prompt_text,
+                prompt_type=prompt_type,
+                version=(latest or 0) + 1,
+                is_active=activate
+            )
+            db.add(prompt)
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                if attempt == VERSION_CONFLICT_RETRIES:
+                    raise
+                continue
+            db.refresh(prompt)
+            return prompt
+    finally:
+        db.close()
+
+
+def activate_prompt(prompt_id: int) -> Optional[Prompt]:
+    """Pin an existing prompt version as the active one for its type"""
+    db = next(get_db())
+    try:
+        prompt = db.query(Prompt).filter(Prompt.id == prompt_id).first()
+        if prompt:
+            db.execute(
+                update(Prompt)
+                .where(Prompt.prompt_type == prompt.prompt_type, Prompt.id != prompt.id)
+                .values(is_active=False)
+            )
+            prompt.is_active = True
+            db.commit()
+            db.refresh(prompt)
+        return prompt
+    finally:
+        db.close()
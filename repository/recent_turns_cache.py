@@ -0,0 +1,162 @@
+import os
+import itertools
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from typing import Optional, List, Dict
+from models import ChatSession, ChatMessage
+from utilities.cache import CacheBackend, LRUTTLCache
+from utilities.metrics import CounterFunc, GaugeFunc
+
+
+# Cache of each session's recent-turns window, so a chat turn on a hot session
+# needs no read round trip. Entries are plain snapshots rather than ORM objects
+# so they never get attached to a request's session and can be serialized by
+# a shared backend. Across workers, staleness is bounded by the TTL.
+RECENT_TURNS_CACHE_SIZE = int(os.getenv("RECENT_TURNS_CACHE_SIZE", "10000"))
+RECENT_TURNS_CACHE_TTL = float(os.getenv("RECENT_TURNS_CACHE_TTL", "300"))
+# Number of most recent turns kept per session (the context window)
+RECENT_TURNS_WINDOW = int(os.getenv("CONTEXT_MAX_TURNS", "20"))
+
+
+@dataclass(frozen=True)
+class SessionSnapshot:
+    """Session columns needed to build chat context"""
+    id: int
+    user_id: Optional[str]
+    session_name: Optional[str]
+    summary: Optional[str]
+    summary_message_id: Optional[int]
+
+
+@dataclass(frozen=True)
+class TurnSnapshot:
+    """A stored question/answer turn"""
+    id: int
+    question: str
+    answer: str
+    timestamp: Optional[datetime]
+
+
+@dataclass(frozen=True)
+class RecentTurns:
+    """A session and its most recent turns in chronological order"""
+    session: SessionSnapshot
+    turns: List[TurnSnapshot] = field(default_factory=list)
+
+
+_backend: CacheBackend = LRUTTLCache(max_size=RECENT_TURNS_CACHE_SIZE, ttl=RECENT_TURNS_CACHE_TTL)
+
+# Write sequence per session, used to stop a read that raced with a write
+# from caching the pre-write window. Bounded like the cache itself.
+_write_seq = itertools.count(1)
+_last_write: "OrderedDict[int, int]" = OrderedDict()
+_current_seq = 0
+
+
+def set_cache_backend(backend: CacheBackend) -> None:
+    """Replace the cache backend (e.g. with one shared across workers)"""
+    global _backend
+    _backend = backend
+
+
+def _snapshot_session(session: ChatSession) -> SessionSnapshot:
+    return SessionSnapshot(
+        id=session.id,
+        user_id=session.user_id,
+        session_name=session.session_name,
+        summary=session.summary,
+        summary_message_id=session.summary_message_id,
+    )
+
+
+def _snapshot_turn(message: ChatMessage) -> TurnSnapshot:
+    return TurnSnapshot(id=message.id, question=message.question, answer=message.answer, timestamp=message.timestamp)
+
+
+def _mark_written(session_id: int) -> None:
+    global _current_seq
+    _current_seq = next(_write_seq)
+    _last_write[session_id] = _current_seq
+    _last_write.move_to_end(session_id)
+    while len(_last_write) > RECENT_TURNS_CACHE_SIZE:
+        _last_write.popitem(last=False)
+
+
+def get_recent_turns(session_id: int) -> Optional[RecentTurns]:
+    """Get the cached recent-turns window for a session, or None on a miss"""
+    return _backend.get(session_id)
+
+
+def begin_load(session_id: int) -> int:
+    """Get a token to pass to populate() before reading a window from the database"""
+    return _current_seq
+
+
+def populate(token: int, session: ChatSession, messages: List[ChatMessage]) -> RecentTurns:
+    """
+    Cache a window read from the database
+    
+    The window is only stored when no write to the session committed since
+    begin_load() returned the token.
+    
+    Returns:
+        The snapshot, cached or not
+    """
+    entry = RecentTurns(
+        session=_snapshot_session(session),
+        turns=[_snapshot_turn(message) for message in messages[-RECENT_TURNS_WINDOW:]],
+    )
+    if _last_write.get(session.id, 0) <= token:
+        _backend.set(session.id, entry)
+    return entry
+
+
+def seed_session(session: ChatSession) -> None:
+    """Cache an empty window for a session that was just created"""
+    _mark_written(session.id)
+    _backend.set(session.id, RecentTurns(session=_snapshot_session(session)))
+
+
+def append_turn(message: ChatMessage) -> None:
+    """Write-through a committed message into its session's cached window"""
+    _mark_written(message.session_id)
+    entry = _backend.peek(message.session_id)
+    if entry is None:
+        return
+    turns = (entry.turns + [_snapshot_turn(message)])[-RECENT_TURNS_WINDOW:]
+    _backend.set(message.session_id, replace(entry, turns=turns))
+
+
+def update_session(session: ChatSession) -> None:
+    """Write-through committed session column changes (name, summary)"""
+    _mark_written(session.id)
+    entry = _backend.peek(session.id)
+    if entry is None:
+        return
+    _backend.set(session.id, replace(entry, session=_snapshot_session(session)))
+
+
+def invalidate(session_id: int) -> None:
+    """Drop a session's cached window"""
+    _mark_written(session_id)
+    _backend.delete(session_id)
+
+
+def get_cache_stats() -> Dict[str, int]:
+    """
+    Get recent-turns cache counters
+    
+    Returns:
+        Dictionary with hits, misses, evictions, expirations, invalidations and size
+    """
+    return _backend.stats()
+
+
+# Cache counters for /metrics, read at scrape time from whichever backend is installed
+_COUNTED = ("hits", "misses", "evictions", "expirations", "invalidations")
+CounterFunc(
+    "brainbox_recent_turns_cache_events", "Recent-turns cache lookups by outcome, plus evicted, expired and invalidated entries",
+    lambda: {(name,): value for name, value in get_cache_stats().items() if name in _COUNTED}, ("event",)
+)
+GaugeFunc("brainbox_recent_turns_cache_entries", "Sessions held in the recent-turns cache", lambda: get_cache_stats().get("size"))
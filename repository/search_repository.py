@@ -0,0 +1,138 @@
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import DateTime, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from utilities.database import read_replica
+
+# The full-text index is kept up to date by the database as part of every
+# insert/update/delete on chat_messages (migrations 6 and 9): a generated
+# tsvector column with a GIN index on Postgres, an FTS5 table fed by triggers
+# on SQLite. So create_message, batch writes and COPY imports need no extra
+# statement. Archived messages are indexed the same way in
+# archived_message_search (migration 10), and every search covers both.
+# All indexes lead with the message's user_id, so a search only visits the
+# user's own matches however large the tables grow; ranking runs over those
+# matches, and snippets are built for the returned page only.
+
+# Text search configuration; must match the one used by migrations 6 and 10
+SEARCH_CONFIG = "english"
+SNIPPET_START, SNIPPET_STOP = "<b>", "</b>"
+SNIPPET_WORDS = 16
+
+_POSTGRES_SEARCH = f"""
+WITH q AS (SELECT websearch_to_tsquery('{SEARCH_CONFIG}', :query) AS query),
+page AS (
+    SELECT id, score FROM (
+        SELECT m.id, ts_rank_cd(m.search_vector, q.query) AS score
+        FROM chat_messages m, q
+        WHERE m.user_id = :user_id AND m.search_vector @@ q.query
+        UNION ALL
+        SELECT a.message_id, ts_rank_cd(a.search_vector, q.query)
+        FROM archived_message_search a, q
+        WHERE a.user_id = :user_id AND a.search_vector @@ q.query
+    ) hits
+    {{after}}
+    ORDER BY score DESC, id DESC
+    LIMIT :limit
+),
+found AS (
+    SELECT id, session_id, question, answer, timestamp FROM chat_messages WHERE id IN (SELECT id FROM page)
+    UNION ALL
+    SELECT message_id, session_id, question, answer, timestamp FROM archived_message_search WHERE message_id IN (SELECT id FROM page)
+)
+SELECT f.id AS message_id, f.session_id, s.session_name, f.question, f.timestamp, page.score,
+       ts_headline('{SEARCH_CONFIG}', f.question || ' ' || f.answer, q.query,
+                   'StartSel={SNIPPET_START}, StopSel={SNIPPET_STOP}, MaxWords={SNIPPET_WORDS}, MinWords=5, MaxFragments=2') AS snippet
+FROM page
+JOIN found f ON f.id = page.id
+JOIN chat_sessions s ON s.id = f.session_id
+CROSS JOIN q
+ORDER BY page.score DESC, page.id DESC
+"""
+
+# :scoped adds the user_id column filter to the terms, so FTS5 only returns
+# the user's postings; the exact user_id check drops the rare other user
+# whose ID tokenizes the same. bm25() gives user_id no weight and is negated
+# to page in the same direction as Postgres. Snippets match the terms alone.
+_SQLITE_SEARCH = f"""
+WITH page AS (
+    SELECT id, score FROM (
+        SELECT chat_messages_fts.rowid AS id, -bm25(chat_messages_fts, 1.0, 1.0, 0.0) AS score
+        FROM chat_messages_fts
+        JOIN chat_messages m ON m.id = chat_messages_fts.rowid
+        WHERE chat_messages_fts MATCH :scoped AND m.user_id = :user_id
+        UNION ALL
+        SELECT archived_message_search_fts.rowid, -bm25(archived_message_search_fts, 1.0, 1.0, 0.0)
+        FROM archived_message_search_fts
+        JOIN archived_message_search a ON a.message_id = archived_message_search_fts.rowid
+        WHERE archived_message_search_fts MATCH :scoped AND a.user_id = :user_id
+    )
+    {{after}}
+    ORDER BY score DESC, id DESC
+    LIMIT :limit
+)
+SELECT m.id AS message_id, m.session_id, s.session_name, m.question, m.timestamp, page.score,
+       snippet(chat_messages_fts, -1, '{SNIPPET_START}', '{SNIPPET_STOP}', '…', {SNIPPET_WORDS}) AS snippet
+FROM page
+JOIN chat_messages_fts ON chat_messages_fts.rowid = page.id
+JOIN chat_messages m ON m.id = page.id
+JOIN chat_sessions s ON s.id = m.session_id
+WHERE chat_messages_fts MATCH :query
+UNION ALL
+SELECT a.message_id, a.session_id, s.session_name, a.question, a.timestamp, page.score,
+       snippet(archived_message_search_fts, -1, '{SNIPPET_START}', '{SNIPPET_STOP}', '…', {SNIPPET_WORDS})
+FROM page
+JOIN archived_message_search_fts ON archived_message_search_fts.rowid = page.id
+JOIN archived_message_search a ON a.message_id = page.id
+JOIN chat_sessions s ON s.id = a.session_id
+WHERE archived_message_search_fts MATCH :query
+ORDER BY score DESC, message_id DESC
+"""
+
+# Keyset position of the previous page's last row, applied to both tiers' matches
+_AFTER = "WHERE (score, id) < (:after_score, :after_id)"
+
+
+def _fts5_phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _fts5_query(query: str) -> str:
+    """Quote every term so user input is never parsed as FTS5 query syntax; terms are ANDed"""
+    return " ".join(_fts5_phrase(term) for term in query.split())
+
+
+async def search_messages(
+    db: AsyncSession,
+    user_id: str,
+    query: str,
+    limit: int = 20,
+    after: Optional[Tuple[float, int]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Full-text search over a user's questions and answers, best match first,
+    including archived sessions
+
+    Rows carry message_id, session_id, session_name, question, timestamp,
+    score and a highlighted snippet; after is the (score, message_id)
+    keyset position of the previous page's last row.
+    """
+    if not query.split():
+        return []
+    bind_arguments = read_replica(("user", user_id))
+    params: Dict[str, Any] = {"user_id": user_id, "limit": limit}
+    if db.get_bind().dialect.name == "postgresql":
+        statement = _POSTGRES_SEARCH
+        params["query"] = query
+    else:
+        statement = _SQLITE_SEARCH
+        # The terms may only match question and answer, never the user_id column
+        params["query"] = f"{{question answer}} : ({_fts5_query(query)})"
+        params["scoped"] = f"user_id : {_fts5_phrase(user_id)} AND {params['query']}"
+    if after:
+        params["after_score"], params["after_id"] = after
+    result = await db.execute(
+        text(statement.format(after=_AFTER if after else "")).columns(timestamp=DateTime),
+        params,
+        bind_arguments=bind_arguments
+    )
+    return [dict(row) for row in result.mappings()]
@@ -0,0 +1,159 @@
+import os
+import time
+import atexit
+import logging
+import threading
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "5.0"))
+# How often quotas and today's totals (including other workers' usage) are reloaded
+USAGE_REFRESH_INTERVAL = float(os.getenv("USAGE_REFRESH_INTERVAL", "60.0"))
+
+logger = logging.getLogger(__name__)
+
+# (user_id, UTC day); unflushed counters per key are [prompt_tokens, completion_tokens, requests]
+Key = Tuple[str, date]
+
+
+def _today() -> date:
+    return datetime.utcnow().date()
+
+
+class UsageLedger:
+    """
+    In-memory per-user, per-day token counters flushed to the database in batches
+
+    record() only adds to a dict under a lock, so the request path never
+    waits on the database. A background thread writes the accumulated
+    deltas every flush interval (one upsert per user-day, not one per
+    request) and takes the stored totals back, so used_today() reflects
+    every worker's usage as of its last flush plus this worker's unflushed
+    deltas. Quotas are cached the same way and reloaded periodically.
+    """
+
+    def __init__(
+        self,
+        write_deltas: Callable[[Dict[Key, List[int]]], Dict[Key, int]],
+        load_state: Callable[[date], Tuple[Dict[str, Optional[int]], Dict[str, int]]],
+        flush_interval: float = USAGE_FLUSH_INTERVAL,
+        refresh_interval: float = USAGE_REFRESH_INTERVAL
+    ):
+        self._write_deltas = write_deltas
+        self._load_state = load_state
+        self.flush_interval = flush_interval
+        self.refresh_interval = refresh_interval
+        self._pending: Dict[Key, List[int]] = {}
+        # Stored totals (prompt + completion) as of the last flush or reload
+        self._stored: Dict[Key, int] = {}
+        self._quotas: Dict[str, Optional[int]] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._atexit_registered = False
+        self._next_refresh = 0.0
+        self._stats = {"recorded": 0, "flushes": 0, "rows_written": 0, "failed_flushes": 0}
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name="usage-ledger", daemon=True)
+                self._thread.start()
+                if not self._atexit_registered:
+                    atexit.register(self.stop)
+                    self._atexit_registered = True
+
+    def record(self, user_id: str, prompt_tokens: int, completion_tokens: int) -> None:
+        """Add one request's tokens to today's counters for the user"""
+        self._ensure_started()
+        key = (user_id, _today())
+        with self._lock:
+            counters = self._pending.get(key)
+            if counters is None:
+                self._pending[key] = [prompt_tokens, completion_tokens, 1]
+            else:
+                counters[0] += prompt_tokens
+                counters[1] += completion_tokens
+                counters[2] += 1
+            self._stats["recorded"] += 1
+
+    def used_today(self, user_id: str) -> int:
+        """Tokens the user consumed today (UTC), from memory only"""
+        self._ensure_started()
+        key = (user_id, _today())
+        with self._lock:
+            pending = self._pending.get(key)
+            return self._stored.get(key, 0) + (pending[0] + pending[1] if pending else 0)
+
+    def quota(self, user_id: str, default: Optional[int]) -> Optional[int]:
+        """The user's daily token limit from the cached quota table, else default (None = unlimited)"""
+        self._ensure_started()
+        return self._quotas.get(user_id, default)
+
+    def _run(self) -> None:
+        while True:
+            if self._next_refresh <= time.monotonic():
+                self._refresh()
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+            if self._stopping:
+                return
+
+    def flush(self) -> None:
+        """Write the accumulated deltas now; on failure they are kept for the next flush"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            totals = self._write_deltas(pending)
+        except Exception as ex:
+            # Put the deltas back so no usage is lost, and keep the thread alive
+            with self._lock:
+                for key, counters in pending.items():
+                    merged = self._pending.setdefault(key, [0, 0, 0])
+                    for i, value in enumerate(counters):
+                        merged[i] += value
+                self._stats["failed_flushes"] += 1
+            logger.error("usage.flush_failed", extra={"rows": len(pending), "error": str(ex)})
+            return
+        with self._lock:
+            self._stored.update(totals)
+            self._stats["flushes"] += 1
+            self._stats["rows_written"] += len(pending)
+
+    def _refresh(self) -> None:
+        today = _today()
+        try:
+            quotas, used = self._load_state(today)
+        except Exception as ex:
+            logger.error("usage.refresh_failed", extra={"error": str(ex)})
+            return
+        finally:
+            self._next_refresh = time.monotonic() + self.refresh_interval
+        with self._lock:
+            self._quotas = quotas
+            # Earlier days are no longer needed for quota checks
+            self._stored = {(user_id, today): total for user_id, total in used.items()}
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Flush the remaining deltas and stop the background thread"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        thread.join(timeout)
+        with self._lock:
+            self._thread = None
+
+    def stats(self) -> Dict[str, int]:
+        """Recorded, flush, written-row and failure counters plus unflushed user-days"""
+        with self._lock:
+            return dict(self._stats, pending=len(self._pending))
@@ -0,0 +1,85 @@
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import UserTokenUsage, UserQuota
+from utilities.database import get_db, read_replica
+from repository.usage_ledger import Key, UsageLedger
+from utilities.metrics import CounterFunc, GaugeFunc
+
+_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def write_usage_deltas(deltas: Dict[Key, List[int]]) -> Dict[Key, int]:
+    """
+    Add accumulated token counts to the per-user daily rows in one transaction
+
+    Returns:
+        The stored prompt + completion total of every written user-day
+    """
+    table = UserTokenUsage.__table__
+    db = next(get_db())
+    try:
+        insert = _INSERTS[db.get_bind().dialect.name](table)
+        # Increment in SQL so concurrent workers flushing the same user-day never lose counts
+        statement = insert.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.day],
+            set_={
+                "prompt_tokens": table.c.prompt_tokens + insert.excluded.prompt_tokens,
+                "completion_tokens": table.c.completion_tokens + insert.excluded.completion_tokens,
+                "requests": table.c.requests + insert.excluded.requests,
+            }
+        ).returning(table.c.user_id, table.c.day, table.c.prompt_tokens + table.c.completion_tokens)
+        totals = {}
+        # One row per user-day touched since the last flush, however many requests it covers
+        for (user_id, day), (prompt_tokens, completion_tokens, requests) in deltas.items():
+            row = db.execute(statement, {
+                "user_id": user_id, "day": day,
+                "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "requests": requests,
+            }).one()
+            totals[(row[0], row[1])] = row[2]
+        db.commit()
+        return totals
+    finally:
+        db.close()
+
+
+def load_usage_state(day: date) -> Tuple[Dict[str, Optional[int]], Dict[str, int]]:
+    """
+    Read every user's quota and the day's stored token totals
+
+    Returns:
+        Tuple of quotas (user_id -> daily token limit, None = unlimited) and
+        totals (user_id -> prompt + completion tokens)
+    """
+    db = next(get_db())
+    try:
+        quotas = dict(db.execute(select(UserQuota.user_id, UserQuota.daily_tokens)).all())
+        totals = dict(db.execute(
+            select(UserTokenUsage.user_id, UserTokenUsage.prompt_tokens + UserTokenUsage.completion_tokens)
+            .where(UserTokenUsage.day == day)
+        ).all())
+        return quotas, totals
+    finally:
+        db.close()
+
+
+# Accumulates usage in memory and writes it through write_usage_deltas
+usage_ledger = UsageLedger(write_usage_deltas, load_usage_state)
+CounterFunc(
+    "brainbox_usage_ledger_events", "Usage records accumulated, ledger flushes, rows written and failed flushes",
+    lambda: {(name,): value for name, value in usage_ledger.stats().items() if name != "pending"}, ("event",)
+)
+GaugeFunc("brainbox_usage_ledger_pending", "User-days with usage not yet written", lambda: usage_ledger.stats()["pending"])
+
+
+async def get_usage_days(db: AsyncSession, user_id: str, since: date) -> List[UserTokenUsage]:
+    """A user's stored daily usage rows from since onwards, newest first"""
+    result = await db.scalars(
+        select(UserTokenUsage)
+        .where(UserTokenUsage.user_id == user_id, UserTokenUsage.day >= since)
+        .order_by(UserTokenUsage.day.desc()),
+        bind_arguments=read_replica()
+    )
+    return result.all()
@@ -0,0 +1,60 @@
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from repository.archive_repository import get_idle_session_ids, archive_session
+from utilities.database import AsyncSessionLocal
+
+
+# Sessions with no new message for this many days move to cold storage
+ARCHIVE_IDLE_DAYS = float(os.getenv("ARCHIVE_IDLE_DAYS", "30"))
+# Sessions archived per transaction
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "100"))
+ARCHIVE_COMPRESS_LEVEL = int(os.getenv("ARCHIVE_COMPRESS_LEVEL", "6"))
+
+
+async def archive_idle_sessions(
+    idle_days: Optional[float] = None,
+    max_sessions: Optional[int] = None,
+    batch_size: int = ARCHIVE_BATCH_SIZE
+) -> Dict[str, int]:
+    """
+    Move the messages of idle sessions into compressed cold storage
+
+    Sessions are archived oldest first, ARCHIVE_BATCH_SIZE per transaction,
+    so the job can be stopped and rerun at any point. A session that gets
+    a new message while the job runs is left hot.
+
+    Args:
+        idle_days: Archive sessions idle for longer than this (default: ARCHIVE_IDLE_DAYS)
+        max_sessions: Stop after archiving this many sessions (default: no limit)
+        batch_size: Sessions per transaction
+
+    Returns:
+        Dictionary with the number of sessions and messages archived and
+        the JSON size of the messages before (raw_bytes) and after
+        (compressed_bytes) compression
+    """
+    idle_before = datetime.utcnow() - timedelta(days=ARCHIVE_IDLE_DAYS if idle_days is None else idle_days)
+    totals = {"sessions": 0, "messages": 0, "raw_bytes": 0, "compressed_bytes": 0}
+    # Sessions skipped this run (e.g. written meanwhile) are not picked again
+    skipped = set()
+
+    async with AsyncSessionLocal() as db:
+        while max_sessions is None or totals["sessions"] < max_sessions:
+            limit = batch_size if max_sessions is None else min(batch_size, max_sessions - totals["sessions"])
+            session_ids = [
+                session_id for session_id in await get_idle_session_ids(db, idle_before, limit + len(skipped))
+                if session_id not in skipped
+            ][:limit]
+            if not session_ids:
+                break
+            for session_id in session_ids:
+                archived = await archive_session(db, session_id, compress_level=ARCHIVE_COMPRESS_LEVEL)
+                if archived is None:
+                    skipped.add(session_id)
+                    continue
+                totals["sessions"] += 1
+                for key, value in archived.items():
+                    totals[key] += value
+            await db.commit()
+    return totals
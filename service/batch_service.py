@@ -0,0 +1,180 @@
+import os
+import asyncio
+from typing import Optional, Dict, Any, AsyncIterator, List, Tuple
+from repository.chat_repository import create_messages_bulk
+import repository.error_log_repository as error_repo
+from service.chatbot_service import load_chat_context, generate_answer
+from service.usage_service import QuotaExceededError, check_quota, record_usage
+from service.context_service import build_conversation_context
+from service.session_coordinator import session_lock
+from utilities.ai_client import LLMUsage
+from utilities.concurrency_limiter import LoadShedError
+from utilities.database import AsyncSessionLocal
+from utilities.prompt_registry import get_prompt
+
+
+# Maximum number of turns accepted in one batch
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+# Default and maximum number of turns generated concurrently per batch
+BATCH_MAX_PARALLEL = int(os.getenv("BATCH_MAX_PARALLEL", "8"))
+BATCH_PARALLEL_CAP = int(os.getenv("BATCH_PARALLEL_CAP", "64"))
+# Completed turns are inserted together once this many are ready or after the interval
+BATCH_FLUSH_SIZE = int(os.getenv("BATCH_FLUSH_SIZE", "50"))
+BATCH_FLUSH_INTERVAL = float(os.getenv("BATCH_FLUSH_INTERVAL", "0.05"))
+
+
+class _BulkTurnWriter:
+    """
+    Collects finished turns and persists them with one multi-row insert per
+    flush. If that insert fails, the turns are retried one at a time, so only
+    the turns that fail on their own are reported as failed.
+    """
+
+    def __init__(self, flush_size: int, flush_interval: float):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: set = set()
+
+    async def submit(self, turn: Dict[str, Any]):
+        """Queue a turn and wait until it has been committed; returns its ChatMessage"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((turn, future))
+        if len(self._pending) >= self.flush_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._start_flush)
+        return await future
+
+    def _start_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        task = asyncio.get_running_loop().create_task(self._flush(pending))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, pending: List[Tuple[Dict[str, Any], asyncio.Future]]) -> None:
+        try:
+            async with AsyncSessionLocal() as db:
+                messages = await create_messages_bulk(db, [turn for turn, _ in pending])
+                await db.commit()
+        except Exception as e:
+            if len(pending) > 1:
+                # One bad turn fails the whole insert; retry each on its own so only it fails
+                for item in pending:
+                    await self._flush([item])
+                return
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), message in zip(pending, messages):
+            if not future.done():
+                future.set_result(message)
+
+    async def close(self) -> None:
+        """Flush whatever is still pending and wait for in-progress flushes"""
+        self._start_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+
+async def process_chat_batch(
+    requests: List[Dict[str, Any]],
+    max_parallel: Optional[int] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Process many chat turns, yielding each result as soon as it is stored
+    
+    Turns on different sessions (and every new-session turn) run
+    concurrently, at most max_parallel at a time; turns on the same session
+    run in request order. Finished turns are persisted in bulk inserts.
+    A failing turn yields an error result and does not stop the batch.
+    
+    Args:
+        requests: Turns as dicts with message, session_id and user_id
+        max_parallel: Concurrent turn limit (defaults to BATCH_MAX_PARALLEL)
+        
+    Yields:
+        One result per request with its index and either "status": "ok" plus
+        session_id, session_name and message, or "status": "error" plus detail
+    """
+    parallel = min(max(max_parallel or BATCH_MAX_PARALLEL, 1), BATCH_PARALLEL_CAP)
+    semaphore = asyncio.Semaphore(parallel)
+    writer = _BulkTurnWriter(BATCH_FLUSH_SIZE, BATCH_FLUSH_INTERVAL)
+    results: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+    system_prompt = get_prompt("system")
+
+    # Group turns per session, keeping request order inside each group
+    groups: Dict[Any, List[Tuple[int, Dict[str, Any]]]] = {}
+    for index, request in enumerate(requests):
+        key = request.get("session_id") or ("new", index)
+        groups.setdefault(key, []).append((index, request))
+
+    async def run_turn(index: int, request: Dict[str, Any]) -> Dict[str, Any]:
+        session_id = request.get("session_id")
+        user_message = request["message"]
+        async with session_lock(session_id):
+            async with semaphore:
+                if session_id:
+                    async with AsyncSessionLocal() as db:
+                        session, conversation_history = await load_chat_context(db, session_id, user_message)
+                else:
+                    session, conversation_history = None, build_conversation_context(None, [], user_message)
+                billed_user = session.user_id if session else request.get("user_id")
+                check_quota(billed_user)
+                usage = LLMUsage()
+                ai_response = await generate_answer(user_message, conversation_history, system_prompt, usage)
+                record_usage(billed_user, usage)
+
+            message = await writer.submit({
+                "session_id": session_id,
+                "user_id": request.get("user_id"),
+                "question": user_message,
+                "answer": ai_response,
+                "prompt_version": system_prompt.version,
+                "prompt_tokens": usage.prompt_tokens,
+                "completion_tokens": usage.completion_tokens,
+                "llm_latency_ms": usage.latency_ms,
+            })
+        return {
+            "index": index,
+            "status": "ok",
+            "session_id": message.session_id,
+            "session_name": session.session_name if session else message.session.session_name,
+            "message": {
+                "message_id": message.id,
+                "question": message.question,
+                "answer": message.answer,
+                "prompt_version": message.prompt_version
+            }
+        }
+
+    async def run_group(items: List[Tuple[int, Dict[str, Any]]]) -> None:
+        for index, request in items:
+            try:
+                result = await run_turn(index, request)
+            except (LoadShedError, QuotaExceededError) as e:
+                result = {"index": index, "status": "error", "detail": str(e), "retry_after": e.retry_after}
+            except ValueError as e:
+                result = {"index": index, "status": "error", "detail": str(e)}
+            except Exception as e:
+                error_repo.log_exception(e)
+                result = {"index": index, "status": "error", "detail": f"An error occurred: {str(e)}"}
+            await results.put(result)
+
+    tasks = [asyncio.create_task(run_group(items)) for items in groups.values()]
+    try:
+        for _ in range(len(requests)):
+            yield await results.get()
+    finally:
+        # On client disconnect, stop outstanding turns; always persist finished ones
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await writer.close()
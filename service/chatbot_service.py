@@ -1,10 +1,35 @@
-from typing import Optional, Dict, Any
-from repository.chat_repository import create_session, get_session, get_all_histories, update_session, delete_session, create_message, get_recent_messages, get_messages_by_session
+import time
+import asyncio
+from typing import Optional, Dict, Any, AsyncIterator, List, Set, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import ChatSession, ChatMessage
+from repository.chat_repository import create_session, delete_session_if_empty, get_session_for_read, create_message, get_session_with_recent_messages, get_histories_page, get_messages_page
 import repository.error_log_repository as error_repo
-from utilities.ai_client import generate_chat_response
+import repository.recent_turns_cache as recent_turns_cache
+from repository.recent_turns_cache import SessionSnapshot
+from utilities.ai_client import LLMUsage, generate_chat_response, stream_chat_response, primary_model
+from utilities.concurrency_limiter import LoadShedError
+from utilities.database import AsyncSessionLocal
+from utilities.prompt_registry import PromptTemplate, get_prompt
+from service.session_coordinator import session_lock, single_flight
+from service.response_cache import get_cached_response, store_response
+from service.context_service import CONTEXT_MAX_TURNS, build_conversation_context
+from service.usage_service import QuotaExceededError, check_quota, record_usage
+from repository.search_repository import search_messages
+from repository.archive_repository import get_archived_messages, rehydrate_session
+from utilities.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, encode_cursor, decode_cursor, encode_rank_cursor, decode_rank_cursor
+from utilities.metrics import Histogram
 
 
-def process_chat_message(
+# Latency of each stage of a /api/chat turn
+chat_stage_seconds = Histogram("brainbox_chat_stage_seconds", "Latency of each stage of a chat turn", ("stage",))
+
+# Deletions of new sessions whose streamed first turn was not stored
+_discard_tasks: Set[asyncio.Task] = set()
+
+
+async def process_chat_message(
+    db: AsyncSession,
     user_message: str, 
     session_id: Optional[int] = None,
     user_id: Optional[str] = None
@@ -12,103 +37,424 @@ def process_chat_message(
     """
     Process a chat message and generate AI response
     
+    The whole turn runs on the request's unit of work: one read round trip
+    for an existing session before the LLM call and one write transaction
+    after it. No connection is held while waiting on the provider. Turns on
+    the same session are serialized, so each one sees the previous answer.
+    The turn is billed to the session's user (or user_id for a new chat)
+    and rejected up front if that user is over their daily token quota.
+    
     Args:
+        db: The request's database session
         user_message: The user's message
         session_id: Optional existing session ID
         user_id: Optional user identifier
         
     Returns:
         Dictionary containing session_id, user_message, ai_response, and timestamp
+        
+    Raises:
+        QuotaExceededError: If the user has used up their daily token quota
     """
     try:
-        # Create or get session
-        if session_id:
-            session = get_session(session_id)
-            if not session:
-                raise ValueError(f"Session with ID {session_id} not found")
-        else:
-            session = create_session(user_id=user_id)
-            
-        
-        # Get conversation history for context
-        conversation_history = get_conversation_history(session.id, limit=10)
+        # Turns on the same session run one at a time, in arrival order
+        started = time.perf_counter()
+        async with session_lock(session_id):
+            chat_stage_seconds.observe(time.perf_counter() - started, ("lock_wait",))
+
+            # Get session and conversation history for context
+            with chat_stage_seconds.time(("load_context",)):
+                if session_id:
+                    session, conversation_history = await load_chat_context(db, session_id, user_message)
+                else:
+                    session, conversation_history = None, build_conversation_context(None, [], user_message)
         
-        # Generate AI response
-        ai_response = generate_chat_response(
-            user_message=user_message,
-            conversation_history=conversation_history
-        )
+            billed_user = session.user_id if session else user_id
+            check_quota(billed_user)
+
+            # Pin the system prompt version for this turn
+            system_prompt = get_prompt("system")
+
+            # Generate AI response
+            usage = LLMUsage()
+            with chat_stage_seconds.time(("llm",)):
+                ai_response = await generate_answer(user_message, conversation_history, system_prompt, usage)
+            record_usage(billed_user, usage)
         
-        # Save user message
-        result = create_message(
-            session_id=session.id,
-            answer=ai_response,
-            question=user_message,
-        )
+            # Create the session (for new chats) and save the message in one transaction
+            if session is None:
+                with chat_stage_seconds.time(("create_session",)):
+                    session = await create_session(db, user_id=user_id)
+            with chat_stage_seconds.time(("create_message",)):
+                result = await create_message(
+                    db,
+                    session_id=session.id,
+                    answer=ai_response,
+                    question=user_message,
+                    prompt_version=system_prompt.version,
+                    prompt_tokens=usage.prompt_tokens,
+                    completion_tokens=usage.completion_tokens,
+                    llm_latency_ms=usage.latency_ms,
+                )
+            with chat_stage_seconds.time(("commit",)):
+                await db.commit()
 
-        return {
-            "session_id": session.id,
-            "session_name": session.session_name,
+            return {
+                "session_id": session.id,
+                "session_name": session.session_name,
                 "messages": [
                     {
                         "message_id": result.id,
                         "question": result.question,
-                        "answer": result.answer
+                        "answer": result.answer,
+                        "prompt_version": result.prompt_version
                     }
                 ],
-        }
+            }
     
+    except (LoadShedError, QuotaExceededError):
+        # Expected under overload or over quota; the client is told when to retry
+        raise
     except Exception as e:
         # Log error to database
         error_repo.log_exception(e)
         raise
 
 
-def get_conversation_history(session_id: int, limit: int = 10) -> list:
+async def generate_answer(
+    user_message: str,
+    conversation_history: list,
+    system_prompt: PromptTemplate,
+    usage: Optional[LLMUsage] = None
+) -> str:
     """
-    Get recent conversation history for context
+    Generate the answer for a turn; stateless questions may be answered from the response cache
     
     Args:
+        user_message: The user's message
+        conversation_history: History built for the turn
+        system_prompt: System prompt version pinned for the turn
+        usage: Optional; filled with token counts and latency when the LLM is called (left empty on a cache hit)
+        
+    Returns:
+        AI generated response
+    """
+    # Cached answers are looked up for the primary model; a fallback's answer is stored under its own model
+    ai_response = get_cached_response(user_message, system_prompt, primary_model()) if not conversation_history else None
+    if ai_response is None:
+        usage = usage if usage is not None else LLMUsage()
+        ai_response = await generate_chat_response(
+            user_message=user_message,
+            conversation_history=conversation_history,
+            system_prompt=system_prompt,
+            usage=usage
+        )
+        if not conversation_history:
+            store_response(user_message, system_prompt, usage.model, ai_response)
+    return ai_response
+
+
+async def process_idempotent_chat_message(
+    idempotency_key: str,
+    user_message: str, 
+    session_id: Optional[int] = None,
+    user_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Process a chat message at most once per idempotency key
+    
+    Concurrent or retried submissions with the same key share one LLM call
+    and one stored message. The shared turn runs on its own unit of work
+    because it can outlive the request that started it.
+    
+    Args:
+        idempotency_key: Client-supplied key identifying the submission
+        user_message: The user's message
+        session_id: Optional existing session ID
+        user_id: Optional user identifier
+        
+    Returns:
+        The same dictionary as process_chat_message
+    """
+    async def run_turn() -> Dict[str, Any]:
+        async with AsyncSessionLocal() as db:
+            return await process_chat_message(db, user_message, session_id=session_id, user_id=user_id)
+
+    key = (session_id, user_id, idempotency_key) if session_id is None else (session_id, idempotency_key)
+    return await single_flight(key, user_message, run_turn)
+
+
+async def load_chat_context(db: AsyncSession, session_id: int, user_message: str) -> Tuple[SessionSnapshot, list]:
+    """
+    Load a session and build its token-budgeted conversation history
+    
+    The recent-turns window is served from the write-through cache when
+    present; otherwise it is read in one round trip and cached. The read
+    transaction is ended before returning so the connection goes back to
+    the pool while the LLM call runs.
+    
+    Args:
+        db: The request's database session
         session_id: The session ID
-        limit: Maximum number of messages to retrieve
+        user_message: The user's message
         
     Returns:
-        List of message dictionaries with role and content
+        Tuple of the session and its conversation history
     """
-    messages = get_recent_messages(session_id, count=limit)
-    return [
-        [{"role": "user", "content": msg.question}, {"role": "assistant", "content": msg.answer}]
-        for msg in messages
-    ]
+    cached = recent_turns_cache.get_recent_turns(session_id)
+    if cached is None:
+        token = recent_turns_cache.begin_load(session_id)
+        session, messages = await get_session_with_recent_messages(db, session_id, count=CONTEXT_MAX_TURNS)
+        if session is not None and session.archived_at is not None:
+            # A new turn on an archived session moves its messages back to the hot table first
+            await rehydrate_session(db, session_id)
+            await db.commit()
+            session, messages = await get_session_with_recent_messages(db, session_id, count=CONTEXT_MAX_TURNS)
+        await db.commit()
+        if not session:
+            raise ValueError(f"Session with ID {session_id} not found")
+        cached = recent_turns_cache.populate(token, session, messages)
+    return cached.session, build_conversation_context(cached.session, cached.turns, user_message)
+
+
+async def prepare_chat_stream(
+    db: AsyncSession,
+    user_message: str,
+    session_id: Optional[int] = None,
+    user_id: Optional[str] = None
+) -> Tuple[ChatSession, list]:
+    """
+    Resolve the session and history for a streamed chat turn
+    
+    Unlike process_chat_message, a new session is created up front because
+    its ID is sent to the client before the first token; stream_chat_message
+    deletes it again if the turn is not stored. The quota is
+    checked here, before the response starts, so it can be refused with a
+    status code.
+    
+    Args:
+        db: The request's database session
+        user_message: The user's message
+        session_id: Optional existing session ID
+        user_id: Optional user identifier used when a new session is created
+        
+    Returns:
+        Tuple of the session and its conversation history
+        
+    Raises:
+        QuotaExceededError: If the user has used up their daily token quota
+    """
+    if session_id:
+        session, conversation_history = await load_chat_context(db, session_id, user_message)
+        check_quota(session.user_id)
+        return session, conversation_history
+    check_quota(user_id)
+    session = await create_session(db, user_id=user_id)
+    await db.commit()
+    return session, build_conversation_context(None, [], user_message)
 
 
-async def get_all_sessions(user_id: str) -> list:
-    chats = get_all_histories(user_id=user_id)
-    return [
-        {
-            "session_id": chat.id,
-            "session_name": chat.session_name,
-            "created_at": chat.created_at.isoformat(),
-            "updated_at": chat.updated_at.isoformat()
+def _discard_empty_session(session_id: int) -> None:
+    """Delete a session left without messages, in the background so it also runs while the stream is cancelled"""
+    async def discard() -> None:
+        try:
+            async with AsyncSessionLocal() as db:
+                await delete_session_if_empty(db, session_id)
+                await db.commit()
+        except Exception as e:
+            error_repo.log_exception(e)
+
+    task = asyncio.get_running_loop().create_task(discard())
+    _discard_tasks.add(task)
+    task.add_done_callback(_discard_tasks.discard)
+
+
+async def stream_chat_message(
+    session: ChatSession,
+    conversation_history: list,
+    user_message: str,
+    new_session: bool = False
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Stream an AI response for a chat message and persist it once complete
+    
+    The answer is only written through create_message after the provider
+    finishes, on a unit of work of its own since the request's session is
+    released before the response body is sent. If the consumer stops
+    iterating (client disconnect), the upstream stream is closed and the
+    partial answer is discarded, so the history only ever contains
+    completed turns. A new session whose first turn is not stored is
+    deleted again rather than left behind empty.
+    
+    Args:
+        session: The session the turn belongs to
+        conversation_history: History returned by prepare_chat_stream
+        user_message: The user's message
+        new_session: Whether prepare_chat_stream created the session for this turn
+        
+    Yields:
+        Event dictionaries with "event" and "data" keys: one "session" event,
+        a "token" event per content delta, then "done" or "error"
+    """
+    stored = False
+    try:
+        yield {
+            "event": "session",
+            "data": {"session_id": session.id, "session_name": session.session_name}
         }
-        for chat in chats
+
+        async with session_lock(session.id) as waited:
+            if waited:
+                # Another turn finished while this one queued; rebuild the context
+                async with AsyncSessionLocal() as db:
+                    _, conversation_history = await load_chat_context(db, session.id, user_message)
+
+            system_prompt = get_prompt("system")
+            usage = LLMUsage()
+            cached_answer = get_cached_response(user_message, system_prompt, primary_model()) if not conversation_history else None
+            if cached_answer is not None:
+                answer_parts = [cached_answer]
+                yield {"event": "token", "data": {"content": cached_answer}}
+            else:
+                answer_parts = []
+                async for token in stream_chat_response(
+                    user_message=user_message,
+                    conversation_history=conversation_history,
+                    system_prompt=system_prompt,
+                    usage=usage
+                ):
+                    answer_parts.append(token)
+                    yield {"event": "token", "data": {"content": token}}
+                record_usage(session.user_id, usage)
+                if not conversation_history:
+                    store_response(user_message, system_prompt, usage.model, "".join(answer_parts))
+
+            async with AsyncSessionLocal() as db:
+                result = await create_message(
+                    db,
+                    session_id=session.id,
+                    answer="".join(answer_parts),
+                    question=user_message,
+                    prompt_version=system_prompt.version,
+                    prompt_tokens=usage.prompt_tokens,
+                    completion_tokens=usage.completion_tokens,
+                    llm_latency_ms=usage.latency_ms,
+                )
+                await db.commit()
+            stored = True
+    except LoadShedError as e:
+        yield {"event": "error", "data": {"detail": str(e), "retry_after": e.retry_after}}
+        return
+    except Exception as e:
+        error_repo.log_exception(e)
+        yield {"event": "error", "data": {"detail": f"An error occurred: {str(e)}"}}
+        return
+    finally:
+        # Runs on errors and on client disconnect as well
+        if new_session and not stored:
+            _discard_empty_session(session.id)
+
+    yield {
+        "event": "done",
+        "data": {
+            "session_id": session.id,
+            "message_id": result.id,
+            "question": result.question,
+            "answer": result.answer,
+            "prompt_version": result.prompt_version
+        }
+    }
+
+
+async def get_all_sessions(
+    db: AsyncSession,
+    user_id: str,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Get one page of a user's sessions, most recently updated first
+    
+    Args:
+        db: The request's database session
+        user_id: The user identifier
+        limit: Maximum number of sessions to return
+        cursor: Continuation token from the previous page
+        
+    Returns:
+        Dictionary with the sessions and the next_cursor (None on the last page)
+    """
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    # Fetch one extra row to learn whether another page exists
+    chats = await get_histories_page(db, user_id=user_id, limit=limit + 1, before=decode_cursor(cursor))
+    next_cursor = None
+    if len(chats) > limit:
+        chats = chats[:limit]
+        next_cursor = encode_cursor(chats[-1].updated_at, chats[-1].id)
+
+    return {
+        "sessions": [
+            {
+                "session_id": chat.id,
+                "session_name": chat.session_name,
+                "created_at": chat.created_at.isoformat(),
+                "updated_at": chat.updated_at.isoformat(),
+                "message_count": chat.message_count,
+                "last_message_at": chat.last_message_at.isoformat() if chat.last_message_at else None,
+                "last_message_preview": chat.last_message_preview
+            }
+            for chat in chats
+        ],
+        "next_cursor": next_cursor
+    }
+
+def _merge_archived(
+    archived: List[Dict[str, Any]], hot: List[ChatMessage], after: Optional[Tuple[Any, int]], count: int
+) -> List[ChatMessage]:
+    """Page of an archived session's messages (plus any hot ones) after the keyset position"""
+    seen = {message.id for message in hot}
+    merged = hot + [
+        ChatMessage(**message) for message in archived
+        if message["id"] not in seen and (after is None or (message["timestamp"], message["id"]) > after)
     ]
+    merged.sort(key=lambda message: (message.timestamp, message.id))
+    return merged[:count]
+
 
-async def get_chat_history(session_id: int) -> Dict[str, Any]:
+async def get_chat_history(
+    db: AsyncSession,
+    session_id: int,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None
+) -> Dict[str, Any]:
     """
-    Get complete session history with all messages
+    Get session history with one page of messages
     
     Args:
+        db: The request's database session
         session_id: The session ID
+        limit: Maximum number of messages to return
+        cursor: Continuation token from the previous page
         
     Returns:
-        Dictionary with session info and messages
+        Dictionary with session info, messages and the next_cursor (None on the last page)
     """
-    session = get_session(session_id)
+    after = decode_cursor(cursor)
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+
+    session = await get_session_for_read(db, session_id)
     if not session:
         raise ValueError(f"Session with ID {session_id} not found")
     
-    messages = get_messages_by_session(session_id)
+    # Fetch one extra row to learn whether another page exists
+    messages = await get_messages_page(db, session_id, limit=limit + 1, after=after)
+    if session.archived_at is not None:
+        # Archived sessions are read from their compressed blob; reads never move them back
+        messages = _merge_archived(await get_archived_messages(db, session_id), messages, after, limit + 1)
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_cursor = encode_cursor(messages[-1].timestamp, messages[-1].id)
     
     return {
         "session_id": session.id,
@@ -120,8 +466,56 @@ async def get_chat_history(session_id: int) -> Dict[str, Any]:
                 "message_id": msg.id,
                 "question": msg.question,
                 "answer": msg.answer,
-                "timestamp": msg.timestamp.isoformat()
+                "timestamp": msg.timestamp.isoformat(),
+                "prompt_version": msg.prompt_version
             }
             for msg in messages
-        ]
+        ],
+        "next_cursor": next_cursor
+    }
+
+
+async def search_chat_history(
+    db: AsyncSession,
+    user_id: str,
+    query: str,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Full-text search across a user's chat history, best match first
+    
+    Args:
+        db: The request's database session
+        user_id: The user identifier
+        query: Search terms
+        limit: Maximum number of results to return
+        cursor: Continuation token from the previous page
+        
+    Returns:
+        Dictionary with the matching messages (with highlighted snippets) and the next_cursor (None on the last page)
+    """
+    after = decode_rank_cursor(cursor)
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+
+    # Fetch one extra row to learn whether another page exists
+    rows = await search_messages(db, user_id, query, limit=limit + 1, after=after)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_rank_cursor(rows[-1]["score"], rows[-1]["message_id"])
+
+    return {
+        "results": [
+            {
+                "message_id": row["message_id"],
+                "session_id": row["session_id"],
+                "session_name": row["session_name"],
+                "question": row["question"],
+                "snippet": row["snippet"],
+                "timestamp": row["timestamp"].isoformat() if row["timestamp"] else None
+            }
+            for row in rows
+        ],
+        "next_cursor": next_cursor
     }
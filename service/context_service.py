@@ -0,0 +1,219 @@
+import os
+import asyncio
+from typing import Optional, Dict, Any, List, Set
+from models import ChatSession, ChatMessage
+from repository.chat_repository import get_session, get_recent_messages, get_messages_between, update_session_summary
+from repository.recent_turns_cache import RECENT_TURNS_WINDOW
+import repository.error_log_repository as error_repo
+from utilities.ai_client import summarize_conversation
+from utilities.prompt_registry import get_prompt
+from utilities.database import AsyncSessionLocal
+from utilities.metrics import CounterFunc, GaugeFunc
+
+
+# Token budget for conversation history (summary + verbatim turns) per request.
+# Turns waiting to be folded into the summary are sent on top of it, so the
+# history can exceed it by up to SUMMARY_MIN_TURNS turns
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+# Number of most recent turns fetched alongside the session (and cached per session)
+CONTEXT_MAX_TURNS = RECENT_TURNS_WINDOW
+# Maximum number of turns folded into the summary per summarization call
+SUMMARY_BATCH_TURNS = int(os.getenv("SUMMARY_BATCH_TURNS", "50"))
+# Turns that must be waiting outside the verbatim window before they are
+# folded, so a long session costs one summarization call per this many turns
+# rather than one per turn
+SUMMARY_MIN_TURNS = int(os.getenv("SUMMARY_MIN_TURNS", "5"))
+# At most this many newest turns are sent verbatim; the rest of the fetched
+# window holds the turns waiting to be folded, so none fall out unseen
+VERBATIM_MAX_TURNS = max(CONTEXT_MAX_TURNS - SUMMARY_MIN_TURNS, 1)
+_FOLD_AFTER_TURNS = max(CONTEXT_MAX_TURNS - VERBATIM_MAX_TURNS, 1)
+
+# Token counts are estimate_tokens() estimates, not tokenizer counts
+_stats: Dict[str, int] = {
+    "requests": 0,
+    "estimated_prompt_tokens": 0,
+    "max_estimated_prompt_tokens": 0,
+    "turns_sent": 0,
+    "turns_over_budget": 0,
+    "summaries_generated": 0,
+    "turns_summarized": 0,
+}
+
+# Sessions with a summary update in flight, and the tasks running them
+_summarizing: Set[int] = set()
+_summary_tasks: Set[asyncio.Task] = set()
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Cheap token estimate (~4 characters per token) used for budgeting"""
+    return len(text) // 4 + 1 if text else 0
+
+
+def _turn_tokens(message: ChatMessage) -> int:
+    return estimate_tokens(message.question) + estimate_tokens(message.answer)
+
+
+def _unsummarized(session: ChatSession, messages: List[ChatMessage]) -> List[ChatMessage]:
+    """Drop turns that are already folded into the session summary"""
+    if session.summary_message_id is None:
+        return list(messages)
+    return [message for message in messages if message.id > session.summary_message_id]
+
+
+def _split_by_budget(session: ChatSession, messages: List[ChatMessage]) -> int:
+    """
+    Find where the verbatim window starts
+    
+    Walks the unsummarized turns newest first until the budget left after
+    the summary is used up or VERBATIM_MAX_TURNS turns are taken.
+    
+    Returns:
+        Index of the oldest turn that still fits; turns before it need folding
+    """
+    remaining = CONTEXT_TOKEN_BUDGET - estimate_tokens(session.summary)
+    start = len(messages)
+    for index in range(len(messages) - 1, max(len(messages) - VERBATIM_MAX_TURNS, 0) - 1, -1):
+        remaining -= _turn_tokens(messages[index])
+        if remaining < 0:
+            break
+        start = index
+    return start
+
+
+def build_conversation_context(
+    session: Optional[ChatSession],
+    messages: List[ChatMessage],
+    user_message: str
+) -> List[Dict[str, str]]:
+    """
+    Build the conversation history sent with a chat turn
+    
+    Fills the token budget with the newest turns first, prefixed by the
+    session's rolling summary. Turns that no longer fit are still sent
+    verbatim until they are folded into the summary, which happens in the
+    background in one call once SUMMARY_MIN_TURNS of them are waiting, so
+    no turn is ever missing from both.
+    
+    Args:
+        session: The session, or None for a brand-new chat
+        messages: Recent messages in chronological order
+        user_message: The user's message, counted in the prompt stats
+        
+    Returns:
+        Flat list of message dictionaries with role and content
+    """
+    history: List[Dict[str, str]] = []
+    if session is not None:
+        messages = _unsummarized(session, messages)
+        start = _split_by_budget(session, messages)
+        # Turns before start did not fit; they stay in the prompt until
+        # folded, and are folded once enough are waiting
+        if start >= _FOLD_AFTER_TURNS:
+            schedule_summary_update(session.id)
+
+        if session.summary:
+            history.append({"role": "system", "content": f"Summary of the earlier conversation: {session.summary}"})
+        for message in messages:
+            history.append({"role": "user", "content": message.question})
+            history.append({"role": "assistant", "content": message.answer})
+        _stats["turns_sent"] += len(messages)
+        _stats["turns_over_budget"] += start
+
+    prompt_tokens = estimate_tokens(get_prompt("system").text) + estimate_tokens(user_message)
+    prompt_tokens += sum(estimate_tokens(entry["content"]) for entry in history)
+    _stats["requests"] += 1
+    _stats["estimated_prompt_tokens"] += prompt_tokens
+    _stats["max_estimated_prompt_tokens"] = max(_stats["max_estimated_prompt_tokens"], prompt_tokens)
+    return history
+
+
+def schedule_summary_update(session_id: int) -> None:
+    """Start a background summary update for a session unless one is already running"""
+    if session_id in _summarizing:
+        return
+    _summarizing.add(session_id)
+    task = asyncio.get_running_loop().create_task(update_session_summary_for(session_id))
+    _summary_tasks.add(task)
+    task.add_done_callback(_summary_tasks.discard)
+
+
+async def update_session_summary_for(session_id: int) -> None:
+    """
+    Fold turns that fell out of the token budget into the session's rolling summary
+    
+    Only the turns newer than the last summarized message are sent along
+    with the previous summary, so the summary is extended rather than
+    regenerated from the full history.
+    
+    Args:
+        session_id: The session ID
+    """
+    try:
+        async with AsyncSessionLocal() as db:
+            while True:
+                session = await get_session(db, session_id)
+                if session is None:
+                    return
+                recent = _unsummarized(session, await get_recent_messages(db, session_id, count=CONTEXT_MAX_TURNS))
+                start = _split_by_budget(session, recent)
+                # Everything older than the verbatim window gets folded
+                keep_from_id = recent[start].id if start < len(recent) else None
+                to_fold = await get_messages_between(
+                    db,
+                    session_id,
+                    after_id=session.summary_message_id,
+                    before_id=keep_from_id,
+                    limit=SUMMARY_BATCH_TURNS
+                )
+                await db.commit()
+                if not to_fold:
+                    return
+
+                summary = await summarize_conversation(
+                    previous_summary=session.summary,
+                    turns=[(message.question, message.answer) for message in to_fold]
+                )
+                await update_session_summary(db, session_id, summary=summary, summary_message_id=to_fold[-1].id)
+                await db.commit()
+
+                _stats["summaries_generated"] += 1
+                _stats["turns_summarized"] += len(to_fold)
+                if len(to_fold) < SUMMARY_BATCH_TURNS:
+                    return
+    except Exception as e:
+        error_repo.log_exception(e)
+    finally:
+        _summarizing.discard(session_id)
+
+
+def get_context_stats() -> Dict[str, Any]:
+    """
+    Get prompt size statistics for chat requests
+    
+    Returns:
+        Dictionary with request count, estimated prompt tokens (total, average,
+        max), verbatim turns sent (and how many of them were over the budget,
+        waiting to be summarized) and summary counters
+    """
+    stats: Dict[str, Any] = dict(_stats)
+    stats["avg_estimated_prompt_tokens"] = stats["estimated_prompt_tokens"] / stats["requests"] if stats["requests"] else 0.0
+    return stats
+
+
+# Context builder counters for /metrics; token counts are ~4 chars/token estimates
+CounterFunc("brainbox_context_requests", "Chat turns whose conversation context was built", lambda: _stats["requests"])
+CounterFunc(
+    "brainbox_context_estimated_prompt_tokens", "Estimated prompt tokens (characters / 4, not a tokenizer count) across chat turns",
+    lambda: _stats["estimated_prompt_tokens"]
+)
+GaugeFunc(
+    "brainbox_context_estimated_prompt_tokens_max", "Largest estimated prompt (characters / 4) sent for a chat turn",
+    lambda: _stats["max_estimated_prompt_tokens"]
+)
+CounterFunc("brainbox_context_turns_sent", "History turns sent verbatim", lambda: _stats["turns_sent"])
+CounterFunc(
+    "brainbox_context_turns_over_budget", "Verbatim turns sent over the token budget because they are not summarized yet",
+    lambda: _stats["turns_over_budget"]
+)
+CounterFunc("brainbox_context_summaries_generated", "Rolling-summary updates", lambda: _stats["summaries_generated"])
+CounterFunc("brainbox_context_turns_summarized", "Turns folded into rolling summaries", lambda: _stats["turns_summarized"])
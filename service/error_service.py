@@ -6,27 +6,29 @@ def log_application_error(
     error_type: str, 
     error_message: str, 
     stack_trace: Optional[str] = None
-) -> int:
+) -> str:
     """
     Log an application error
     
+    The entry is queued for the background error log writer, so this never
+    blocks on the database.
+    
     Args:
         error_type: Type/category of the error
         error_message: Error message
         stack_trace: Optional stack trace
         
     Returns:
-        ID of the created error log entry
+        Fingerprint the entry is grouped under
     """
-    error_log = error_repo.log_error(
+    return error_repo.log_error(
         error_type=error_type,
         error_message=error_message,
         stack_trace=stack_trace
     )
-    return error_log.id
 
 
-def log_exception(exception: Exception) -> int:
+def log_exception(exception: Exception) -> str:
     """
     Log an exception with full stack trace
     
@@ -34,7 +36,16 @@ def log_exception(exception: Exception) -> int:
         exception: The exception to log
         
     Returns:
-        ID of the created error log entry
+        Fingerprint the entry is grouped under
+    """
+    return error_repo.log_exception(exception)
+
+
+def flush_error_logs(timeout: float = 5.0) -> None:
+    """
+    Flush queued error log entries and stop the background writer
+    
+    Args:
+        timeout: Seconds to wait for the writer to finish
     """
-    error_log = error_repo.log_exception(exception)
-    return error_log.id
+    error_repo.error_log_writer.stop(timeout=timeout)
@@ -0,0 +1,209 @@
+import os
+import json
+import zlib
+from datetime import datetime
+from typing import Optional, Dict, Any, AsyncIterator, List, Set, Union
+from repository.export_repository import stream_sessions_with_messages, insert_sessions, insert_messages
+from repository.chat_repository import refresh_session_stats
+from repository.archive_repository import decode_messages
+from utilities.database import AsyncSessionLocal
+
+
+# Rows buffered per server-side cursor fetch, and rows written per import transaction
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+# Compressed output is flushed to the client at least this often (bytes of input)
+GZIP_FLUSH_BYTES = 64 * 1024
+
+
+class ImportFormatError(ValueError):
+    """Raised when an import line is not a valid export record"""
+
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def _message_line(session_id: int, message_id: int, message: Any) -> str:
+    return json.dumps({
+        "type": "message",
+        "session_id": session_id,
+        "message_id": message_id,
+        "question": message["question"],
+        "answer": message["answer"],
+        "timestamp": _isoformat(message["timestamp"]),
+        "prompt_version": message["prompt_version"],
+        "prompt_tokens": message["prompt_tokens"],
+        "completion_tokens": message["completion_tokens"],
+        "llm_latency_ms": message["llm_latency_ms"],
+    }) + "\n"
+
+
+async def export_sessions(user_id: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Export sessions and their messages as NDJSON, in constant memory
+
+    Each session is written as a {"type": "session"} line followed by one
+    {"type": "message"} line per message, oldest first; archived sessions'
+    messages are decoded from their compressed blob. Rows are read
+    through a server-side cursor on a dedicated database session, so this
+    is safe to hand to a StreamingResponse.
+
+    Args:
+        user_id: Only export this user's sessions (default: all sessions)
+
+    Yields:
+        One JSON document per line, newline-terminated
+    """
+    async with AsyncSessionLocal() as db:
+        current_session = None
+        async for row in stream_sessions_with_messages(db, user_id=user_id, batch_size=EXPORT_BATCH_SIZE):
+            if row.session_id != current_session:
+                current_session = row.session_id
+                yield json.dumps({
+                    "type": "session",
+                    "session_id": row.session_id,
+                    "user_id": row.user_id,
+                    "session_name": row.session_name,
+                    "created_at": _isoformat(row.created_at),
+                    "updated_at": _isoformat(row.updated_at),
+                    "summary": row.summary,
+                }) + "\n"
+                if row.archive_payload is not None:
+                    for message in decode_messages(row.archive_payload, row.session_id):
+                        yield _message_line(row.session_id, message["id"], message)
+            if row.message_id is not None:
+                yield _message_line(row.session_id, row.message_id, row._mapping)
+
+
+async def gzip_stream(chunks: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    """Gzip-compress a text stream incrementally, flushing every GZIP_FLUSH_BYTES of input"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    pending = 0
+    async for chunk in chunks:
+        data = chunk.encode()
+        pending += len(data)
+        out = compressor.compress(data)
+        if pending >= GZIP_FLUSH_BYTES:
+            out += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+async def gunzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Decompress a gzip byte stream incrementally"""
+    decompressor = zlib.decompressobj(31)
+    async for chunk in chunks:
+        out = decompressor.decompress(chunk)
+        if out:
+            yield out
+    out = decompressor.flush()
+    if out:
+        yield out
+
+
+async def _iter_lines(chunks: AsyncIterator[Union[bytes, str]]) -> AsyncIterator[str]:
+    """Split a byte or text stream into lines without buffering more than one line"""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk.encode() if isinstance(chunk, str) else chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode()
+    if buffer:
+        yield buffer.decode()
+
+
+async def import_sessions(chunks: AsyncIterator[Union[bytes, str]]) -> Dict[str, int]:
+    """
+    Import an NDJSON export, in batches and constant memory
+
+    Sessions get new IDs and each message is attached to the session line
+    that precedes it. Sessions are inserted with one batched statement per
+    batch and messages with COPY (Postgres) or batched executemany. Every
+    IMPORT_BATCH_SIZE messages are committed together, along with the
+    message stats of the sessions they touch, so a failure part way leaves
+    the earlier batches imported. Rolling summaries are not
+    imported, since they point at message IDs that change; they are rebuilt
+    when the conversation next outgrows its context budget.
+
+    Args:
+        chunks: The NDJSON body as bytes or text chunks
+
+    Returns:
+        Dictionary with the number of sessions and messages imported
+    """
+    counts = {"sessions": 0, "messages": 0}
+    # Export session ID -> imported session ID; only IDs, so memory stays small
+    id_map: Dict[int, int] = {}
+    pending_sessions: List[Dict[str, Any]] = []
+    pending_source_ids: List[int] = []
+    pending_source_set: Set[int] = set()
+    pending_messages: List[Dict[str, Any]] = []
+    line_number = 0
+
+    async with AsyncSessionLocal() as db:
+        async def flush() -> None:
+            if pending_sessions:
+                new_ids = await insert_sessions(db, pending_sessions)
+                id_map.update(zip(pending_source_ids, new_ids))
+                counts["sessions"] += len(new_ids)
+                pending_sessions.clear()
+                pending_source_ids.clear()
+                pending_source_set.clear()
+            if pending_messages:
+                for message in pending_messages:
+                    message["session_id"] = id_map[message["session_id"]]
+                await insert_messages(db, pending_messages)
+                # COPY bypasses the per-turn counters, so recompute the touched sessions
+                await refresh_session_stats(db, {message["session_id"] for message in pending_messages})
+                counts["messages"] += len(pending_messages)
+                pending_messages.clear()
+            await db.commit()
+
+        async for line in _iter_lines(chunks):
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                record_type = record["type"]
+                source_session_id = record["session_id"]
+                if record_type == "session":
+                    pending_sessions.append({
+                        "user_id": record.get("user_id"),
+                        "session_name": record.get("session_name"),
+                        "created_at": _parse_datetime(record.get("created_at")) or datetime.utcnow(),
+                        "updated_at": _parse_datetime(record.get("updated_at")) or datetime.utcnow(),
+                    })
+                    pending_source_ids.append(source_session_id)
+                    pending_source_set.add(source_session_id)
+                elif record_type == "message":
+                    if source_session_id not in id_map and source_session_id not in pending_source_set:
+                        raise ImportFormatError(f"message for session {source_session_id} before its session line")
+                    pending_messages.append({
+                        "session_id": source_session_id,
+                        "question": record["question"],
+                        "answer": record["answer"],
+                        "timestamp": _parse_datetime(record.get("timestamp")) or datetime.utcnow(),
+                        "prompt_version": record.get("prompt_version"),
+                        "prompt_tokens": record.get("prompt_tokens"),
+                        "completion_tokens": record.get("completion_tokens"),
+                        "llm_latency_ms": record.get("llm_latency_ms"),
+                    })
+                else:
+                    raise ImportFormatError(f"unknown record type {record_type!r}")
+            except (ValueError, KeyError, TypeError) as e:
+                await db.rollback()
+                raise ImportFormatError(f"Invalid record on line {line_number}: {e}") from e
+
+            if len(pending_messages) >= IMPORT_BATCH_SIZE or len(pending_sessions) >= IMPORT_BATCH_SIZE:
+                await flush()
+        await flush()
+    return counts
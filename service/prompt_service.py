@@ -0,0 +1,111 @@
+import os
+import logging
+import threading
+from typing import List, Dict, Any, Optional
+import repository.prompt_repository as prompt_repo
+from utilities import prompt_registry
+
+
+# How often every worker checks the pinned versions and reloads the ones another worker changed; 0 = off
+PROMPT_REFRESH_INTERVAL = float(os.getenv("PROMPT_REFRESH_INTERVAL", "30"))
+
+logger = logging.getLogger(__name__)
+
+_refresh_stop = threading.Event()
+_refresh_thread: Optional[threading.Thread] = None
+
+
+def load_prompts() -> List[Dict[str, Any]]:
+    """
+    Load the pinned prompt versions from the prompts table into the in-memory registry
+    
+    Called at startup, whenever a version is published or pinned, and by the
+    periodic refresh when another worker changed a pin. The chat hot path only
+    reads the registry and never queries the database.
+    
+    Returns:
+        The active prompt type/version pairs after loading
+    """
+    prompt_registry.install(prompt_repo.get_active_prompts())
+    return prompt_registry.list_active()
+
+
+def publish_prompt(prompt_type: str, prompt_text: str) -> Dict[str, Any]:
+    """
+    Store a new version of a prompt, pin it and reload the registry
+    
+    Other workers pick the new version up within PROMPT_REFRESH_INTERVAL seconds.
+    
+    Args:
+        prompt_type: Prompt type, e.g. 'system' or 'summary'
+        prompt_text: Template text; ${name} placeholders are allowed
+        
+    Returns:
+        Dictionary with the new prompt's id, type and version
+    """
+    prompt = prompt_repo.create_prompt_version(prompt_text=prompt_text, prompt_type=prompt_type)
+    load_prompts()
+    return {"prompt_id": prompt.id, "prompt_type": prompt.prompt_type, "version": prompt.version}
+
+
+def pin_prompt(prompt_id: int) -> Dict[str, Any]:
+    """
+    Pin an existing prompt version (e.g. to roll back) and reload the registry
+    
+    Args:
+        prompt_id: ID of the prompt version to pin
+        
+    Returns:
+        Dictionary with the pinned prompt's id, type and version
+    """
+    prompt = prompt_repo.activate_prompt(prompt_id)
+    if not prompt:
+        raise ValueError(f"Prompt with ID {prompt_id} not found")
+    load_prompts()
+    return {"prompt_id": prompt.id, "prompt_type": prompt.prompt_type, "version": prompt.version}
+
+
+def refresh_prompts() -> bool:
+    """
+    Reload the registry if the pinned versions differ from the loaded ones
+    
+    Reads only the (prompt_type, id) pairs of the pinned rows, so an
+    unchanged table costs one small query.
+    
+    Returns:
+        True if the registry was reloaded
+    """
+    if dict(prompt_repo.get_active_prompt_ids()) == prompt_registry.active_ids():
+        return False
+    load_prompts()
+    return True
+
+
+def _run_refresh() -> None:
+    while not _refresh_stop.wait(PROMPT_REFRESH_INTERVAL):
+        try:
+            if refresh_prompts():
+                logger.info("prompts.reloaded", extra={"prompts": prompt_registry.list_active()})
+        except Exception as ex:
+            # Keep serving the loaded versions and try again next interval
+            logger.error("prompts.refresh_failed", extra={"error": str(ex)})
+
+
+def start_prompt_refresh() -> None:
+    """Start the background thread checking for versions pinned by other workers"""
+    global _refresh_thread
+    if PROMPT_REFRESH_INTERVAL <= 0 or _refresh_thread is not None:
+        return
+    _refresh_stop.clear()
+    _refresh_thread = threading.Thread(target=_run_refresh, name="prompt-refresh", daemon=True)
+    _refresh_thread.start()
+
+
+def stop_prompt_refresh(timeout: float = 5.0) -> None:
+    """Stop the background refresh thread"""
+    global _refresh_thread
+    if _refresh_thread is None:
+        return
+    _refresh_stop.set()
+    _refresh_thread.join(timeout)
+    _refresh_thread = None
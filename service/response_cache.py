@@ -0,0 +1,95 @@
+import os
+import hashlib
+from typing import Optional, Dict, Any, List
+from utilities.prompt_registry import PromptTemplate
+from utilities.cache import LRUTTLCache
+from utilities.metrics import CounterFunc, GaugeFunc
+
+
+# Cache of answers to stateless (no history) questions. Off by default.
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+
+_cache = LRUTTLCache(max_size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+
+# Cache counters for /metrics, read at scrape time
+_COUNTED = ("hits", "misses", "evictions", "expirations")
+CounterFunc(
+    "brainbox_response_cache_events", "Response cache lookups by outcome, plus evicted and expired entries",
+    lambda: {(name,): value for name, value in _cache.stats().items() if name in _COUNTED}, ("event",)
+)
+GaugeFunc("brainbox_response_cache_entries", "Answers held in the response cache", lambda: _cache.stats()["size"])
+GaugeFunc("brainbox_response_cache_enabled", "Whether the response cache is on (1) or off (0)", lambda: int(RESPONSE_CACHE_ENABLED))
+
+
+class CachedResponse:
+    """A cached answer and how often it has been served"""
+
+    def __init__(self, question: str, answer: str):
+        self.question = question
+        self.answer = answer
+        self.hits = 0
+
+
+def set_response_cache_enabled(enabled: bool) -> None:
+    """Turn the response cache on or off at runtime"""
+    global RESPONSE_CACHE_ENABLED
+    RESPONSE_CACHE_ENABLED = enabled
+    if not enabled:
+        _cache.clear()
+
+
+def normalize_message(user_message: str) -> str:
+    """Normalize a question so trivially different phrasings share an entry"""
+    return " ".join(user_message.lower().split()).rstrip("?!. ")
+
+
+def _cache_key(user_message: str, system_prompt: PromptTemplate, model: Optional[str]) -> str:
+    # A published system prompt version or another model changes the key, so their answers are not mixed
+    raw = "\0".join([model or "", str(system_prompt.version), system_prompt.text, normalize_message(user_message)])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def get_cached_response(user_message: str, system_prompt: PromptTemplate, model: Optional[str]) -> Optional[str]:
+    """
+    Look up the answer to a first-turn question
+    
+    Args:
+        user_message: The user's message
+        system_prompt: System prompt version pinned for the turn
+        model: Model the turn would be answered by
+        
+    Returns:
+        The cached answer, or None on a miss or when the cache is disabled
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    entry = _cache.get(_cache_key(user_message, system_prompt, model))
+    if entry is None:
+        return None
+    entry.hits += 1
+    return entry.answer
+
+
+def store_response(user_message: str, system_prompt: PromptTemplate, model: Optional[str], answer: str) -> None:
+    """Cache the answer to a first-turn question under the prompt version and model that produced it"""
+    if RESPONSE_CACHE_ENABLED and answer:
+        _cache.set(_cache_key(user_message, system_prompt, model), CachedResponse(user_message, answer))
+
+
+def get_response_cache_stats(top: int = 10) -> Dict[str, Any]:
+    """
+    Get response cache counters and the most-served entries
+    
+    Args:
+        top: Number of entries to include, by hit count
+        
+    Returns:
+        Dictionary with enabled flag, cache counters and per-entry hit counts
+    """
+    entries: List[CachedResponse] = _cache.values()
+    entries.sort(key=lambda entry: entry.hits, reverse=True)
+    stats: Dict[str, Any] = dict(_cache.stats(), enabled=RESPONSE_CACHE_ENABLED)
+    stats["top_entries"] = [{"question": entry.question[:100], "hits": entry.hits} for entry in entries[:top]]
+    return stats
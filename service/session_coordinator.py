@@ -0,0 +1,128 @@
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+from utilities.cache import LRUTTLCache
+from utilities.metrics import CounterFunc, GaugeFunc
+
+
+# How long a finished idempotent result is replayed to late retries
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "60"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+
+# Per-session lock and the number of turns holding or waiting on it
+_session_locks: Dict[int, List[Any]] = {}
+
+# Idempotency key -> (message, shared task) for turns still running
+_inflight: Dict[Hashable, Tuple[str, "asyncio.Task"]] = {}
+_completed = LRUTTLCache(max_size=IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_TTL)
+
+_stats: Dict[str, int] = {
+    "serialized_turns": 0,
+    "coalesced": 0,
+    "replayed": 0,
+}
+
+
+class IdempotencyConflictError(Exception):
+    """Raised when an idempotency key is reused with a different message"""
+
+
+@asynccontextmanager
+async def session_lock(session_id: Optional[int]) -> AsyncIterator[bool]:
+    """
+    Serialize chat turns on one session within this worker
+    
+    Yields:
+        True if the turn had to wait behind another one on the same session
+    """
+    if session_id is None:
+        yield False
+        return
+
+    entry = _session_locks.get(session_id)
+    if entry is None:
+        entry = _session_locks[session_id] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        # Count holders and waiters rather than asking the lock: right after a
+        # release it reads unlocked while the woken waiter has not run yet
+        waited = entry[1] > 1
+        if waited:
+            _stats["serialized_turns"] += 1
+        async with entry[0]:
+            yield waited
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _session_locks[session_id]
+
+
+async def single_flight(
+    key: Hashable,
+    message: str,
+    work: Callable[[], Awaitable[Dict[str, Any]]]
+) -> Dict[str, Any]:
+    """
+    Run work once per idempotency key and share the result
+    
+    Concurrent callers with the same key await the same task, so they share
+    one upstream call and one stored message. The task is not tied to any
+    caller, so a disconnecting client does not cancel it for the others.
+    Results are replayed to retries for IDEMPOTENCY_TTL seconds; failures
+    are not, so a retry after an error runs again.
+    
+    Args:
+        key: Idempotency key, scoped by the caller (e.g. with the session ID)
+        message: The user's message, which must match for a shared result
+        work: Coroutine function producing the result
+        
+    Returns:
+        The result of the single execution
+    """
+    completed = _completed.get(key)
+    if completed is not None:
+        completed_message, result = completed
+        if completed_message != message:
+            raise IdempotencyConflictError("Idempotency key was already used with a different message")
+        _stats["replayed"] += 1
+        return result
+
+    inflight = _inflight.get(key)
+    if inflight is not None:
+        inflight_message, task = inflight
+        if inflight_message != message:
+            raise IdempotencyConflictError("Idempotency key is in use with a different message")
+        _stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    task = asyncio.get_running_loop().create_task(work())
+    _inflight[key] = (message, task)
+
+    def _finish(done: "asyncio.Task") -> None:
+        _inflight.pop(key, None)
+        if not done.cancelled() and done.exception() is None:
+            _completed.set(key, (message, done.result()))
+
+    task.add_done_callback(_finish)
+    return await asyncio.shield(task)
+
+
+def get_coordination_stats() -> Dict[str, int]:
+    """
+    Get per-session serialization and single-flight counters
+    
+    Returns:
+        Dictionary with serialized, coalesced and replayed turn counts plus
+        the number of locked sessions and in-flight idempotent turns
+    """
+    return dict(_stats, locked_sessions=len(_session_locks), inflight=len(_inflight))
+
+
+# Coordination counters for /metrics, read at scrape time
+CounterFunc(
+    "brainbox_chat_turn_coordination", "Chat turns that waited on their session's lock, or were coalesced or replayed by idempotency key",
+    lambda: {(name,): value for name, value in _stats.items()}, ("event",)
+)
+GaugeFunc("brainbox_chat_locked_sessions", "Sessions with a chat turn running or waiting in this worker", lambda: len(_session_locks))
+GaugeFunc("brainbox_chat_idempotent_turns_in_flight", "Idempotent chat turns still running", lambda: len(_inflight))
@@ -0,0 +1,101 @@
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from repository.usage_repository import usage_ledger, get_usage_days
+from utilities.ai_client import LLMUsage
+
+
+# Daily token limit (prompt + completion, UTC day) for users without a row in
+# user_quotas; 0 = unlimited
+USAGE_DEFAULT_DAILY_TOKENS = int(os.getenv("USAGE_DEFAULT_DAILY_TOKENS", "0"))
+
+
+class QuotaExceededError(Exception):
+    """Raised when a user has used up their daily token quota"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def check_quota(user_id: Optional[str]) -> None:
+    """
+    Reject a turn if the user is over their daily token quota
+
+    Reads the in-memory ledger only, so the check adds no database round
+    trip. Turns without a user are not metered. A turn that starts under
+    the limit may finish over it; the next one is rejected.
+
+    Args:
+        user_id: The user the turn is billed to
+
+    Raises:
+        QuotaExceededError: With retry_after set to the seconds until the quota resets
+    """
+    if not user_id:
+        return
+    limit = usage_ledger.quota(user_id, USAGE_DEFAULT_DAILY_TOKENS or None)
+    if limit is None:
+        return
+    if usage_ledger.used_today(user_id) >= limit:
+        now = datetime.utcnow()
+        reset = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        raise QuotaExceededError(
+            f"Daily token quota of {limit} exceeded",
+            retry_after=max((reset - now).total_seconds(), 1)
+        )
+
+
+def record_usage(user_id: Optional[str], usage: LLMUsage) -> None:
+    """
+    Add a turn's tokens to the user's daily counters
+
+    Args:
+        user_id: The user the turn is billed to
+        usage: Usage filled in by the LLM call; answers served from cache carry none
+    """
+    if not user_id or usage.latency_ms is None:
+        return
+    usage_ledger.record(user_id, usage.prompt_tokens or 0, usage.completion_tokens or 0)
+
+
+async def get_user_usage(db: AsyncSession, user_id: str, days: int = 30) -> Dict[str, Any]:
+    """
+    Get a user's daily token usage and quota
+
+    Args:
+        db: The request's database session
+        user_id: The user identifier
+        days: Number of days to report, including today
+
+    Returns:
+        Dictionary with the quota, today's live total and one entry per day
+        (stored totals, which trail live usage by up to one flush interval)
+    """
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    rows = await get_usage_days(db, user_id, since)
+    return {
+        "user_id": user_id,
+        "daily_quota": usage_ledger.quota(user_id, USAGE_DEFAULT_DAILY_TOKENS or None),
+        "used_today": usage_ledger.used_today(user_id),
+        "days": [
+            {
+                "day": row.day.isoformat(),
+                "prompt_tokens": row.prompt_tokens,
+                "completion_tokens": row.completion_tokens,
+                "requests": row.requests
+            }
+            for row in rows
+        ]
+    }
+
+
+def flush_usage(timeout: float = 5.0) -> None:
+    """
+    Write out accumulated usage and stop the ledger's background thread
+
+    Args:
+        timeout: Seconds to wait for the final flush
+    """
+    usage_ledger.stop(timeout=timeout)
@@ -0,0 +1,69 @@
+import os
+import sys
+import asyncio
+import tempfile
+
+# Point every engine at a throwaway SQLite file before the app modules read their configuration
+_db_dir = tempfile.mkdtemp(prefix="brainbox-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_dir}/test.db"
+os.environ["ASYNC_DATABASE_URL"] = f"sqlite+aiosqlite:///{_db_dir}/test.db"
+os.environ.pop("ASYNC_READ_DATABASE_URL", None)
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import delete
+from models import Prompt
+from utilities import prompt_registry
+from utilities.database import SessionLocal, async_engine, init_db
+import service.chatbot_service as chatbot_service
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    init_db()
+
+
+def run(coro):
+    """Run a coroutine on a fresh event loop, releasing pooled connections bound to it afterwards"""
+    async def main():
+        try:
+            return await coro
+        finally:
+            await async_engine.dispose()
+    return asyncio.run(main())
+
+
+class FakeLLM:
+    """Stands in for generate_chat_response, recording the history each call was given"""
+
+    def __init__(self, delay: float = 0.01):
+        self.delay = delay
+        self.calls = []
+
+    async def __call__(self, user_message, conversation_history=None, system_prompt=None, usage=None):
+        self.calls.append((user_message, list(conversation_history or [])))
+        await asyncio.sleep(self.delay)
+        return f"answer to {user_message}"
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    llm = FakeLLM()
+    monkeypatch.setattr(chatbot_service, "generate_chat_response", llm)
+    return llm
+
+
+def _reset_prompts():
+    with SessionLocal() as db:
+        db.execute(delete(Prompt))
+        db.commit()
+    prompt_registry.install([])
+
+
+@pytest.fixture
+def clean_prompts():
+    """Start and end with no stored prompt versions and the built-in defaults active"""
+    _reset_prompts()
+    yield
+    _reset_prompts()
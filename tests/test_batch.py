@@ -0,0 +1,38 @@
+import uuid
+from sqlalchemy import func, select
+import service.batch_service as batch_service
+from conftest import run
+from models import ChatMessage
+from utilities.database import AsyncSessionLocal
+
+
+def test_failed_bulk_insert_only_fails_the_offending_turn(fake_llm, monkeypatch):
+    create_messages_bulk = batch_service.create_messages_bulk
+    inserts = []
+
+    async def failing_on_poison(db, turns):
+        inserts.append(len(turns))
+        if any(turn["question"].startswith("poison") for turn in turns):
+            raise ValueError("value too long for column")
+        return await create_messages_bulk(db, turns)
+
+    monkeypatch.setattr(batch_service, "create_messages_bulk", failing_on_poison)
+    monkeypatch.setattr(batch_service, "BATCH_FLUSH_SIZE", 3)
+    monkeypatch.setattr(batch_service, "BATCH_FLUSH_INTERVAL", 10.0)
+    tag = uuid.uuid4().hex
+    questions = [f"first {tag}", f"poison {tag}", f"third {tag}"]
+
+    async def scenario():
+        results = [result async for result in batch_service.process_chat_batch([{"message": q} for q in questions])]
+        async with AsyncSessionLocal() as db:
+            stored = await db.scalar(select(func.count()).select_from(ChatMessage).where(ChatMessage.question.contains(tag)))
+        return sorted(results, key=lambda result: result["index"]), stored
+
+    results, stored = run(scenario())
+
+    assert [result["status"] for result in results] == ["ok", "error", "ok"]
+    assert results[0]["message"]["answer"] == f"answer to first {tag}"
+    assert "value too long" in results[1]["detail"]
+    # One bulk insert of all three, then one insert per turn
+    assert inserts == [3, 1, 1, 1]
+    assert stored == 2
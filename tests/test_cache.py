@@ -0,0 +1,21 @@
+import pytest
+from utilities.cache import CacheBackend, LRUTTLCache
+
+
+def test_backend_must_implement_the_full_interface():
+    class NoValues(CacheBackend):
+        def get(self, key): return None
+        def peek(self, key): return None
+        def set(self, key, value): pass
+        def delete(self, key): pass
+        def clear(self): pass
+        def stats(self): return {}
+
+    with pytest.raises(TypeError, match="values"):
+        NoValues()
+
+    cache = LRUTTLCache(max_size=2, ttl=60)
+    for key in ("a", "b", "c"):
+        cache.set(key, key.upper())
+    assert cache.values() == ["B", "C"]
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,62 @@
+import asyncio
+import uuid
+import service.chatbot_service as chatbot_service
+from conftest import run
+from models import ChatSession
+from service.chatbot_service import prepare_chat_stream, stream_chat_message
+from utilities.concurrency_limiter import LoadShedError
+from utilities.database import AsyncSessionLocal
+
+
+async def _shed(user_message, conversation_history=None, system_prompt=None, usage=None):
+    raise LoadShedError("Upstream is saturated (queue full), retry later", retry_after=2)
+    yield
+
+
+async def _answer(user_message, conversation_history=None, system_prompt=None, usage=None):
+    for token in ("streamed ", "answer"):
+        yield token
+
+
+async def _stream_new_session(events_to_read=None):
+    """Stream a first turn; returns the session ID, the events read, and whether the session still exists"""
+    async with AsyncSessionLocal() as db:
+        session, history = await prepare_chat_stream(db, f"hi {uuid.uuid4()}", user_id="streamer")
+    stream = stream_chat_message(session, history, "hi", new_session=True)
+    events = []
+    async for event in stream:
+        events.append(event["event"])
+        if len(events) == events_to_read:
+            # The client goes away
+            await stream.aclose()
+            break
+    await asyncio.gather(*chatbot_service._discard_tasks)
+    async with AsyncSessionLocal() as db:
+        return events, await db.get(ChatSession, session.id)
+
+
+def test_failed_first_turn_does_not_leave_an_empty_session(monkeypatch):
+    monkeypatch.setattr(chatbot_service, "stream_chat_response", _shed)
+
+    events, session = run(_stream_new_session())
+
+    assert events == ["session", "error"]
+    assert session is None
+
+
+def test_abandoned_first_turn_does_not_leave_an_empty_session(monkeypatch):
+    monkeypatch.setattr(chatbot_service, "stream_chat_response", _answer)
+
+    events, session = run(_stream_new_session(events_to_read=2))
+
+    assert events == ["session", "token"]
+    assert session is None
+
+
+def test_completed_first_turn_keeps_its_session(monkeypatch):
+    monkeypatch.setattr(chatbot_service, "stream_chat_response", _answer)
+
+    events, session = run(_stream_new_session())
+
+    assert events == ["session", "token", "token", "done"]
+    assert session is not None and session.message_count == 1
@@ -0,0 +1,75 @@
+import types
+import pytest
+import utilities.circuit_breaker as circuit_breaker
+from utilities.circuit_breaker import CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(circuit_breaker, "time", types.SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def test_opens_after_consecutive_failures_and_rejects_until_cooldown(clock):
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=10.0)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    clock.now += 4.0
+    assert not breaker.allow()
+    assert breaker.retry_after() == 6.0
+    assert breaker.stats()["opened"] == 1 and breaker.stats()["rejected"] == 1
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=10.0)
+    breaker.record_failure()
+    clock.now += 10.0
+
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_probe_reopens_for_a_full_cooldown(clock):
+    breaker = CircuitBreaker(failure_threshold=5, cooldown=10.0)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.now += 10.0
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.retry_after() == 10.0
+    assert breaker.stats()["opened"] == 2
+
+
+def test_released_probe_can_be_claimed_again(clock):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=10.0)
+    breaker.record_failure()
+    clock.now += 10.0
+    assert breaker.allow()
+
+    # The probe call was cancelled without an outcome
+    breaker.release_probe()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
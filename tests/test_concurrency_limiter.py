@@ -0,0 +1,200 @@
+import asyncio
+import types
+import uuid
+import httpx
+import pytest
+import service.chatbot_service as chatbot_service
+import utilities.concurrency_limiter as concurrency_limiter
+from conftest import FakeLLM, run
+from utilities.concurrency_limiter import AdaptiveConcurrencyLimiter, LoadShedError
+
+
+class Overloaded(Exception):
+    """Stands in for a 429 / gateway timeout from the provider"""
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Only the limiter's clock is faked; the event loop keeps real time
+    clock = FakeClock()
+    monkeypatch.setattr(concurrency_limiter, "time", types.SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def _limiter(**options):
+    settings = dict(initial_limit=2, min_limit=1, max_limit=4, max_queue=1, queue_timeout=5.0, backoff=0.5)
+    settings.update(options)
+    return AdaptiveConcurrencyLimiter(is_overload=lambda error: isinstance(error, Overloaded), **settings)
+
+
+async def _call(limiter, clock, llm, seconds, error=None):
+    """One upstream call through the limiter, taking seconds on the fake clock"""
+    async with limiter.slot():
+        clock.now += seconds
+        answer = await llm("hello")
+        if error is not None:
+            raise error
+        return answer
+
+
+def test_success_grows_limit_by_one_per_limits_worth_of_calls(clock):
+    limiter, llm = _limiter(), FakeLLM(delay=0)
+
+    async def scenario():
+        for _ in range(4):
+            await _call(limiter, clock, llm, 0.1)
+
+    run(scenario())
+
+    # 2 -> 2.5 -> 2.9 -> 3.24 -> 3.55
+    assert limiter.limit == pytest.approx(3.5530, abs=1e-3)
+    assert limiter.stats()["limit"] == 3
+    assert limiter.stats()["increases"] == 4
+
+
+def test_limit_never_grows_past_max(clock):
+    limiter, llm = _limiter(), FakeLLM(delay=0)
+
+    async def scenario():
+        for _ in range(50):
+            await _call(limiter, clock, llm, 0.1)
+
+    run(scenario())
+
+    assert limiter.limit == 4
+    assert limiter.stats()["increases"] < 50
+
+
+def test_overload_cuts_limit_once_per_average_latency(clock):
+    limiter, llm = _limiter(initial_limit=4), FakeLLM(delay=0)
+
+    async def scenario():
+        with pytest.raises(Overloaded):
+            await _call(limiter, clock, llm, 1.0, Overloaded())
+        # Same congestion episode: within one average latency of the last cut
+        with pytest.raises(Overloaded):
+            await _call(limiter, clock, llm, 0.0, Overloaded())
+        assert limiter.limit == 2
+        clock.now += 1.0
+        with pytest.raises(Overloaded):
+            await _call(limiter, clock, llm, 0.0, Overloaded())
+        assert limiter.limit == 1
+        clock.now += 1.0
+        # Floored at min_limit
+        with pytest.raises(Overloaded):
+            await _call(limiter, clock, llm, 0.0, Overloaded())
+
+    run(scenario())
+
+    assert limiter.limit == 1
+    assert limiter.stats()["decreases"] == 3
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_slow_call_counts_as_overload_and_other_errors_leave_limit(clock):
+    limiter, llm = _limiter(initial_limit=4, latency_target=2.0), FakeLLM(delay=0)
+
+    async def scenario():
+        with pytest.raises(ValueError):
+            await _call(limiter, clock, llm, 0.1, ValueError("bad request"))
+        assert limiter.limit == 4
+        await _call(limiter, clock, llm, 3.0)
+
+    run(scenario())
+
+    assert limiter.limit == 2
+    assert limiter.stats()["decreases"] == 1
+    assert limiter.stats()["increases"] == 0
+
+
+def test_queue_is_fifo_and_bounded(clock):
+    limiter, llm = _limiter(initial_limit=1, max_queue=1), FakeLLM(delay=0)
+
+    async def scenario():
+        await limiter.acquire()
+        queued = asyncio.ensure_future(_call(limiter, clock, llm, 0.1))
+        await asyncio.sleep(0)
+        assert limiter.stats()["queue_depth"] == 1
+        # Queue full: shed at once instead of waiting
+        with pytest.raises(LoadShedError, match="queue full"):
+            await limiter.acquire()
+        limiter.release(0.1)
+        return await queued
+
+    assert run(scenario()) == "answer to hello"
+    stats = limiter.stats()
+    assert (stats["admitted"], stats["queued"], stats["shed"]) == (2, 1, 1)
+    assert (stats["in_flight"], stats["queue_depth"]) == (0, 0)
+
+
+def test_waiter_is_shed_after_queue_timeout(clock):
+    limiter = _limiter(initial_limit=1, queue_timeout=0.01)
+
+    async def scenario():
+        await limiter.acquire()
+        with pytest.raises(LoadShedError, match="queue deadline exceeded"):
+            await limiter.acquire()
+
+    run(scenario())
+
+    assert limiter.stats()["queue_depth"] == 0
+    assert limiter.stats()["shed"] == 1
+
+
+def test_retry_after_follows_average_latency(clock):
+    limiter, llm = _limiter(initial_limit=1, max_limit=1, max_queue=0, queue_timeout=4.0), FakeLLM(delay=0)
+
+    async def shed_retry_after():
+        await limiter.acquire()
+        try:
+            with pytest.raises(LoadShedError) as shed:
+                await limiter.acquire()
+            return shed.value.retry_after
+        finally:
+            limiter.release(0.0)
+
+    # No latency seen yet: the queue timeout
+    assert run(shed_retry_after()) == 4.0
+
+    limiter, llm = _limiter(initial_limit=1, max_limit=1, max_queue=0, queue_timeout=4.0), FakeLLM(delay=0)
+
+    async def slow_then_shed():
+        await _call(limiter, clock, llm, 2.2)
+        return await shed_retry_after()
+
+    # Seconds rounded up, never below one
+    assert run(slow_then_shed()) == 3.0
+
+
+def test_shed_chat_turn_returns_503_with_retry_after(clock, monkeypatch):
+    limiter, llm = _limiter(initial_limit=1, max_limit=1, max_queue=0), FakeLLM(delay=0)
+
+    async def limited_llm(*args, **kwargs):
+        async with limiter.slot():
+            return await llm(*args, **kwargs)
+
+    monkeypatch.setattr(chatbot_service, "generate_chat_response", limited_llm)
+    from main import app
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            await _call(limiter, clock, llm, 6.5)
+            # Saturate the only slot; the chat turn finds no room in the queue
+            await limiter.acquire()
+            try:
+                return await client.post("/api/chat", json={"message": f"hi {uuid.uuid4()}"})
+            finally:
+                limiter.release(0.0)
+
+    response = run(scenario())
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "7"
@@ -0,0 +1,38 @@
+import service.context_service as context_service
+from models import ChatMessage, ChatSession
+
+
+def _turns(count, start_id=1):
+    return [
+        ChatMessage(id=start_id + index, session_id=1, question=f"question {start_id + index} " + "x" * 200, answer="answer " + "y" * 200)
+        for index in range(count)
+    ]
+
+
+def test_turns_over_budget_stay_verbatim_until_folded(monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(context_service, "schedule_summary_update", scheduled.append)
+    # Room for two turns (~101 tokens each) per request
+    monkeypatch.setattr(context_service, "CONTEXT_TOKEN_BUDGET", 250)
+    session = ChatSession(id=1, summary=None, summary_message_id=None)
+
+    # Two turns over the budget, fewer than SUMMARY_MIN_TURNS: still sent, no fold yet
+    history = context_service.build_conversation_context(session, _turns(4), "next")
+    assert [entry["content"] for entry in history if entry["role"] == "user"] == [
+        message.question for message in _turns(4)
+    ]
+    assert scheduled == []
+
+    # Enough turns waiting: a fold is scheduled, and they are sent until it lands
+    turns = _turns(2 + context_service._FOLD_AFTER_TURNS)
+    history = context_service.build_conversation_context(session, turns, "next")
+    assert len(history) == 2 * len(turns)
+    assert scheduled == [1]
+
+    # Once folded, only the summary and the newer turns are sent
+    session.summary, session.summary_message_id = "Earlier: questions 1-3.", 3
+    history = context_service.build_conversation_context(session, turns, "next")
+    assert history[0] == {"role": "system", "content": "Summary of the earlier conversation: Earlier: questions 1-3."}
+    assert [entry["content"] for entry in history if entry["role"] == "user"] == [
+        message.question for message in turns[3:]
+    ]
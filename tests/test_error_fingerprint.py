@@ -0,0 +1,19 @@
+import traceback
+from repository.error_log_repository import error_fingerprint
+
+
+def _trace(session_id):
+    try:
+        raise ValueError(f"Session with ID {session_id} not found")
+    except ValueError as e:
+        return "".join(traceback.format_exception(type(e), e, e.__traceback__))
+
+
+def test_traces_differing_only_in_message_values_share_a_fingerprint():
+    assert error_fingerprint("ValueError", "a", _trace(42)) == error_fingerprint("ValueError", "b", _trace(7))
+
+
+def test_messages_without_trace_are_normalized():
+    assert error_fingerprint("TimeoutError", "timed out after 30s on 'primary'") == \
+        error_fingerprint("TimeoutError", "timed out after 5s on 'replica'")
+    assert error_fingerprint("TimeoutError", "timed out") != error_fingerprint("KeyError", "timed out")
@@ -0,0 +1,45 @@
+import json
+import uuid
+from sqlalchemy import select
+from conftest import run
+from models import ChatSession, ChatMessage
+from repository.archive_repository import archive_session
+from repository.chat_repository import create_session, create_message
+from service.export_service import export_sessions, import_sessions
+from utilities.database import AsyncSessionLocal
+
+
+async def _chunks(lines):
+    for line in lines:
+        yield line
+
+
+def test_export_and_import_keep_per_message_usage():
+    user_id = f"export-{uuid.uuid4()}"
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            hot = await create_session(db, user_id=user_id)
+            await create_message(db, hot.id, "q1", "a1", prompt_tokens=11, completion_tokens=7, llm_latency_ms=300)
+            cold = await create_session(db, user_id=user_id)
+            await create_message(db, cold.id, "q2", "a2", prompt_tokens=5, completion_tokens=3, llm_latency_ms=90)
+            await db.commit()
+            await archive_session(db, cold.id)
+            await db.commit()
+
+        lines = [line async for line in export_sessions(user_id=user_id)]
+        await import_sessions(_chunks(lines))
+        async with AsyncSessionLocal() as db:
+            imported = (await db.execute(
+                select(ChatMessage.question, ChatMessage.prompt_tokens, ChatMessage.completion_tokens, ChatMessage.llm_latency_ms)
+                .join(ChatSession).where(ChatSession.user_id == user_id, ChatSession.id.notin_([hot.id, cold.id]))
+                .order_by(ChatMessage.question)
+            )).all()
+        return lines, imported
+
+    lines, imported = run(scenario())
+
+    exported = [json.loads(line) for line in lines if json.loads(line)["type"] == "message"]
+    assert {(m["question"], m["prompt_tokens"], m["completion_tokens"], m["llm_latency_ms"]) for m in exported} == \
+        {("q1", 11, 7, 300), ("q2", 5, 3, 90)}
+    assert [tuple(row) for row in imported] == [("q1", 11, 7, 300), ("q2", 5, 3, 90)]
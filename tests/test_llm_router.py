@@ -0,0 +1,264 @@
+import asyncio
+import types
+import pytest
+from conftest import run
+from utilities.circuit_breaker import CircuitBreaker, CLOSED, HALF_OPEN
+from utilities.concurrency_limiter import AdaptiveConcurrencyLimiter
+from utilities.llm_router import LLMProvider, LLMRouter
+
+
+class ProviderDown(Exception):
+    """A failure that moves the call to the next provider"""
+
+
+class FakeStream:
+    """Completion stream whose first chunk waits for gate, if one is given"""
+
+    def __init__(self, chunks, gate=None):
+        self.chunks = list(chunks)
+        self.gate = gate
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.gate is not None:
+            await self.gate.wait()
+            self.gate = None
+        if not self.chunks:
+            raise StopAsyncIteration
+        return self.chunks.pop(0)
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    """OpenAI-shaped client whose create() runs respond(stream)"""
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.calls = 0
+        self.cancelled = 0
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+
+    async def create(self, model, messages, stream=False, extra_body=None):
+        self.calls += 1
+        try:
+            return await self.respond(stream)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+    async def close(self):
+        pass
+
+
+def answer(text, delay=0.0):
+    async def respond(stream):
+        await asyncio.sleep(delay)
+        return text
+    return respond
+
+
+async def never(stream):
+    await asyncio.Event().wait()
+
+
+def fail(error):
+    async def respond(stream):
+        raise error
+    return respond
+
+
+def _provider(name, respond, breaker=None):
+    client = FakeClient(respond)
+    provider = LLMProvider(name, f"{name}-model", lambda: client, breaker or CircuitBreaker(3, 30.0))
+    return provider, client
+
+
+def _router(*providers, **options):
+    settings = dict(
+        hedge_percentile=95, hedge_delay=0.01, hedge_min_delay=0.01, hedge_max_ratio=1.0,
+        is_failover_error=lambda error: isinstance(error, ProviderDown), min_samples=1000,
+    )
+    settings.update(options)
+    return LLMRouter(list(providers), **settings)
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    primary, primary_client = _provider("primary", never)
+    secondary, secondary_client = _provider("secondary", answer("from secondary"))
+    router = _router(primary, secondary)
+
+    provider, response = run(router.complete([]))
+
+    assert (provider, response) == (secondary, "from secondary")
+    assert primary_client.cancelled == 1
+    assert router.stats()["hedges"] == 1
+    assert (primary._stats["cancelled"], secondary._stats["won"], secondary._stats["hedges"]) == (1, 1, 1)
+
+
+def test_fast_primary_is_not_hedged():
+    primary, _ = _provider("primary", answer("from primary"))
+    secondary, secondary_client = _provider("secondary", answer("from secondary"))
+    router = _router(primary, secondary, hedge_delay=5.0)
+
+    assert run(router.complete([])) == (primary, "from primary")
+    assert secondary_client.calls == 0
+
+
+def test_failover_on_provider_failure_only():
+    primary, _ = _provider("primary", fail(ProviderDown("503")), CircuitBreaker(1, 30.0))
+    secondary, _ = _provider("secondary", answer("from secondary"))
+    router = _router(primary, secondary, hedge_max_ratio=0)
+
+    assert run(router.complete([])) == (secondary, "from secondary")
+    assert secondary._stats["failovers"] == 1
+    assert primary.breaker.state == "open"
+    # The open circuit is skipped without a call
+    assert run(router.complete([])) == (secondary, "from secondary")
+    assert primary._stats["calls"] == 1
+
+    # A caller error is not the provider's fault: raised, no failover, breaker untouched
+    primary, _ = _provider("primary", fail(ValueError("bad request")))
+    secondary, secondary_client = _provider("secondary", answer("from secondary"))
+    with pytest.raises(ValueError):
+        run(_router(primary, secondary, hedge_max_ratio=0).complete([]))
+    assert secondary_client.calls == 0
+    assert primary.breaker.state == CLOSED
+
+
+def test_hedges_are_capped_at_max_ratio():
+    # Every call is slow enough to be hedged; the hedge never answers
+    primary, _ = _provider("primary", answer("from primary", delay=0.05))
+    secondary, secondary_client = _provider("secondary", never)
+    router = _router(primary, secondary, hedge_delay=0.005, hedge_max_ratio=0.2)
+
+    async def scenario():
+        for _ in range(10):
+            assert await router.complete([]) == (primary, "from primary")
+
+    run(scenario())
+
+    # A hedge is allowed while hedges < 0.2 * calls + 1: on calls 1, 2 and 6
+    assert router.stats()["hedges"] == secondary_client.calls == secondary_client.cancelled == 3
+
+
+def test_hedge_needs_a_free_limiter_slot():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1, min_limit=1, max_limit=1, max_queue=0, queue_timeout=1.0)
+    primary, _ = _provider("primary", answer("from primary", delay=0.05))
+    secondary, secondary_client = _provider("secondary", answer("from secondary"))
+    router = _router(primary, secondary, limiter=limiter)
+
+    async def scenario():
+        # The caller's slot is the only one, so the hedge is skipped
+        async with limiter.slot():
+            result = await router.complete([])
+        limiter.limit = limiter.max_limit = 2
+        async with limiter.slot():
+            hedged = await router.complete([])
+            in_flight = limiter.in_flight
+        return result, hedged, in_flight
+
+    result, hedged, in_flight = run(scenario())
+
+    assert result == (primary, "from primary")
+    assert router.stats()["hedges_skipped"] == 1
+    assert hedged == (secondary, "from secondary")
+    # The hedge's slot is back once complete() returns; only the caller's is held
+    assert in_flight == 1
+    assert limiter.in_flight == 0
+
+
+def test_losing_stream_waiting_for_first_chunk_is_closed():
+    streams = {}
+
+    async def primary_respond(stream):
+        streams["primary"] = FakeStream(["late"], gate=asyncio.Event())
+        return streams["primary"]
+
+    async def secondary_respond(stream):
+        streams["secondary"] = FakeStream(["hello", " world"])
+        return streams["secondary"]
+
+    primary, _ = _provider("primary", primary_respond)
+    secondary, _ = _provider("secondary", secondary_respond)
+    router = _router(primary, secondary)
+
+    async def scenario():
+        provider, stream = await router.complete([], stream=True)
+        return provider, [chunk async for chunk in stream]
+
+    assert run(scenario()) == (secondary, ["hello", " world"])
+    assert streams["primary"].closed
+    assert not streams["secondary"].closed
+
+
+def test_losing_stream_with_first_chunk_in_is_closed():
+    # The hedge releases the primary's first chunk, so both finish before the router looks
+    streams = {}
+
+    async def primary_respond(stream):
+        streams["primary"] = FakeStream(["a"], gate=asyncio.Event())
+        return streams["primary"]
+
+    async def secondary_respond(stream):
+        streams["primary"].gate.set()
+        streams["secondary"] = FakeStream(["b"])
+        return streams["secondary"]
+
+    primary, _ = _provider("primary", primary_respond)
+    secondary, _ = _provider("secondary", secondary_respond)
+    router = _router(primary, secondary)
+
+    async def scenario():
+        provider, stream = await router.complete([], stream=True)
+        return provider, [chunk async for chunk in stream]
+
+    provider, chunks = run(scenario())
+
+    loser = "secondary" if provider is primary else "primary"
+    assert chunks == (["a"] if provider is primary else ["b"])
+    assert streams[loser].closed
+    assert not streams[provider.name].closed
+
+
+def test_half_open_probes_are_released_by_losers_and_unused_candidates():
+    primary, _ = _provider("primary", never, CircuitBreaker(1, 0.0))
+    secondary, _ = _provider("secondary", answer("from secondary"), CircuitBreaker(1, 0.0))
+    third, third_client = _provider("third", answer("from third"), CircuitBreaker(1, 0.0))
+    for provider in (primary, secondary, third):
+        provider.breaker.record_failure()
+    router = _router(primary, secondary, third)
+
+    assert run(router.complete([])) == (secondary, "from secondary")
+
+    # The cancelled primary and the unused third give their probe back
+    assert primary.breaker.state == HALF_OPEN and primary.breaker.allow()
+    assert third_client.calls == 0
+    assert third.breaker.state == HALF_OPEN and third.breaker.allow()
+    assert secondary.breaker.state == CLOSED
+
+
+def test_cancelled_call_cancels_every_attempt():
+    primary, primary_client = _provider("primary", never, CircuitBreaker(1, 0.0))
+    secondary, secondary_client = _provider("secondary", never)
+    primary.breaker.record_failure()
+    router = _router(primary, secondary)
+
+    async def scenario():
+        call = asyncio.ensure_future(router.complete([]))
+        while secondary_client.calls == 0:
+            await asyncio.sleep(0.005)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+
+    run(scenario())
+
+    assert (primary_client.cancelled, secondary_client.cancelled) == (1, 1)
+    assert (primary._stats["cancelled"], secondary._stats["cancelled"]) == (1, 1)
+    # The primary's half-open probe is free again
+    assert primary.breaker.allow()
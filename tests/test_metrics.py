@@ -0,0 +1,99 @@
+import pytest
+import uuid
+from conftest import run
+import repository.recent_turns_cache as recent_turns_cache
+import service.response_cache as response_cache
+from service.chatbot_service import process_chat_message
+from utilities.database import AsyncSessionLocal
+from utilities.metrics import render_metrics
+from utilities.prompt_registry import PromptTemplate
+
+
+def _samples():
+    return {
+        line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+        for line in render_metrics().splitlines() if line and not line.startswith("#")
+    }
+
+
+@pytest.fixture
+def response_cache_on(monkeypatch):
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_ENABLED", True)
+    yield
+    response_cache._cache.clear()
+
+
+def test_response_cache_counters_are_published(response_cache_on):
+    prompt = PromptTemplate("system", "Be brief.", version=3)
+    before = _samples()
+
+    assert response_cache.get_cached_response("What is DNS?", prompt, "model-a") is None
+    response_cache.store_response("What is DNS?", prompt, "model-a", "A name lookup system.")
+    assert response_cache.get_cached_response("what is dns", prompt, "model-a") == "A name lookup system."
+    # Another model's answer is not served
+    assert response_cache.get_cached_response("What is DNS?", prompt, "model-b") is None
+
+    after = _samples()
+    hits, misses = 'brainbox_response_cache_events_total{event="hits"}', 'brainbox_response_cache_events_total{event="misses"}'
+    assert after[hits] - before.get(hits, 0) == 1
+    assert after[misses] - before.get(misses, 0) == 2
+    assert after["brainbox_response_cache_enabled"] == 1
+
+
+def test_recent_turns_cache_counters_are_published(fake_llm):
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            first = await process_chat_message(db, f"hello {uuid.uuid4()}")
+        before = _samples()
+        async with AsyncSessionLocal() as db:
+            # Served from the window cached when the session was created
+            await process_chat_message(db, "again", session_id=first["session_id"])
+        recent_turns_cache.invalidate(first["session_id"])
+        async with AsyncSessionLocal() as db:
+            await process_chat_message(db, "and again", session_id=first["session_id"])
+        return before, _samples()
+
+    before, after = run(scenario())
+
+    def delta(event):
+        name = f'brainbox_recent_turns_cache_events_total{{event="{event}"}}'
+        return after[name] - before.get(name, 0)
+
+    assert (delta("hits"), delta("misses"), delta("invalidations")) == (1, 1, 1)
+    assert after["brainbox_recent_turns_cache_entries"] >= 1
+
+
+def test_context_stats_are_published(fake_llm):
+    before = _samples()
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            first = await process_chat_message(db, f"hello {uuid.uuid4()}")
+        async with AsyncSessionLocal() as db:
+            await process_chat_message(db, "again", session_id=first["session_id"])
+
+    run(scenario())
+    after = _samples()
+
+    def delta(name):
+        return after[name] - before.get(name, 0)
+
+    assert delta("brainbox_context_requests_total") == 2
+    assert delta("brainbox_context_turns_sent_total") == 1
+    assert delta("brainbox_context_estimated_prompt_tokens_total") > 0
+    assert after["brainbox_context_estimated_prompt_tokens_max"] > 0
+    assert "brainbox_context_summaries_generated_total" in after
+
+
+def test_coordination_client_and_limiter_stats_are_published():
+    import service.session_coordinator  # noqa: F401 registers its series on import
+    samples = _samples()
+
+    for event in ("serialized_turns", "coalesced", "replayed"):
+        assert f'brainbox_chat_turn_coordination_total{{event="{event}"}}' in samples
+    for event in ("admitted", "queued", "shed", "increases", "decreases"):
+        assert f'brainbox_llm_limiter_events_total{{event="{event}"}}' in samples
+    for event in ("requests", "connections_opened", "connections_reused", "retries", "failures"):
+        assert f'brainbox_llm_client_events_total{{event="{event}"}}' in samples
+    assert "brainbox_chat_locked_sessions" in samples
+    assert "brainbox_llm_concurrency_limit" in samples
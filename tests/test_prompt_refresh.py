@@ -0,0 +1,36 @@
+import repository.prompt_repository as prompt_repo
+from service.prompt_service import load_prompts, refresh_prompts
+from utilities.prompt_registry import get_prompt
+
+
+def test_refresh_picks_up_version_pinned_by_another_worker(clean_prompts):
+    load_prompts()
+    assert refresh_prompts() is False
+
+    # Published through another worker: the table changes, this worker's registry does not
+    prompt = prompt_repo.create_prompt_version(prompt_text="Answer briefly.", prompt_type="system")
+    assert get_prompt("system").prompt_id != prompt.id
+
+    assert refresh_prompts() is True
+    assert get_prompt("system").prompt_id == prompt.id
+    assert get_prompt("system").text == "Answer briefly."
+    assert refresh_prompts() is False
+
+
+def test_version_taken_by_concurrent_publisher_is_retried(clean_prompts, monkeypatch):
+    prompt_repo.create_prompt_version(prompt_text="v1", prompt_type="summary")
+    latest_version = prompt_repo._latest_version
+    reads = []
+
+    def stale_then_fresh(db, prompt_type):
+        reads.append(prompt_type)
+        # The first read misses the version another publisher just stored
+        return 0 if len(reads) == 1 else latest_version(db, prompt_type)
+
+    monkeypatch.setattr(prompt_repo, "_latest_version", stale_then_fresh)
+    prompt = prompt_repo.create_prompt_version(prompt_text="v2", prompt_type="summary")
+
+    assert len(reads) == 2
+    assert prompt.version == 2
+    versions = sorted((p.version, p.prompt_text, p.is_active) for p in prompt_repo.get_all_prompts("summary"))
+    assert versions == [(1, "v1", False), (2, "v2", True)]
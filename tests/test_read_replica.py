@@ -0,0 +1,40 @@
+import uuid
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
+from conftest import run
+import repository.recent_turns_cache as recent_turns_cache
+import utilities.database as database
+from models import Base
+from repository.chat_repository import get_session_for_read
+from service.chatbot_service import process_chat_message
+from utilities.database import AsyncSessionLocal
+
+
+def test_turn_context_is_read_from_the_primary(fake_llm, monkeypatch, tmp_path):
+    """The next turn may reach a worker that never saw the previous one, while the replica lags behind"""
+    # A replica that has not caught up with anything yet
+    Base.metadata.create_all(create_engine(f"sqlite:///{tmp_path}/replica.db"))
+    replica = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/replica.db")
+    monkeypatch.setattr(database, "read_async_engine", replica)
+    question = f"first {uuid.uuid4()}"
+
+    async def scenario():
+        try:
+            async with AsyncSessionLocal() as db:
+                first = await process_chat_message(db, question)
+            # Another worker: no record of the write and nothing cached
+            database._recent_writes.clear()
+            recent_turns_cache.invalidate(first["session_id"])
+            async with AsyncSessionLocal() as db:
+                displayed = await get_session_for_read(db, first["session_id"])
+                await db.commit()
+                await process_chat_message(db, "second", session_id=first["session_id"])
+            return displayed
+        finally:
+            await replica.dispose()
+
+    displayed = run(scenario())
+
+    # Display reads do go to the lagging replica
+    assert displayed is None
+    assert question in str(fake_llm.calls[-1][1])
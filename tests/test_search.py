@@ -0,0 +1,75 @@
+import uuid
+from sqlalchemy import select
+from conftest import run
+from models import ChatMessage
+from repository.archive_repository import archive_session, rehydrate_session
+from repository.chat_repository import create_session, create_message, create_messages_bulk, delete_session
+from repository.search_repository import search_messages
+from utilities.database import AsyncSessionLocal
+
+
+def test_search_only_returns_the_users_own_messages():
+    alice, bob = f"alice-{uuid.uuid4()}", f"bob-{uuid.uuid4()}"
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            mine = await create_session(db, user_id=alice)
+            theirs = await create_session(db, user_id=bob)
+            await create_message(db, mine.id, "how do I rotate keys", "use the rotation endpoint")
+            await create_message(db, theirs.id, "how do I rotate keys", "ask an admin to rotate them")
+            await create_messages_bulk(db, [
+                {"session_id": mine.id, "question": "rotate logs?", "answer": "logrotate"},
+                {"session_id": None, "user_id": bob, "question": "rotate tires?", "answer": "every 8000 km"},
+            ])
+            await db.commit()
+            owners = dict((await db.execute(
+                select(ChatMessage.session_id, ChatMessage.user_id).where(ChatMessage.session_id.in_([mine.id, theirs.id]))
+            )).all())
+            first = await search_messages(db, alice, "rotate", limit=1)
+            rest = await search_messages(db, alice, "rotate", limit=10, after=(first[0]["score"], first[0]["message_id"]))
+            return mine.id, theirs.id, owners, first + rest
+
+    session_id, other_session_id, owners, results = run(scenario())
+
+    # Filled in by the database from the session
+    assert owners == {session_id: alice, other_session_id: bob}
+    assert len(results) == 2
+    assert {row["session_id"] for row in results} == {session_id}
+    assert all("<b>" in row["snippet"] for row in results)
+
+
+def test_archived_sessions_stay_searchable():
+    user_id = f"archive-search-{uuid.uuid4()}"
+
+    async def search(db):
+        return [(row["session_id"], row["question"]) for row in await search_messages(db, user_id, "certificate")]
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            cold = await create_session(db, user_id=user_id)
+            await create_message(db, cold.id, "renew the certificate", "run certbot renew")
+            hot = await create_session(db, user_id=user_id)
+            await create_message(db, hot.id, "certificate expired?", "check the notAfter date")
+            await db.commit()
+            before = await search(db)
+            await archive_session(db, cold.id)
+            await db.commit()
+            archived = await search(db)
+            archived_page = await search_messages(db, user_id, "certificate", limit=1)
+            await rehydrate_session(db, cold.id)
+            await db.commit()
+            restored = await search(db)
+            await archive_session(db, cold.id)
+            await delete_session(db, cold.id)
+            await db.commit()
+            deleted = await search(db)
+            return cold.id, hot.id, before, archived, archived_page, restored, deleted
+
+    cold_id, hot_id, before, archived, archived_page, restored, deleted = run(scenario())
+
+    expected = {(cold_id, "renew the certificate"), (hot_id, "certificate expired?")}
+    assert set(before) == expected
+    assert len(archived) == 2 and set(archived) == expected
+    assert "<b>" in archived_page[0]["snippet"]
+    assert len(restored) == 2 and set(restored) == expected
+    assert deleted == [(hot_id, "certificate expired?")]
@@ -0,0 +1,88 @@
+import uuid
+import asyncio
+from sqlalchemy import func, select
+from conftest import run
+from models import ChatMessage
+from service.chatbot_service import process_chat_message, process_idempotent_chat_message
+from service.session_coordinator import session_lock
+from utilities.database import AsyncSessionLocal
+
+
+async def _turn(message, session_id=None):
+    async with AsyncSessionLocal() as db:
+        return await process_chat_message(db, message, session_id=session_id)
+
+
+async def _stored_messages(session_id):
+    async with AsyncSessionLocal() as db:
+        return (await db.scalars(
+            select(ChatMessage).where(ChatMessage.session_id == session_id).order_by(ChatMessage.id)
+        )).all()
+
+
+def test_concurrent_turns_on_one_session_run_in_order(fake_llm):
+    async def scenario():
+        first = await _turn(f"start {uuid.uuid4()}")
+        session_id = first["session_id"]
+        messages = [f"turn {index}" for index in range(5)]
+        await asyncio.gather(*(_turn(message, session_id) for message in messages))
+        return session_id, messages, await _stored_messages(session_id)
+
+    session_id, messages, stored = run(scenario())
+
+    assert [message.question for message in stored[1:]] == messages
+    # One LLM call per turn, each seeing the answers of every turn queued before it
+    assert [question for question, _ in fake_llm.calls[1:]] == messages
+    start_answer = stored[0].answer
+    for index, (_, history) in enumerate(fake_llm.calls[1:]):
+        answers = [entry["content"] for entry in history if entry["role"] == "assistant"]
+        assert answers == [start_answer] + [f"answer to {message}" for message in messages[:index]]
+
+
+def test_concurrent_submissions_with_one_idempotency_key_share_one_turn(fake_llm):
+    async def scenario():
+        first = await _turn(f"start {uuid.uuid4()}")
+        session_id = first["session_id"]
+        results = await asyncio.gather(*(
+            process_idempotent_chat_message("key-1", "same question", session_id=session_id)
+            for _ in range(5)
+        ))
+        async with AsyncSessionLocal() as db:
+            count = await db.scalar(
+                select(func.count()).select_from(ChatMessage)
+                .where(ChatMessage.session_id == session_id, ChatMessage.question == "same question")
+            )
+        return results, count
+
+    results, count = run(scenario())
+
+    assert [question for question, _ in fake_llm.calls].count("same question") == 1
+    assert count == 1
+    assert len({result["messages"][0]["message_id"] for result in results}) == 1
+
+
+def test_turn_arriving_right_after_a_release_reports_waiting():
+    async def scenario():
+        release = asyncio.Event()
+        waited = []
+
+        async def holder():
+            async with session_lock(42):
+                await release.wait()
+            # The queued turn has been woken but not run yet; this one queues behind it
+            async with session_lock(42) as late:
+                waited.append(late)
+
+        async def queued():
+            async with session_lock(42) as was_queued:
+                waited.append(was_queued)
+
+        holding = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        queuing = asyncio.create_task(queued())
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(holding, queuing)
+        return waited
+
+    assert run(scenario()) == [True, True]
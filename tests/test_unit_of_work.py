@@ -0,0 +1,58 @@
+import uuid
+from contextlib import contextmanager
+from sqlalchemy import event
+from conftest import run
+import repository.recent_turns_cache as recent_turns_cache
+from service.chatbot_service import process_chat_message
+from utilities.database import AsyncSessionLocal, async_engine
+
+
+@contextmanager
+def count_db_work():
+    """Count pool checkouts and SQL statements on the request path's engine"""
+    counts = {"checkouts": 0, "statements": []}
+
+    def on_checkout(*args):
+        counts["checkouts"] += 1
+
+    def on_execute(conn, cursor, statement, *args):
+        counts["statements"].append(statement.split()[0].upper())
+
+    event.listen(async_engine.sync_engine.pool, "checkout", on_checkout)
+    event.listen(async_engine.sync_engine, "before_cursor_execute", on_execute)
+    try:
+        yield counts
+    finally:
+        event.remove(async_engine.sync_engine.pool, "checkout", on_checkout)
+        event.remove(async_engine.sync_engine, "before_cursor_execute", on_execute)
+
+
+async def _turn(message, session_id=None):
+    async with AsyncSessionLocal() as db:
+        return await process_chat_message(db, message, session_id=session_id)
+
+
+def test_turn_round_trips(fake_llm):
+    """
+    A turn runs on one unit of work: before it, every repository call
+    checked out its own connection (3 checkouts for a new chat, 3 for an
+    existing session, plus one round trip each for the session and history).
+    """
+    async def scenario():
+        with count_db_work() as new_chat:
+            first = await _turn(f"hello {uuid.uuid4()}")
+        # Existing session with its recent turns cached, then with a cold cache
+        with count_db_work() as cached:
+            await _turn("second", first["session_id"])
+        recent_turns_cache.invalidate(first["session_id"])
+        with count_db_work() as uncached:
+            await _turn("third", first["session_id"])
+        return new_chat, cached, uncached
+
+    new_chat, cached, uncached = run(scenario())
+
+    # One write transaction: session, message and the session's stats
+    assert new_chat == {"checkouts": 1, "statements": ["INSERT", "UPDATE", "INSERT"]}
+    assert cached == {"checkouts": 1, "statements": ["UPDATE", "INSERT"]}
+    # Session and history in one SELECT, released before the LLM call, then the write
+    assert uncached == {"checkouts": 2, "statements": ["SELECT", "UPDATE", "INSERT"]}
@@ -1,61 +1,416 @@
 import os
-from openai import OpenAI
-from typing import List, Dict
-import google.generativeai as genai
+import time
+import logging
+import random
+import asyncio
+import httpx
+from dataclasses import dataclass
+from openai import AsyncOpenAI, APIConnectionError, APITimeoutError, APIStatusError, RateLimitError, InternalServerError
+from typing import List, Dict, AsyncIterator, Optional, Any, Tuple
+from utilities.prompt_registry import PromptTemplate, register_default, get_prompt
+from utilities.concurrency_limiter import AdaptiveConcurrencyLimiter
+from utilities.circuit_breaker import CircuitBreaker
+from utilities.llm_router import LLMProvider, LLMRouter, register_router_metrics
+from utilities.metrics import Counter, CounterFunc, GaugeFunc
 
 
-# Initialize OpenAI client
-_client = None
+# Client configuration, all tunable from the environment alongside OPENAI_MODEL
+BASE_URL = os.getenv("OPENAI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta/openai/")
+MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", "60"))
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+RETRY_BACKOFF_BASE = float(os.getenv("OPENAI_RETRY_BACKOFF_BASE", "0.5"))
+RETRY_BACKOFF_MAX = float(os.getenv("OPENAI_RETRY_BACKOFF_MAX", "8"))
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+# Request usage on streamed completions (stream_options.include_usage); turn
+# off for providers that reject the option
+STREAM_USAGE = os.getenv("LLM_STREAM_USAGE", "true").lower() in ("1", "true", "yes")
+
+logger = logging.getLogger(__name__)
+
+# Errors worth retrying: connection failures/timeouts, 429 and 5xx
+RETRYABLE_ERRORS = (APIConnectionError, RateLimitError, InternalServerError)
+
+_stats: Dict[str, int] = {
+    "requests": 0,
+    "connections_opened": 0,
+    "retries": 0,
+    "failures": 0,
+}
+
+
+async def _trace(event_name: str, info: Dict[str, Any]) -> None:
+    """httpcore trace hook used to count requests and newly opened connections"""
+    if event_name == "connection.connect_tcp.complete":
+        _stats["connections_opened"] += 1
+    elif event_name in ("http11.send_request_headers.started", "http2.send_request_headers.started"):
+        _stats["requests"] += 1
+
+
+async def _attach_trace(request: httpx.Request) -> None:
+    request.extensions["trace"] = _trace
+
+
+def _build_client(base_url: str, api_key: Optional[str], name: str) -> AsyncOpenAI:
+    """Create a pooled async OpenAI client for one provider"""
+    if not api_key:
+        raise RuntimeError(f"API key for LLM provider '{name}' is not configured. Please set it in .env file")
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+        event_hooks={"request": [_attach_trace]},
+    )
+    # Retries are handled by _create_completion so they get jittered backoff
+    return AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        http_client=http_client,
+        max_retries=0,
+    )
+
+
+def _load_providers() -> List[LLMProvider]:
+    """
+    Build the configured providers in priority order
+    
+    LLM_PROVIDERS lists provider names, primary first. "default" is the
+    OPENAI_BASE_URL / OPENAI_API_KEY / OPENAI_MODEL endpoint; any other name
+    reads LLM_<NAME>_BASE_URL, LLM_<NAME>_API_KEY and LLM_<NAME>_MODEL.
+    """
+    providers = []
+    for name in [n.strip() for n in os.getenv("LLM_PROVIDERS", "default").split(",") if n.strip()]:
+        if name == "default":
+            base_url, api_key, model = BASE_URL, os.getenv("OPENAI_API_KEY"), os.getenv("OPENAI_MODEL")
+        else:
+            prefix = f"LLM_{name.upper()}_"
+            base_url = os.getenv(prefix + "BASE_URL")
+            api_key = os.getenv(prefix + "API_KEY")
+            model = os.getenv(prefix + "MODEL") or os.getenv("OPENAI_MODEL")
+            if not base_url:
+                raise RuntimeError(f"LLM provider '{name}' needs {prefix}BASE_URL")
+        providers.append(LLMProvider(
+            name,
+            model,
+            lambda base_url=base_url, api_key=api_key, name=name: _build_client(base_url, api_key, name),
+            CircuitBreaker(BREAKER_FAILURES, BREAKER_COOLDOWN),
+        ))
+    return providers
+
+
+def _is_provider_failure(error: BaseException) -> bool:
+    """Errors that are the provider's fault, so the call should move to the next provider"""
+    if isinstance(error, (APIConnectionError, RateLimitError, InternalServerError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code in (401, 403, 404, 408, 409)
+
+
+def _is_overload(error: BaseException) -> bool:
+    """Errors that mean the provider is saturated and the concurrency limit should back off"""
+    if isinstance(error, (RateLimitError, APITimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code in (502, 503, 504)
+
+
+# Adaptive bound on concurrent upstream calls; excess callers queue briefly or are shed
+llm_limiter = AdaptiveConcurrencyLimiter(
+    initial_limit=int(os.getenv("LLM_LIMIT_INITIAL", "20")),
+    min_limit=int(os.getenv("LLM_LIMIT_MIN", "1")),
+    max_limit=int(os.getenv("LLM_LIMIT_MAX", "200")),
+    max_queue=int(os.getenv("LLM_QUEUE_SIZE", "100")),
+    queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", "5")),
+    backoff=float(os.getenv("LLM_LIMIT_BACKOFF", "0.7")),
+    latency_target=float(os.getenv("LLM_LATENCY_TARGET", "0")),
+    is_overload=_is_overload,
+)
+
+
+# Providers in priority order, with hedging to the next one on slow first tokens
+llm_router = LLMRouter(
+    _load_providers(),
+    hedge_percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", "95")),
+    hedge_delay=float(os.getenv("LLM_HEDGE_DELAY", "2")),
+    hedge_min_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.05")),
+    hedge_max_ratio=float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.1")),
+    is_failover_error=_is_provider_failure,
+    stream_usage=STREAM_USAGE,
+    limiter=llm_limiter,
+)
+register_router_metrics(llm_router)
+
+
+def primary_model() -> Optional[str]:
+    """The model that answers when the primary provider is healthy"""
+    return llm_router.providers[0].model
+
+
+async def close_ai_client() -> None:
+    """Close every provider's client and its connection pool"""
+    await llm_router.close()
+
+
+def get_provider_stats() -> Dict[str, Any]:
+    """
+    Get routing state per LLM provider
+    
+    Returns:
+        Dictionary with call and hedge totals and, per provider, outcome
+        counts, win rate, first-token latency percentiles, hedge threshold
+        and circuit breaker state
+    """
+    return llm_router.stats()
+
+
+def get_client_stats() -> Dict[str, int]:
+    """
+    Get connection reuse and retry counters for the LLM client
+    
+    Returns:
+        Dictionary with request, connection, reuse, retry and failure counts
+    """
+    stats = dict(_stats)
+    stats["connections_reused"] = max(stats["requests"] - stats["connections_opened"], 0)
+    return stats
+
+
+def _retry_delay(attempt: int, error: Exception) -> float:
+    """Full-jitter exponential backoff, honouring Retry-After when the provider sends one"""
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), RETRY_BACKOFF_MAX)
+            except ValueError:
+                pass
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * (2 ** attempt)))
+
+
+# Upstream metrics; the gauges are read from the limiter at scrape time
+llm_tokens = Counter("brainbox_llm_tokens", "Tokens reported in upstream response usage", ("type",))
+GaugeFunc("brainbox_llm_in_flight", "Upstream LLM calls currently in flight", lambda: llm_limiter.stats()["in_flight"])
+GaugeFunc("brainbox_llm_queue_depth", "Callers waiting for an upstream LLM slot", lambda: llm_limiter.stats()["queue_depth"])
+GaugeFunc("brainbox_llm_concurrency_limit", "Current adaptive limit on concurrent upstream LLM calls", lambda: llm_limiter.stats()["limit"])
+GaugeFunc("brainbox_llm_limiter_avg_latency_seconds", "Moving average of upstream call latency seen by the limiter", lambda: llm_limiter.stats()["avg_latency"])
+_LIMITER_COUNTED = ("admitted", "queued", "shed", "increases", "decreases")
+CounterFunc(
+    "brainbox_llm_limiter_events", "Limiter admissions, queued and shed callers, and limit increases and decreases",
+    lambda: {(name,): value for name, value in llm_limiter.stats().items() if name in _LIMITER_COUNTED}, ("event",)
+)
+CounterFunc(
+    "brainbox_llm_client_events", "Upstream HTTP requests, connections opened and reused, retries and failed calls",
+    lambda: {(name,): value for name, value in get_client_stats().items()}, ("event",)
+)
+
+
+@dataclass
+class LLMUsage:
+    """Model, token counts and upstream latency of one answer, filled in by the call that produced it"""
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    latency_ms: Optional[int] = None
+    model: Optional[str] = None
+
+    def fill(self, model: Optional[str], reported: Any, seconds: float) -> None:
+        self.model = model
+        self.latency_ms = int(seconds * 1000)
+        if reported is not None:
+            self.prompt_tokens, self.completion_tokens = _usage_counts(reported)
+
+
+def _usage_counts(usage: Any) -> Tuple[int, int]:
+    """(prompt, completion) tokens; stream chunks carry usage as a plain dict with this client version"""
+    if isinstance(usage, dict):
+        return usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0
+    return usage.prompt_tokens or 0, usage.completion_tokens or 0
 
-def get_ai_client():
-    """Get or initialize the OpenAI client"""
-    try:
-        client = os.getenv("OPENAI_API_KEY")
-        if not client:
-            raise ValueError("OpenAI API key is not configured. Please set OPENAI_API_KEY in .env file")
-        result = OpenAI(api_key=client, base_url="https://generativelanguage.googleapis.com/v1beta/openai/")
-        return result
-    except Exception as ex:
-        print(str(ex))
 
+def _record_usage(usage: Any) -> None:
+    if usage is not None:
+        prompt_tokens, completion_tokens = _usage_counts(usage)
+        llm_tokens.inc(("prompt",), prompt_tokens)
+        llm_tokens.inc(("completion",), completion_tokens)
 
 
-def generate_chat_response(user_message: str, conversation_history: List[Dict[str, str]] = None) -> str:
+def get_limiter_stats() -> Dict[str, Any]:
+    """
+    Get the upstream concurrency limiter state
+    
+    Returns:
+        Dictionary with the current limit, in-flight calls, queue depth and shed count
+    """
+    return llm_limiter.stats()
+
+
+async def _create_completion(messages: List[Dict[str, str]], stream: bool = False):
+    """
+    Route a chat completion across providers under the concurrency limiter,
+    with bounded retries once every provider has failed on 429/5xx or
+    connection errors.
+    For streams the slot stays held; the caller must release it.
+    Returns the model that answered (which may be a fallback's) and the response.
+    """
+    attempt = 0
+    while True:
+        await llm_limiter.acquire()
+        started = time.monotonic()
+        try:
+            provider, response = await llm_router.complete(messages, stream=stream)
+        except BaseException as ex:
+            llm_limiter.release(time.monotonic() - started, ex)
+            if not isinstance(ex, RETRYABLE_ERRORS):
+                raise
+            if attempt >= MAX_RETRIES:
+                _stats["failures"] += 1
+                raise
+            await asyncio.sleep(_retry_delay(attempt, ex))
+            attempt += 1
+            _stats["retries"] += 1
+            continue
+        if not stream:
+            llm_limiter.release(time.monotonic() - started)
+            _record_usage(getattr(response, "usage", None))
+        return provider.model, response
+
+
+# Built-in prompts, used until a version is published to the prompts table
+SYSTEM_PROMPT: str = """You are a helpful AI assistant called Brainbox AI. 
+            You can answer questions about normal everyday topics in a friendly and informative manner. 
+            Be concise, accurate, and helpful in your responses."""
+
+
+SUMMARY_PROMPT: str = """You maintain a running summary of a conversation between a user and Brainbox AI.
+            Extend the existing summary with the new turns. Keep facts, names, preferences and open questions
+            the assistant may need later. Reply with the updated summary only, in a few short paragraphs at most."""
+
+
+register_default("system", SYSTEM_PROMPT)
+register_default("summary", SUMMARY_PROMPT)
+
+
+def build_messages(
+    user_message: str,
+    conversation_history: List[Dict[str, str]] = None,
+    system_prompt: Optional[PromptTemplate] = None
+) -> List[Dict[str, str]]:
+    """
+    Build the chat completion payload for a user message
+    
+    Args:
+        user_message: The user's message
+        conversation_history: Optional list of previous messages
+        system_prompt: System prompt template; defaults to the active "system" prompt
+        
+    Returns:
+        List of messages starting with the system prompt
+    """
+    system_prompt = system_prompt or get_prompt("system")
+    messages = [{"role": "system", "content": system_prompt.render()}]
+    
+    # Add conversation history if provided
+    if conversation_history:
+        messages.extend(conversation_history)
+    
+    # Add current user message
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+
+async def generate_chat_response(
+    user_message: str,
+    conversation_history: List[Dict[str, str]] = None,
+    system_prompt: Optional[PromptTemplate] = None,
+    usage: Optional[LLMUsage] = None
+) -> str:
     """
     Generate response for a chat message with optional conversation history
     
     Args:
         user_message: The user's message
         conversation_history: Optional list of previous messages
+        system_prompt: System prompt template; defaults to the active "system" prompt
+        usage: Optional; filled with the answering model, token counts and latency
         
     Returns:
         AI generated response
     """
-    try:
-
-        system_prompt: str = """You are a helpful AI assistant called Brainbox AI. 
-            You can answer questions about normal everyday topics in a friendly and informative manner. 
-            Be concise, accurate, and helpful in your responses."""
+    started = time.monotonic()
+    model, response = await _create_completion(build_messages(user_message, conversation_history, system_prompt))
+    if usage is not None:
+        usage.fill(model, getattr(response, "usage", None), time.monotonic() - started)
+    answer = response.choices[0].message.content
+    logger.debug("llm.response", extra={"answer": answer, "answer_chars": len(answer or "")})
+    return answer
 
-        client = get_ai_client()
 
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        # Add conversation history if provided
-        if conversation_history:
-            messages.extend(conversation_history)
+async def stream_chat_response(
+    user_message: str,
+    conversation_history: List[Dict[str, str]] = None,
+    system_prompt: Optional[PromptTemplate] = None,
+    usage: Optional[LLMUsage] = None
+) -> AsyncIterator[str]:
+    """
+    Stream the response for a chat message token by token
+    
+    Args:
+        user_message: The user's message
+        conversation_history: Optional list of previous messages
+        system_prompt: System prompt template; defaults to the active "system" prompt
+        usage: Optional; filled with the answering model, token counts and latency once the stream ends
         
-        # Add current user message
-        messages.append({"role": "user", "content": user_message})
+    Yields:
+        Content deltas as they arrive from the provider
+    """
+    started = time.monotonic()
+    model, stream = await _create_completion(build_messages(user_message, conversation_history, system_prompt), stream=True)
+    # The limiter slot is held until the stream ends; its latency signal is
+    # the time to the first token, which does not depend on answer length
+    first_token_latency = None
+    error = None
+    reported = None
+    try:
+        async for chunk in stream:
+            if first_token_latency is None:
+                first_token_latency = time.monotonic() - started
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            # Providers that report usage on streams send it on the last chunk
+            if getattr(chunk, "usage", None) is not None:
+                reported = chunk.usage
+                _record_usage(reported)
+        if usage is not None:
+            usage.fill(model, reported, time.monotonic() - started)
+    except BaseException as ex:
+        error = ex
+        raise
+    finally:
+        # Runs on normal completion and when the consumer goes away, so an
+        # abandoned stream releases the upstream connection immediately.
+        llm_limiter.release(first_token_latency or (time.monotonic() - started), error)
+        await stream.close()
 
-        response = client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL"),
-            messages=messages,
-        )
 
-        print(response.choices[0].message.content)
+async def summarize_conversation(previous_summary: Optional[str], turns: List[Tuple[str, str]]) -> str:
+    """
+    Extend a rolling conversation summary with additional turns
+    
+    Args:
+        previous_summary: The current summary, if any
+        turns: (question, answer) pairs to fold in, oldest first
         
-        return response.choices[0].message.content
-
-    except Exception as ex:
-        print(str(ex))
+    Returns:
+        The updated summary
+    """
+    transcript = "\n\n".join(f"User: {question}\nAssistant: {answer}" for question, answer in turns)
+    _, response = await _create_completion([
+        {"role": "system", "content": get_prompt("summary").render()},
+        {"role": "user", "content": f"Existing summary:\n{previous_summary or '(none)'}\n\nNew turns:\n{transcript}"},
+    ])
+    return response.choices[0].message.content
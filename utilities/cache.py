@@ -0,0 +1,103 @@
+import time
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+
+class CacheBackend(ABC):
+    """
+    Interface for key/value cache backends
+    
+    The in-process LRUTTLCache is the default; a shared backend (e.g. Redis)
+    can implement the same methods to share entries across workers.
+    """
+
+    @abstractmethod
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value, or None on a miss"""
+
+    @abstractmethod
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value without touching recency or counters"""
+
+    @abstractmethod
+    def set(self, key: Hashable, value: Any) -> None:
+        """Insert or replace a value"""
+
+    @abstractmethod
+    def delete(self, key: Hashable) -> None:
+        """Remove a value if present"""
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Remove every value"""
+
+    @abstractmethod
+    def values(self) -> List[Any]:
+        """Snapshot of the unexpired values"""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss/eviction counters"""
+
+
+class LRUTTLCache(CacheBackend):
+    """Size-bounded, least-recently-used cache whose entries also expire after a TTL"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                return None
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def values(self) -> List[Any]:
+        """Snapshot of the unexpired values, least recently used first"""
+        now = time.monotonic()
+        with self._lock:
+            return [value for value, expires_at in self._entries.values() if expires_at > now]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, size=len(self._entries), max_size=self.max_size)
@@ -0,0 +1,67 @@
+import time
+from typing import Dict, Any
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker
+
+    After failure_threshold failures in a row the circuit opens and calls
+    are refused for cooldown seconds. Then a single probe call is let
+    through (half-open): success closes the circuit, failure reopens it.
+    """
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._stats = {"opened": 0, "rejected": 0}
+
+    def allow(self) -> bool:
+        """Whether a call may be sent now; in half-open state this claims the probe"""
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.cooldown:
+                self._stats["rejected"] += 1
+                return False
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            if self._probing:
+                self._stats["rejected"] += 1
+                return False
+            self._probing = True
+        return True
+
+    def record_success(self) -> None:
+        self.state = CLOSED
+        self._failures = 0
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probing = False
+        if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self._stats["opened"] += 1
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+
+    def release_probe(self) -> None:
+        """Give back the probe of a call that ended without an outcome (e.g. cancelled)"""
+        self._probing = False
+
+    def retry_after(self) -> float:
+        """Seconds until an open circuit lets a probe through"""
+        if self.state != OPEN:
+            return 0.0
+        return max(self.cooldown - (time.monotonic() - self._opened_at), 0.0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "consecutive_failures": self._failures, **self._stats}
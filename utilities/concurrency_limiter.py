@@ -0,0 +1,148 @@
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Deque, Dict, Any
+
+
+class LoadShedError(Exception):
+    """Raised when a call is rejected because the upstream is saturated"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD concurrency limiter with a bounded FIFO wait queue
+    
+    The limit grows by roughly one per limit's worth of successful calls and
+    is cut multiplicatively whenever a call reports overload (429, timeout,
+    gateway errors) or, if a latency target is set, finishes slower than it.
+    Callers beyond the limit wait in a queue of bounded length for at most
+    queue_timeout seconds; anything beyond that is shed immediately.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        max_queue: int,
+        queue_timeout: float,
+        backoff: float = 0.7,
+        latency_target: float = 0.0,
+        is_overload: Callable[[BaseException], bool] = lambda error: False
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.backoff = backoff
+        self.latency_target = latency_target
+        self.is_overload = is_overload
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+        self._avg_latency = 0.0
+        self._stats = {"admitted": 0, "queued": 0, "shed": 0, "increases": 0, "decreases": 0}
+
+    def _retry_after(self) -> float:
+        return max(1.0, math.ceil(self._avg_latency or self.queue_timeout))
+
+    def _shed(self, reason: str) -> LoadShedError:
+        self._stats["shed"] += 1
+        return LoadShedError(f"Upstream is saturated ({reason}), retry later", retry_after=self._retry_after())
+
+    async def acquire(self) -> None:
+        """Take a slot, waiting in the queue if needed; raises LoadShedError when shedding"""
+        if self.try_acquire():
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise self._shed("queue full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._stats["queued"] += 1
+        try:
+            await asyncio.wait_for(waiter, timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise self._shed("queue deadline exceeded")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Slot was handed over just as we were cancelled; give it back
+                self._release_slot()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        self._stats["admitted"] += 1
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if one is free right now, without queueing"""
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            self._stats["admitted"] += 1
+            return True
+        return False
+
+    def release_unmeasured(self) -> None:
+        """Return a slot without feeding an outcome back into the limit"""
+        self._release_slot()
+
+    def _release_slot(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        # Hand free slots to waiters in FIFO order; the slot is counted on
+        # their behalf so nobody can jump the queue in between
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def release(self, latency: float, error: BaseException = None) -> None:
+        """Return a slot and adjust the limit from the call's outcome"""
+        self._avg_latency = latency if not self._avg_latency else 0.9 * self._avg_latency + 0.1 * latency
+        overloaded = (error is not None and self.is_overload(error)) or (
+            self.latency_target > 0 and latency > self.latency_target
+        )
+        now = time.monotonic()
+        if overloaded:
+            # Cut at most once per average latency so one burst of failures
+            # from the same congestion does not collapse the limit
+            if now - self._last_decrease >= (self._avg_latency or 0):
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+                self._stats["decreases"] += 1
+        elif error is None and self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._stats["increases"] += 1
+        self._release_slot()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold a slot for the duration of the block and feed its outcome back"""
+        await self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException as error:
+            self.release(time.monotonic() - started, error)
+            raise
+        self.release(time.monotonic() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        """Current limit, in-flight calls, queue depth and admission counters"""
+        return dict(
+            self._stats,
+            limit=int(self.limit),
+            in_flight=self.in_flight,
+            queue_depth=len(self._waiters),
+            avg_latency=round(self._avg_latency, 3),
+        )
@@ -0,0 +1,299 @@
+import math
+import time
+import asyncio
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+from openai import AsyncOpenAI
+from utilities.circuit_breaker import CircuitBreaker, CLOSED, HALF_OPEN
+from utilities.concurrency_limiter import AdaptiveConcurrencyLimiter, LoadShedError
+from utilities.metrics import Counter, CounterFunc, GaugeFunc, Histogram
+
+
+# Per-provider metrics; outcome is "won", "cancelled" (lost a hedge race) or "failed"
+provider_calls = Counter("brainbox_llm_provider_calls", "Upstream calls per provider by outcome", ("provider", "outcome"))
+provider_first_token_seconds = Histogram("brainbox_llm_provider_first_token_seconds", "Time to first token (or full response) per provider", ("provider",))
+provider_hedges = Counter("brainbox_llm_provider_hedges", "Hedged duplicate calls sent to a provider", ("provider",))
+provider_failovers = Counter("brainbox_llm_provider_failovers", "Calls sent to a provider after another one failed", ("provider",))
+
+
+class LLMProvider:
+    """One OpenAI-compatible backend with its own client, circuit breaker and latency window"""
+
+    def __init__(
+        self,
+        name: str,
+        model: Optional[str],
+        client_factory: Callable[[], AsyncOpenAI],
+        breaker: CircuitBreaker,
+        window: int = 256
+    ):
+        self.name = name
+        self.model = model
+        self.breaker = breaker
+        self._client_factory = client_factory
+        self._client: Optional[AsyncOpenAI] = None
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._stats = {"calls": 0, "won": 0, "cancelled": 0, "failed": 0, "hedges": 0, "failovers": 0}
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        if self._client is None:
+            self._client = self._client_factory()
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def observe(self, latency: float) -> None:
+        self._latencies.append(latency)
+        provider_first_token_seconds.observe(latency, (self.name,))
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """Nearest-rank percentile of recent first-token latencies"""
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(max(math.ceil(pct / 100 * len(ordered)) - 1, 0), len(ordered) - 1)]
+
+    def record(self, outcome: str) -> None:
+        self._stats[outcome] += 1
+        provider_calls.inc((self.name, outcome))
+
+    def win_rate(self) -> float:
+        return self._stats["won"] / self._stats["calls"] if self._stats["calls"] else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "provider": self.name,
+            "model": self.model,
+            **self._stats,
+            "win_rate": round(self.win_rate(), 4),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "breaker": self.breaker.stats(),
+        }
+
+
+class _PrefetchedStream:
+    """A completion stream whose first chunk was already read to decide a hedge race"""
+
+    def __init__(self, stream, first_chunk):
+        self._stream = stream
+        self._first_chunk = first_chunk
+
+    async def __aiter__(self):
+        if self._first_chunk is not None:
+            chunk, self._first_chunk = self._first_chunk, None
+            yield chunk
+        async for chunk in self._stream:
+            yield chunk
+
+    async def close(self) -> None:
+        await self._stream.close()
+
+
+class LLMRouter:
+    """
+    Routes completions across providers in priority order
+
+    Each call goes to the first provider whose circuit is closed. If it has
+    not produced its first token (or, without streaming, its response)
+    within the hedge threshold, the same call is also sent to the next
+    provider; whichever answers first wins and the other is cancelled.
+    The threshold is a percentile of the provider's recent first-token
+    latencies, or hedge_delay until enough samples exist. Hedges are capped
+    at hedge_max_ratio of calls. The caller holds one limiter slot for the
+    call. A hedge is a second upstream call, so it is only sent if the
+    limiter has a free slot right now, and that slot is held until
+    complete() returns.
+    A provider failure (per is_failover_error)
+    moves the call on to the next provider and counts against that
+    provider's circuit breaker; other errors are raised as they are. With
+    stream_usage, streamed calls ask for token usage on their last chunk.
+    """
+
+    def __init__(
+        self,
+        providers: List[LLMProvider],
+        hedge_percentile: float,
+        hedge_delay: float,
+        hedge_min_delay: float,
+        hedge_max_ratio: float,
+        is_failover_error: Callable[[BaseException], bool],
+        min_samples: int = 20,
+        stream_usage: bool = False,
+        limiter: Optional[AdaptiveConcurrencyLimiter] = None
+    ):
+        self.providers = providers
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_ratio = hedge_max_ratio
+        self.is_failover_error = is_failover_error
+        self.min_samples = min_samples
+        self.stream_usage = stream_usage
+        self.limiter = limiter
+        self._calls = 0
+        self._hedges = 0
+        self._hedges_skipped = 0
+
+    def hedge_threshold(self, provider: LLMProvider) -> float:
+        """Seconds to wait on a provider before sending a hedged duplicate"""
+        if len(provider._latencies) < self.min_samples:
+            return self.hedge_delay
+        return max(provider.percentile(self.hedge_percentile), self.hedge_min_delay)
+
+    def _can_hedge(self) -> bool:
+        return self.hedge_max_ratio > 0 and self._hedges < self.hedge_max_ratio * self._calls + 1
+
+    async def _attempt(self, provider: LLMProvider, messages: List[Dict[str, str]], stream: bool):
+        """Send the call to one provider; streams are returned once their first chunk is in"""
+        started = time.monotonic()
+        try:
+            response = await provider.client.chat.completions.create(
+                model=provider.model,
+                messages=messages,
+                stream=stream,
+                # Ask for a final usage chunk; the pinned client predates the stream_options argument
+                extra_body={"stream_options": {"include_usage": True}} if stream and self.stream_usage else None,
+            )
+            if stream:
+                try:
+                    first_chunk = await response.__anext__()
+                except StopAsyncIteration:
+                    first_chunk = None
+                except BaseException:
+                    await response.close()
+                    raise
+                response = _PrefetchedStream(response, first_chunk)
+        except asyncio.CancelledError:
+            # Lost the race; the elapsed time is a lower bound on its latency
+            provider.observe(time.monotonic() - started)
+            raise
+        provider.observe(time.monotonic() - started)
+        return response
+
+    async def complete(self, messages: List[Dict[str, str]], stream: bool = False):
+        """
+        Run one completion with hedging and failover
+
+        Returns:
+            Tuple of the provider that answered and the completion response,
+            or for streams an async iterable of chunks with close()
+        """
+        candidates = [provider for provider in self.providers if provider.breaker.allow()]
+        if not candidates:
+            retry_after = min(provider.breaker.retry_after() for provider in self.providers)
+            raise LoadShedError("All LLM providers are unavailable, retry later", retry_after=max(1.0, math.ceil(retry_after)))
+        self._calls += 1
+
+        running: Dict[asyncio.Task, LLMProvider] = {}
+        hedged = False
+        hedge_slot = False
+        last_error: Optional[BaseException] = None
+
+        def start(provider: LLMProvider, reason: Optional[str] = None) -> None:
+            provider._stats["calls"] += 1
+            if reason == "hedge":
+                provider._stats["hedges"] += 1
+                provider_hedges.inc((provider.name,))
+            elif reason == "failover":
+                provider._stats["failovers"] += 1
+                provider_failovers.inc((provider.name,))
+            running[asyncio.ensure_future(self._attempt(provider, messages, stream))] = provider
+
+        start(candidates.pop(0))
+        try:
+            while running:
+                timeout = None
+                if candidates and not hedged and self._can_hedge():
+                    # Hedge against the most recently started provider
+                    timeout = self.hedge_threshold(list(running.values())[-1])
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    # Without a free slot the upstream is busy enough; keep waiting instead
+                    if self.limiter is not None:
+                        hedge_slot = self.limiter.try_acquire()
+                        if not hedge_slot:
+                            self._hedges_skipped += 1
+                            continue
+                    self._hedges += 1
+                    start(candidates.pop(0), "hedge")
+                    continue
+
+                for task in done:
+                    provider = running.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        provider.breaker.record_success()
+                        provider.record("won")
+                        return provider, task.result()
+                    if not self.is_failover_error(error):
+                        provider.breaker.release_probe()
+                        provider.record("failed")
+                        raise error
+                    provider.breaker.record_failure()
+                    provider.record("failed")
+                    last_error = error
+                if not running and candidates:
+                    start(candidates.pop(0), "failover")
+            raise last_error
+        finally:
+            # Unused candidates give back any half-open probe they claimed
+            for provider in candidates:
+                provider.breaker.release_probe()
+            # Cancel whatever is still in flight, including after a win
+            for task, provider in running.items():
+                task.cancel()
+                provider.breaker.release_probe()
+                provider.record("cancelled")
+            if running:
+                results = await asyncio.gather(*running, return_exceptions=True)
+                for result in results:
+                    if isinstance(result, _PrefetchedStream):
+                        await result.close()
+            # At most one upstream call outlives complete(), covered by the caller's slot
+            if hedge_slot:
+                self.limiter.release_unmeasured()
+
+    async def close(self) -> None:
+        for provider in self.providers:
+            await provider.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self._calls,
+            "hedges": self._hedges,
+            "hedges_skipped": self._hedges_skipped,
+            "providers": [dict(provider.stats(), hedge_threshold=self.hedge_threshold(provider)) for provider in self.providers],
+        }
+
+
+def register_router_metrics(router: LLMRouter) -> None:
+    """Export per-provider gauges for /metrics, read at scrape time"""
+    states = {CLOSED: 0, HALF_OPEN: 1}
+    GaugeFunc(
+        "brainbox_llm_provider_circuit_state", "Circuit state per provider (0 closed, 1 half-open, 2 open)",
+        lambda: {(p.name,): states.get(p.breaker.state, 2) for p in router.providers}, ("provider",)
+    )
+    GaugeFunc(
+        "brainbox_llm_provider_win_rate", "Share of a provider's calls whose result was used",
+        lambda: {(p.name,): p.win_rate() for p in router.providers}, ("provider",)
+    )
+    CounterFunc(
+        "brainbox_llm_provider_circuit_events", "Circuit openings and calls rejected by an open circuit, per provider",
+        lambda: {(p.name, name): p.breaker.stats()[name] for p in router.providers for name in ("opened", "rejected")},
+        ("provider", "event")
+    )
+    CounterFunc(
+        "brainbox_llm_hedges_skipped", "Hedges not sent because the concurrency limiter had no free slot",
+        lambda: router._hedges_skipped
+    )
+    GaugeFunc(
+        "brainbox_llm_provider_hedge_threshold_seconds", "Current hedge threshold per provider",
+        lambda: {(p.name,): router.hedge_threshold(p) for p in router.providers}, ("provider",)
+    )
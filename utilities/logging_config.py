@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import uuid
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+from utilities.metrics import Counter
+
+
+# Log records go onto a bounded in-memory queue and are formatted as JSON and
+# written by a background thread, so a request never blocks on stdout/stderr.
+# Pass structured fields with extra=..., e.g.
+#     logger.info("chat.turn", extra={"session_id": 7, "chars": 120})
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# String fields (and the message) longer than this are cut
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "2000"))
+
+
+def _parse_sample_rates(value: str) -> Dict[str, float]:
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        key, _, rate = item.partition("=")
+        rates[key.strip()] = float(rate)
+    return rates
+
+
+# Fraction of records kept per event name or logger name,
+# e.g. "llm.response=0.01,sqlalchemy.engine=0.1,uvicorn.access=0.1"
+LOG_SAMPLE_RATES = _parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", ""))
+
+# Correlation ID of the request being handled, stamped on every record
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+log_records_dropped = Counter("brainbox_log_records_dropped", "Log records dropped because the log queue was full")
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+
+def _truncate(text: str) -> str:
+    if len(text) <= LOG_MAX_FIELD_CHARS:
+        return text
+    return f"{text[:LOG_MAX_FIELD_CHARS]}...(+{len(text) - LOG_MAX_FIELD_CHARS} chars)"
+
+
+def _field(value: Any) -> Any:
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        return _truncate(value)
+    encoded = json.dumps(value, default=str)
+    return value if len(encoded) <= LOG_MAX_FIELD_CHARS else _truncate(encoded)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: timestamp, level, logger, message, request_id and extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": _truncate(record.getMessage()),
+            "request_id": getattr(record, "request_id", None),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = _field(value)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _ContextFilter(logging.Filter):
+    """Stamps the current request ID and drops records sampled out by LOG_SAMPLE_RATES"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if LOG_SAMPLE_RATES:
+            rate = LOG_SAMPLE_RATES.get(record.msg) if isinstance(record.msg, str) else None
+            if rate is None:
+                rate = LOG_SAMPLE_RATES.get(record.name)
+            if rate is not None and random.random() >= rate:
+                return False
+        record.request_id = request_id_var.get()
+        return True
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that never blocks and leaves all formatting to the listener thread"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped.inc()
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging() -> None:
+    """
+    Route all logging (including uvicorn and SQLAlchemy) through the JSON queue pipeline
+
+    Safe to call more than once; only the first call installs the handlers.
+    Queued records are written out at interpreter exit, after the server's
+    own shutdown messages.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    log_queue: "queue.Queue" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+
+    handler = _NonBlockingQueueHandler(log_queue)
+    handler.addFilter(_ContextFilter())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+    # uvicorn installs its own plain-text handlers; send its records through the pipeline too
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        logger = logging.getLogger(name)
+        logger.handlers = []
+        logger.propagate = True
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Write out queued records and stop the writer thread"""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is None:
+        return
+    try:
+        listener.stop()
+    except queue.Full:
+        pass
+
+
+class RequestIdMiddleware:
+    """ASGI middleware giving each request a correlation ID (X-Request-ID, generated if absent)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", []).append((b"x-request-id", request_id.encode("latin-1")))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_id_var.reset(token)
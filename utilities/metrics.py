@@ -0,0 +1,170 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+# Default latency buckets in seconds, from fast DB queries up to long LLM calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Metrics in registration order, rendered by render_metrics()
+_registry: List["_Metric"] = []
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """Yield (suffix, formatted labels, value) triples"""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonic counter; labels are passed positionally in labelnames order"""
+    type_name = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for labels, value in list(self._values.items()):
+            yield "_total", _format_labels(self.labelnames, labels), value
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram; observe() is a bisect and three additions"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, labels: Tuple[str, ...] = ()) -> None:
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    @contextmanager
+    def time(self, labels: Tuple[str, ...] = ()) -> Iterator[None]:
+        """Observe the duration of the enclosed block, including when it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, labels)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for labels, (counts, total) in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield "_bucket", _format_labels(self.labelnames, labels, ("le", _format_value(float(bound)))), cumulative
+            yield "_sum", _format_labels(self.labelnames, labels), total[0]
+            yield "_count", _format_labels(self.labelnames, labels), cumulative
+
+
+class GaugeFunc(_Metric):
+    """
+    Gauge read from a callback at scrape time, so the hot path pays nothing.
+    The callback returns a number, or a dict of label tuples to numbers.
+    """
+    type_name = "gauge"
+
+    def __init__(self, name: str, help_text: str, callback: Callable[[], object], labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self.callback = callback
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        value = self.callback()
+        if isinstance(value, dict):
+            for labels, item in value.items():
+                yield "", _format_labels(self.labelnames, labels), item
+        elif value is not None:
+            yield "", "", value
+
+
+class CounterFunc(GaugeFunc):
+    """
+    Counter read from a callback at scrape time, for components that already
+    keep their own monotonic counters. Same callback contract as GaugeFunc.
+    """
+    type_name = "counter"
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for _, labels, value in super().samples():
+            yield "_total", labels, value
+
+
+def render_metrics() -> str:
+    """Render every registered metric in the Prometheus text exposition format"""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+# Request metrics, recorded by MetricsMiddleware
+http_requests = Counter("brainbox_http_requests", "HTTP requests by route template, method and status", ("endpoint", "method", "status"))
+http_request_seconds = Histogram("brainbox_http_request_seconds", "HTTP request latency until the response body is complete", ("endpoint", "method"))
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests and timing them per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Route templates keep label cardinality bounded; unknown paths share one label
+            route = scope.get("route")
+            endpoint = getattr(route, "path", "unmatched")
+            http_requests.inc((endpoint, scope["method"], str(status[0])))
+            http_request_seconds.observe(time.perf_counter() - started, (endpoint, scope["method"]))
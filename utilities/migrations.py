@@ -0,0 +1,533 @@
+import json
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Date, DateTime, Boolean, LargeBinary, ForeignKey, MetaData, Table, select, inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+
+# Bookkeeping table recording which migrations have been applied. It lives in
+# its own metadata so create_all on the models never touches it.
+_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String(255), nullable=False),
+    Column("applied_at", DateTime, default=datetime.utcnow),
+)
+
+
+# Migration steps spell out their DDL instead of reading the models, so an
+# old step keeps doing the same thing after the models move on.
+
+
+def _create_index(
+    name: str,
+    table: str,
+    *columns: str,
+    using: Optional[str] = None,
+    unique: bool = False
+) -> Callable[[Connection], None]:
+    """
+    Build a migration step that creates an index if it is missing
+
+    On Postgres the index is built CONCURRENTLY so writes to a large table
+    are not blocked meanwhile. That cannot run inside a transaction, so the
+    migration's earlier steps are committed first; steps are idempotent, so
+    a crash in between is repaired by rerunning the migration.
+    """
+    method = f" USING {using}" if using else ""
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    def step(conn: Connection) -> None:
+        if conn.dialect.name != "postgresql":
+            conn.execute(text(f"CREATE {kind} IF NOT EXISTS {name} ON {table}{method} ({', '.join(columns)})"))
+            return
+        conn.commit()
+        conn.execution_options(isolation_level="AUTOCOMMIT")
+        try:
+            # A failed concurrent build leaves an invalid index that IF NOT EXISTS would keep
+            invalid = conn.scalar(text(
+                "SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+            ), {"name": name})
+            if invalid:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+            conn.execute(text(f"CREATE {kind} CONCURRENTLY IF NOT EXISTS {name} ON {table}{method} ({', '.join(columns)})"))
+        finally:
+            conn.commit()
+            conn.execution_options(isolation_level=conn.default_isolation_level)
+    return step
+
+
+def _drop_index(name: str) -> Callable[[Connection], None]:
+    """Build a migration step that drops an index if it exists"""
+    def step(conn: Connection) -> None:
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    return step
+
+
+def _add_columns(table: str, *columns: Column) -> Callable[[Connection], None]:
+    """Build a migration step that adds columns missing from an existing table"""
+    def step(conn: Connection) -> None:
+        existing = {column["name"] for column in inspect(conn).get_columns(table)}
+        for column in columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column.name} {column_type}"))
+    return step
+
+
+def _create_table(name: str, *columns: Column) -> Callable[[Connection], None]:
+    """Build a migration step that creates a table if it is missing"""
+    def step(conn: Connection) -> None:
+        metadata = MetaData()
+        # Tables referenced by foreign keys are reflected so the DDL can name them
+        referenced = {fk.target_fullname.split(".")[0] for column in columns for fk in column.foreign_keys}
+        if referenced:
+            metadata.reflect(bind=conn, only=sorted(referenced))
+        # Copies, since a Column can only belong to one Table and the step may run again
+        Table(name, metadata, *(column._copy() for column in columns)).create(bind=conn, checkfirst=True)
+    return step
+
+
+def _execute(statement: str) -> Callable[[Connection], None]:
+    """Build a migration step that runs a data backfill statement"""
+    def step(conn: Connection) -> None:
+        conn.execute(text(statement))
+    return step
+
+
+def _index_archived_messages(conn: Connection) -> None:
+    """Copy the searchable text of sessions archived before the search table existed"""
+    archives = conn.execute(text(
+        "SELECT a.session_id, s.user_id, a.payload FROM chat_session_archives a "
+        "JOIN chat_sessions s ON s.id = a.session_id "
+        "WHERE NOT EXISTS (SELECT 1 FROM archived_message_search m WHERE m.session_id = a.session_id)"
+    )).all()
+    for session_id, user_id, payload in archives:
+        # Payload rows start with id, question, answer, ISO timestamp (see archive_repository)
+        rows = [
+            {"message_id": values[0], "session_id": session_id, "user_id": user_id,
+             "question": values[1], "answer": values[2],
+             "timestamp": datetime.fromisoformat(values[3]) if values[3] else None}
+            for values in json.loads(zlib.decompress(payload))
+        ]
+        if rows:
+            conn.execute(text(
+                "INSERT INTO archived_message_search (message_id, session_id, user_id, question, answer, timestamp) "
+                "VALUES (:message_id, :session_id, :user_id, :question, :answer, :timestamp)"
+            ), rows)
+
+
+def _renumber_duplicate_prompt_versions(conn: Connection) -> None:
+    """
+    Move rows that share a (prompt_type, version) with an older row to the
+    next free versions of their type, so the unique index can be built.
+    The oldest row keeps the version.
+    """
+    rows = conn.execute(text(
+        "SELECT id, prompt_type, version FROM prompts "
+        "WHERE prompt_type IS NOT NULL AND version IS NOT NULL ORDER BY prompt_type, version, id"
+    )).all()
+    latest: Dict[str, int] = {}
+    for _, prompt_type, version in rows:
+        latest[prompt_type] = max(latest.get(prompt_type, 0), version)
+    seen = set()
+    moves = []
+    for prompt_id, prompt_type, version in rows:
+        if (prompt_type, version) in seen:
+            latest[prompt_type] += 1
+            moves.append({"id": prompt_id, "version": latest[prompt_type]})
+        seen.add((prompt_type, version))
+    if moves:
+        conn.execute(text("UPDATE prompts SET version = :version WHERE id = :id"), moves)
+
+
+def _for_dialect(**steps: Callable[[Connection], None]) -> Callable[[Connection], None]:
+    """Build a migration step that runs the step named after the connection's dialect, if any"""
+    def step(conn: Connection) -> None:
+        each = steps.get(conn.dialect.name)
+        if each:
+            each(conn)
+    return step
+
+
+def _steps(*steps: Callable[[Connection], None]) -> Callable[[Connection], None]:
+    """Combine several steps into one migration"""
+    def step(conn: Connection) -> None:
+        for each in steps:
+            each(conn)
+    return step
+
+
+# Ordered list of (version, description, step). Append only; never renumber.
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (
+        1,
+        "composite indexes for history, session listing and error lookups",
+        _steps(
+            _create_index("ix_chat_messages_session_id_timestamp", "chat_messages", "session_id", "timestamp"),
+            _create_index("ix_chat_sessions_user_id_updated_at", "chat_sessions", "user_id", "updated_at"),
+            _create_index("ix_error_logs_error_type_timestamp", "error_logs", "error_type", "timestamp"),
+        ),
+    ),
+    (
+        2,
+        "rolling conversation summary on chat_sessions",
+        _add_columns("chat_sessions", Column("summary", Text), Column("summary_message_id", Integer)),
+    ),
+    (
+        3,
+        "error log fingerprints with occurrence counts",
+        _steps(
+            _add_columns(
+                "error_logs",
+                Column("fingerprint", String(64)),
+                Column("occurrence_count", Integer),
+                Column("first_seen", DateTime),
+                Column("last_seen", DateTime),
+            ),
+            _execute(
+                "UPDATE error_logs SET occurrence_count = 1, first_seen = timestamp, last_seen = timestamp "
+                "WHERE occurrence_count IS NULL"
+            ),
+            _drop_index("ix_error_logs_error_type_timestamp"),
+            _create_index("ix_error_logs_error_type_last_seen", "error_logs", "error_type", "last_seen"),
+            _create_index("ix_error_logs_fingerprint", "error_logs", "fingerprint"),
+        ),
+    ),
+    (
+        4,
+        "versioned prompts and the prompt version used per message",
+        _steps(
+            _add_columns("prompts", Column("version", Integer), Column("is_active", Boolean)),
+            _execute("UPDATE prompts SET is_active = false WHERE is_active IS NULL"),
+            _add_columns("chat_messages", Column("prompt_version", Integer)),
+        ),
+    ),
+    (
+        5,
+        "denormalized message count, last message time and preview on chat_sessions",
+        _steps(
+            _add_columns(
+                "chat_sessions",
+                Column("message_count", Integer),
+                Column("last_message_at", DateTime),
+                Column("last_message_preview", String(200)),
+            ),
+            _execute(
+                "UPDATE chat_sessions SET "
+                "message_count = (SELECT count(*) FROM chat_messages m WHERE m.session_id = chat_sessions.id), "
+                "last_message_at = (SELECT max(m.timestamp) FROM chat_messages m WHERE m.session_id = chat_sessions.id), "
+                "last_message_preview = (SELECT substr(m.answer, 1, 120) FROM chat_messages m "
+                "WHERE m.session_id = chat_sessions.id ORDER BY m.timestamp DESC, m.id DESC LIMIT 1) "
+                "WHERE message_count IS NULL"
+            ),
+            # updated_at was never bumped by new messages; catch it up so listing order is right
+            _execute(
+                "UPDATE chat_sessions SET updated_at = last_message_at "
+                "WHERE last_message_at IS NOT NULL AND (updated_at IS NULL OR updated_at < last_message_at)"
+            ),
+        ),
+    ),
+    (
+        6,
+        "full-text index over message questions and answers",
+        _for_dialect(
+            # Generated column: computed by every insert/update, including existing rows
+            postgresql=_steps(
+                _execute(
+                    "ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                    "GENERATED ALWAYS AS (to_tsvector('english', coalesce(question, '') || ' ' || coalesce(answer, ''))) STORED"
+                ),
+                _create_index("ix_chat_messages_search_vector", "chat_messages", "search_vector", using="GIN"),
+            ),
+            # External-content FTS5 table kept in step with chat_messages by triggers
+            sqlite=_steps(
+                _execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5("
+                    "question, answer, content='chat_messages', content_rowid='id', tokenize='porter unicode61')"
+                ),
+                _execute(
+                    "CREATE TRIGGER IF NOT EXISTS chat_messages_fts_insert AFTER INSERT ON chat_messages BEGIN "
+                    "INSERT INTO chat_messages_fts(rowid, question, answer) VALUES (new.id, new.question, new.answer); END"
+                ),
+                _execute(
+                    "CREATE TRIGGER IF NOT EXISTS chat_messages_fts_delete AFTER DELETE ON chat_messages BEGIN "
+                    "INSERT INTO chat_messages_fts(chat_messages_fts, rowid, question, answer) "
+                    "VALUES ('delete', old.id, old.question, old.answer); END"
+                ),
+                _execute(
+                    "CREATE TRIGGER IF NOT EXISTS chat_messages_fts_update AFTER UPDATE OF question, answer ON chat_messages BEGIN "
+                    "INSERT INTO chat_messages_fts(chat_messages_fts, rowid, question, answer) "
+                    "VALUES ('delete', old.id, old.question, old.answer); "
+                    "INSERT INTO chat_messages_fts(rowid, question, answer) VALUES (new.id, new.question, new.answer); END"
+                ),
+                _execute("INSERT INTO chat_messages_fts(chat_messages_fts) VALUES ('rebuild')"),
+            ),
+        ),
+    ),
+    (
+        7,
+        "cold storage for the messages of idle sessions",
+        _steps(
+            _add_columns("chat_sessions", Column("archived_at", DateTime)),
+            _create_table(
+                "chat_session_archives",
+                Column("session_id", Integer, ForeignKey("chat_sessions.id"), primary_key=True),
+                Column("payload", LargeBinary, nullable=False),
+                Column("message_count", Integer, nullable=False),
+                Column("raw_bytes", Integer, nullable=False),
+                Column("archived_at", DateTime),
+            ),
+            _create_index("ix_chat_sessions_archived_at_last_message_at", "chat_sessions", "archived_at", "last_message_at"),
+        ),
+    ),
+    (
+        8,
+        "token usage per message, per-user daily usage and quotas",
+        _steps(
+            _add_columns(
+                "chat_messages",
+                Column("prompt_tokens", Integer),
+                Column("completion_tokens", Integer),
+                Column("llm_latency_ms", Integer),
+            ),
+            _create_table(
+                "user_token_usage",
+                Column("user_id", String(100), primary_key=True),
+                Column("day", Date, primary_key=True),
+                Column("prompt_tokens", BigInteger, nullable=False),
+                Column("completion_tokens", BigInteger, nullable=False),
+                Column("requests", Integer, nullable=False),
+            ),
+            _create_table(
+                "user_quotas",
+                Column("user_id", String(100), primary_key=True),
+                Column("daily_tokens", BigInteger),
+            ),
+        ),
+    ),
+    (
+        9,
+        "owner on chat_messages, leading the full-text index so search only touches the user's messages",
+        _steps(
+            _add_columns("chat_messages", Column("user_id", String(100))),
+            # Filled from the session on every insert, whichever path wrote the row
+            _for_dialect(
+                postgresql=_steps(
+                    _execute(
+                        "CREATE OR REPLACE FUNCTION chat_messages_set_user_id() RETURNS trigger AS $$ BEGIN "
+                        "IF NEW.user_id IS NULL THEN "
+                        "SELECT user_id INTO NEW.user_id FROM chat_sessions WHERE id = NEW.session_id; "
+                        "END IF; RETURN NEW; END $$ LANGUAGE plpgsql"
+                    ),
+                    _execute("DROP TRIGGER IF EXISTS chat_messages_set_user_id ON chat_messages"),
+                    _execute(
+                        "CREATE TRIGGER chat_messages_set_user_id BEFORE INSERT ON chat_messages "
+                        "FOR EACH ROW EXECUTE FUNCTION chat_messages_set_user_id()"
+                    ),
+                ),
+                sqlite=_execute(
+                    "CREATE TRIGGER IF NOT EXISTS chat_messages_set_user_id AFTER INSERT ON chat_messages "
+                    "WHEN new.user_id IS NULL BEGIN "
+                    "UPDATE chat_messages SET user_id = (SELECT user_id FROM chat_sessions WHERE id = new.session_id) "
+                    "WHERE id = new.id; END"
+                ),
+            ),
+            _execute(
+                "UPDATE chat_messages SET user_id = "
+                "(SELECT s.user_id FROM chat_sessions s WHERE s.id = chat_messages.session_id) "
+                "WHERE user_id IS NULL"
+            ),
+            _for_dialect(
+                # btree_gin lets one GIN index lead with the scalar user_id
+                postgresql=_steps(
+                    _execute("CREATE EXTENSION IF NOT EXISTS btree_gin"),
+                    _create_index(
+                        "ix_chat_messages_user_id_search_vector", "chat_messages", "user_id", "search_vector", using="GIN"
+                    ),
+                    _drop_index("ix_chat_messages_search_vector"),
+                ),
+                # Rebuilt with user_id as an indexed column, so MATCH intersects with the user's postings
+                sqlite=_steps(
+                    _execute("DROP TRIGGER IF EXISTS chat_messages_fts_insert"),
+                    _execute("DROP TRIGGER IF EXISTS chat_messages_fts_delete"),
+                    _execute("DROP TRIGGER IF EXISTS chat_messages_fts_update"),
+                    _execute("DROP TABLE IF EXISTS chat_messages_fts"),
+                    _execute(
+                        "CREATE VIRTUAL TABLE chat_messages_fts USING fts5("
+                        "question, answer, user_id, content='chat_messages', content_rowid='id', tokenize='porter unicode61')"
+                    ),
+                    # The owner trigger may not have run yet, so the insert looks the user up itself
+                    _execute(
+                        "CREATE TRIGGER chat_messages_fts_insert AFTER INSERT ON chat_messages BEGIN "
+                        "INSERT INTO chat_messages_fts(rowid, question, answer, user_id) VALUES (new.id, new.question, new.answer, "
+                        "coalesce(new.user_id, (SELECT user_id FROM chat_sessions WHERE id = new.session_id))); END"
+                    ),
+                    _execute(
+                        "CREATE TRIGGER chat_messages_fts_delete AFTER DELETE ON chat_messages BEGIN "
+                        "INSERT INTO chat_messages_fts(chat_messages_fts, rowid, question, answer, user_id) "
+                        "VALUES ('delete', old.id, old.question, old.answer, old.user_id); END"
+                    ),
+                    # Not on user_id: the owner trigger's fill matches what the insert already indexed
+                    _execute(
+                        "CREATE TRIGGER chat_messages_fts_update AFTER UPDATE OF question, answer ON chat_messages BEGIN "
+                        "INSERT INTO chat_messages_fts(chat_messages_fts, rowid, question, answer, user_id) "
+                        "VALUES ('delete', old.id, old.question, old.answer, old.user_id); "
+                        "INSERT INTO chat_messages_fts(rowid, question, answer, user_id) "
+                        "VALUES (new.id, new.question, new.answer, new.user_id); END"
+                    ),
+                    _execute("INSERT INTO chat_messages_fts(chat_messages_fts) VALUES ('rebuild')"),
+                ),
+            ),
+        ),
+    ),
+    (
+        10,
+        "full-text index over archived messages",
+        _steps(
+            _create_table(
+                "archived_message_search",
+                Column("message_id", Integer, primary_key=True, autoincrement=False),
+                Column("session_id", Integer, ForeignKey("chat_sessions.id"), nullable=False),
+                Column("user_id", String(100)),
+                Column("question", Text, nullable=False),
+                Column("answer", Text, nullable=False),
+                Column("timestamp", DateTime),
+            ),
+            _create_index("ix_archived_message_search_session_id", "archived_message_search", "session_id"),
+            # Same layout as the chat_messages index after migration 9
+            _for_dialect(
+                postgresql=_steps(
+                    _execute(
+                        "ALTER TABLE archived_message_search ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                        "GENERATED ALWAYS AS (to_tsvector('english', coalesce(question, '') || ' ' || coalesce(answer, ''))) STORED"
+                    ),
+                    _execute("CREATE EXTENSION IF NOT EXISTS btree_gin"),
+                    _create_index(
+                        "ix_archived_message_search_user_id_search_vector", "archived_message_search",
+                        "user_id", "search_vector", using="GIN"
+                    ),
+                ),
+                # Rows are only ever inserted and deleted, so no update trigger
+                sqlite=_steps(
+                    _execute(
+                        "CREATE VIRTUAL TABLE IF NOT EXISTS archived_message_search_fts USING fts5("
+                        "question, answer, user_id, content='archived_message_search', content_rowid='message_id', "
+                        "tokenize='porter unicode61')"
+                    ),
+                    _execute(
+                        "CREATE TRIGGER IF NOT EXISTS archived_message_search_fts_insert AFTER INSERT ON archived_message_search BEGIN "
+                        "INSERT INTO archived_message_search_fts(rowid, question, answer, user_id) "
+                        "VALUES (new.message_id, new.question, new.answer, new.user_id); END"
+                    ),
+                    _execute(
+                        "CREATE TRIGGER IF NOT EXISTS archived_message_search_fts_delete AFTER DELETE ON archived_message_search BEGIN "
+                        "INSERT INTO archived_message_search_fts(archived_message_search_fts, rowid, question, answer, user_id) "
+                        "VALUES ('delete', old.message_id, old.question, old.answer, old.user_id); END"
+                    ),
+                ),
+            ),
+            _index_archived_messages,
+        ),
+    ),
+    (
+        11,
+        "id as the tie-breaker column of the history and session listing indexes",
+        # Keyset pages compare (timestamp, id) and (updated_at, id); with id in
+        # the index, ties on the timestamp are resolved without a sort on Postgres
+        _steps(
+            _create_index("ix_chat_messages_session_id_timestamp_id", "chat_messages", "session_id", "timestamp", "id"),
+            _drop_index("ix_chat_messages_session_id_timestamp"),
+            _create_index("ix_chat_sessions_user_id_updated_at_id", "chat_sessions", "user_id", "updated_at", "id"),
+            _drop_index("ix_chat_sessions_user_id_updated_at"),
+        ),
+    ),
+    (
+        12,
+        "unique prompt version per prompt type",
+        _steps(
+            _renumber_duplicate_prompt_versions,
+            _create_index("uq_prompts_prompt_type_version", "prompts", "prompt_type", "version", unique=True),
+        ),
+    ),
+]
+
+
+# Advisory lock key serializing migrations across workers and hosts (Postgres)
+_MIGRATION_LOCK_KEY = 0x6272626F78  # "brbox"
+_LOCK_POLL_INTERVAL = 0.5
+
+
+@contextmanager
+def _migration_lock(conn: Connection) -> Iterator[bool]:
+    """
+    Hold the cross-process migration lock on conn
+
+    Postgres takes a session-level advisory lock, which survives the
+    per-migration commits. It is polled with pg_try_advisory_lock rather than
+    waited on, because a session blocked inside pg_advisory_lock holds a
+    snapshot that CREATE INDEX CONCURRENTLY would wait for. SQLite takes the
+    database write lock with BEGIN IMMEDIATE, which a commit releases, so
+    there everything runs in that one transaction.
+
+    Yields:
+        Whether each migration may commit on its own (False on SQLite)
+    """
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        while not conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": _MIGRATION_LOCK_KEY}):
+            conn.commit()
+            time.sleep(_LOCK_POLL_INTERVAL)
+        conn.commit()
+        try:
+            yield True
+        finally:
+            conn.rollback()
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _MIGRATION_LOCK_KEY})
+            conn.commit()
+    elif dialect == "sqlite":
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        yield False
+    else:
+        yield True
+
+
+def run_migrations(engine: Engine, metadata: Optional[MetaData] = None) -> List[int]:
+    """
+    Apply pending schema migrations in version order
+    
+    Safe to run from every worker at once: the work happens under a
+    cross-process lock, and the applied versions are read under it, so
+    exactly one worker applies each migration and the others find it
+    recorded. Each migration commits together with the row that records
+    it, so a failed step can simply be retried on the next start.
+    
+    Args:
+        engine: The engine to migrate
+        metadata: Model tables to create (if missing) under the same lock first
+        
+    Returns:
+        Versions applied by this call
+    """
+    newly_applied = []
+    with engine.connect() as conn:
+        with _migration_lock(conn) as commit_each:
+            _metadata.create_all(bind=conn)
+            if metadata is not None:
+                metadata.create_all(bind=conn)
+            applied = set(conn.scalars(select(schema_migrations.c.version)).all())
+            for version, description, step in sorted(MIGRATIONS, key=lambda migration: migration[0]):
+                if version in applied:
+                    continue
+                step(conn)
+                conn.execute(schema_migrations.insert().values(version=version, description=description))
+                if commit_each:
+                    conn.commit()
+                newly_applied.append(version)
+            conn.commit()
+    return newly_applied
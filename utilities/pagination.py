@@ -0,0 +1,64 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+
+# Page size limits for keyset-paginated endpoints
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursorError(Exception):
+    """Raised when a continuation token cannot be decoded"""
+
+
+def encode_cursor(position: datetime, row_id: int) -> str:
+    """
+    Encode a keyset position as an opaque continuation token
+    
+    Args:
+        position: Sort column value of the last row on the page
+        row_id: Primary key of the last row, used as tie-breaker
+        
+    Returns:
+        URL-safe token
+    """
+    payload = json.dumps({"p": position.isoformat(), "id": row_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    """
+    Decode a continuation token produced by encode_cursor
+    
+    Args:
+        token: The token, or None for the first page
+        
+    Returns:
+        Tuple of (position, row_id), or None for the first page
+    """
+    if not token:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        return datetime.fromisoformat(payload["p"]), int(payload["id"])
+    except (ValueError, KeyError, TypeError) as ex:
+        raise InvalidCursorError("Invalid pagination cursor") from ex
+
+
+def encode_rank_cursor(score: float, row_id: int) -> str:
+    """Encode a (relevance score, row_id) keyset position for ranked results"""
+    payload = json.dumps({"s": score, "id": row_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_rank_cursor(token: Optional[str]) -> Optional[Tuple[float, int]]:
+    """Decode a continuation token produced by encode_rank_cursor"""
+    if not token:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        return float(payload["s"]), int(payload["id"])
+    except (ValueError, KeyError, TypeError) as ex:
+        raise InvalidCursorError("Invalid pagination cursor") from ex
@@ -0,0 +1,240 @@
+import os
+import re
+import sys
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import Counter
+from contextvars import ContextVar, copy_context
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from utilities.logging_config import request_id_var
+
+
+# Requests slower than this are logged with their SQL statement count and DB time; 0 = off
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+# A request running the same statement this many times is logged as a likely N+1 pattern; 0 = off
+REPEATED_QUERY_THRESHOLD = int(os.getenv("REPEATED_QUERY_THRESHOLD", "10"))
+# Fraction of requests profiled at random
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# A request carrying "X-Profile: <PROFILE_TOKEN>" is profiled; unset = header ignored
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# Distinct statements remembered per request for the repeated-statement check
+_MAX_TRACKED_STATEMENTS = 500
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """SQL statements run on behalf of one request"""
+
+    __slots__ = ("queries", "db_seconds", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.statements: Counter = Counter()
+
+    def add(self, statement: str, seconds: float) -> None:
+        self.queries += 1
+        self.db_seconds += seconds
+        if statement in self.statements or len(self.statements) < _MAX_TRACKED_STATEMENTS:
+            self.statements[statement] += 1
+
+    def most_repeated(self) -> Optional[Any]:
+        """(statement, count) of the most often run statement, or None"""
+        top = self.statements.most_common(1)
+        return top[0] if top else None
+
+
+# Stats of the request being handled; async engines run their events in the
+# caller's context, so statements are attributed to the right request
+_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    if context is not None and _query_stats.get() is not None:
+        context._profiler_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    stats = _query_stats.get()
+    started = getattr(context, "_profiler_started", None)
+    if stats is not None and started is not None:
+        stats.add(statement, time.perf_counter() - started)
+
+
+def track_queries(engine: Engine) -> None:
+    """Count statements and time spent in the database per request on engine (the sync engine of an async one)"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _await_chain(awaitable: Any) -> List[str]:
+    """Frames of a suspended coroutine and everything it awaits, outermost first"""
+    stack = []
+    while awaitable is not None:
+        if isinstance(awaitable, asyncio.Task):
+            awaitable = awaitable.get_coro()
+            continue
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "ag_frame", None) or getattr(awaitable, "gi_frame", None)
+        if frame is None:
+            # A future, lock or other awaitable with no frame of its own
+            stack.append(f"[{type(awaitable).__name__}]")
+            break
+        stack.append(_frame_label(frame))
+        awaitable = (
+            getattr(awaitable, "cr_await", None) or getattr(awaitable, "ag_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+        )
+    return stack
+
+
+def _thread_stack(thread_id: int, root_code: Any) -> List[str]:
+    """Frames the thread is executing, outermost first, starting at the frame running root_code"""
+    frame = sys._current_frames().get(thread_id)
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame))
+        if frame.f_code is root_code:
+            # Leave out the event loop frames above the request's task
+            break
+        frame = frame.f_back
+    return stack[::-1]
+
+
+class _Sampler:
+    """
+    Wall-clock sampler for one request's task, run on its own thread
+
+    Each tick records where the request is: the executing Python stack when
+    its task is running on the event loop, otherwise the chain of awaits it
+    is suspended in (DB, LLM, lock waits). Time spent waiting therefore
+    shows up in the profile just like time spent computing.
+    """
+
+    def __init__(self, task: asyncio.Task, interval: float):
+        self.task = task
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._loop_thread = threading.get_ident()
+        self._stopped = threading.Event()
+        # Runs in a copy of the request's context so its log records carry the request ID
+        self._thread = threading.Thread(target=copy_context().run, args=(self._run,), name="request-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def _sample(self) -> None:
+        coro = self.task.get_coro()
+        if getattr(coro, "cr_running", False):
+            stack = _thread_stack(self._loop_thread, coro.cr_code)
+        else:
+            stack = _await_chain(coro)
+        if stack:
+            self.samples[";".join(stack)] += 1
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self._sample()
+            except Exception:
+                # Frames can change under the sampler; skip the tick
+                continue
+        try:
+            self._write_report()
+        except OSError as ex:
+            logger.error("request.profile_write_failed", extra={"report": self._report_path, "error": str(ex)})
+
+    def stop(self, report_path: str, summary: Dict[str, Any]) -> None:
+        """Stop sampling and write the report from the sampler thread, off the event loop"""
+        self._report_path, self._summary = report_path, summary
+        self._stopped.set()
+
+    def _write_report(self) -> None:
+        os.makedirs(os.path.dirname(self._report_path) or ".", exist_ok=True)
+        with open(self._report_path, "w") as report:
+            for stack, count in self.samples.most_common():
+                report.write(f"{stack} {count}\n")
+        logger.info("request.profiled", extra=dict(self._summary, report=self._report_path, samples=sum(self.samples.values())))
+
+
+def _should_profile(scope) -> bool:
+    if PROFILE_TOKEN:
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                return value.decode("latin-1") == PROFILE_TOKEN
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _report_path(method: str, path: str) -> str:
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_") or "root"
+    name = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{method}-{slug}-{request_id_var.get() or 'none'}.folded"
+    return os.path.join(PROFILE_DIR, name)
+
+
+class ProfilerMiddleware:
+    """
+    ASGI middleware counting each request's SQL statements and DB time
+
+    Requests slower than SLOW_REQUEST_MS are logged with their query counts,
+    and requests repeating one statement REPEATED_QUERY_THRESHOLD times or
+    more (the shape of an N+1 loop) are logged with that statement. Requests
+    picked by the X-Profile header or PROFILE_SAMPLE_RATE are also sampled
+    and written to PROFILE_DIR as collapsed stacks ("frame;frame;... count"
+    lines), which flamegraph.pl, speedscope and similar tools read directly.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = _query_stats.set(stats)
+        sampler = None
+        if _should_profile(scope):
+            sampler = _Sampler(asyncio.current_task(), PROFILE_INTERVAL_MS / 1000)
+            sampler.start()
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _query_stats.reset(token)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            summary = {
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": getattr(scope.get("route"), "path", None),
+                "status": status[0],
+                "duration_ms": round(elapsed_ms, 1),
+                "db_queries": stats.queries,
+                "db_ms": round(stats.db_seconds * 1000, 1),
+            }
+            if sampler is not None:
+                sampler.stop(_report_path(scope["method"], scope["path"]), summary)
+            if SLOW_REQUEST_MS and elapsed_ms >= SLOW_REQUEST_MS:
+                logger.warning("request.slow", extra=summary)
+            repeated = stats.most_repeated()
+            if REPEATED_QUERY_THRESHOLD and repeated and repeated[1] >= REPEATED_QUERY_THRESHOLD:
+                logger.warning("request.repeated_query", extra=dict(summary, statement=repeated[0], repeats=repeated[1]))
@@ -0,0 +1,69 @@
+import threading
+from string import Template
+from typing import Dict, Iterable, List, Optional, Any
+
+
+class PromptTemplate:
+    """A prompt template compiled once when it is loaded"""
+
+    def __init__(self, prompt_type: str, text: str, version: int = 0, prompt_id: Optional[int] = None):
+        self.prompt_type = prompt_type
+        self.version = version  # 0 means the built-in default
+        self.prompt_id = prompt_id
+        self.template = Template(text)
+        self.text = text
+
+    def render(self, **values: Any) -> str:
+        """Fill ${placeholders}; unknown placeholders are left as-is"""
+        if not values:
+            return self.text
+        return self.template.safe_substitute(values)
+
+
+# Active template per prompt_type. Replaced wholesale on reload so readers on
+# the chat hot path never take a lock or touch the database.
+_defaults: Dict[str, PromptTemplate] = {}
+_active: Dict[str, PromptTemplate] = {}
+_lock = threading.Lock()
+
+
+def register_default(prompt_type: str, text: str) -> None:
+    """Register the built-in template used until a version is stored in the prompts table"""
+    global _active
+    with _lock:
+        _defaults[prompt_type] = PromptTemplate(prompt_type, text)
+        if prompt_type not in _active:
+            _active = dict(_active, **{prompt_type: _defaults[prompt_type]})
+
+
+def get_prompt(prompt_type: str) -> PromptTemplate:
+    """Get the active template for a prompt type"""
+    return _active[prompt_type]
+
+
+def install(prompts: Iterable[Any]) -> None:
+    """
+    Replace the active templates with the given pinned prompt rows
+    
+    Prompt types without a stored version fall back to their built-in default.
+    """
+    global _active
+    compiled = {
+        prompt.prompt_type: PromptTemplate(prompt.prompt_type, prompt.prompt_text, prompt.version or 0, prompt.id)
+        for prompt in prompts
+    }
+    with _lock:
+        _active = dict(_defaults, **compiled)
+
+
+def active_ids() -> Dict[str, int]:
+    """Prompt ID of every active template loaded from the prompts table (built-in defaults are left out)"""
+    return {prompt.prompt_type: prompt.prompt_id for prompt in _active.values() if prompt.prompt_id is not None}
+
+
+def list_active() -> List[Dict[str, Any]]:
+    """Describe the active template for every prompt type"""
+    return [
+        {"prompt_type": prompt.prompt_type, "version": prompt.version, "prompt_id": prompt.prompt_id}
+        for prompt in _active.values()
+    ]